@@ -0,0 +1,388 @@
+"""Autosave journal and crash recovery.
+
+Every change to the document is appended to an on-disk journal as a small delta
+(position, removed length, inserted text, its formatting runs and the styles
+they use), so autosaving
+costs the size of the edit rather than the size of the document. A format change
+made through UndoHistory is journaled as the change itself (see format_change()),
+whatever the size of the range it covers. Once the journal has grown large, or
+after a while, it is compacted: the document's formatting is read a few
+milliseconds per turn of the event loop, starting over whenever the document is
+edited in between, and the snapshot is written on a FileSaver thread. A new
+journal continues from that snapshot.
+
+Each running editor keeps its journals in a session directory guarded by a
+QLockFile. A session directory whose lock can be taken belongs to an editor that
+did not exit cleanly, and its journals can be replayed on the next start.
+"""
+import os
+import json
+import time
+import shutil
+import itertools
+from contextlib import contextmanager
+from PySide6.QtCore import QObject, QTimer, QLockFile, QStandardPaths
+from PySide6.QtGui import QTextCursor as TextCursor, QTextCharFormat as TextCharFormat
+from file_saver import FileSaver, SaveSnapshot
+from text_formats import range_formatting, char_format_from_style_key, change_char_format, FormattingReader
+from txty_format import StyleTable, read_txty, read_plain_text, style_from_dict, style_from_mask
+
+autosave_directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation), "Texty", "autosave")
+flush_interval = 1000 # milliseconds
+compact_interval = 10 * 60 * 1000 # milliseconds
+compact_journal_size = 4 * 1024 * 1024 # bytes
+slice_duration = 0.008 # seconds of reading a snapshot's formatting per turn of the event loop
+lock_file_name = "session.lock"
+session_numbers = itertools.count(1) # tells apart the journals of one editor, one per open document
+
+
+class AutosaveJournal(QObject):
+    """Record the edits of one QTextDocument into a recoverable journal."""
+
+    def __init__(self, document, directory=autosave_directory, parent=None):
+        super().__init__(parent)
+        self.document = None
+        self.directory = directory
+        self.session_directory = os.path.join(directory, f"{os.getpid()}-{int(time.time() * 1000)}-{next(session_numbers)}")
+        self.session_lock = None
+
+        self.paused = False
+        self.format_operations = None # of the format change being made, see format_change()
+        self.pending = []
+        self.sequence = 0
+        self.journal_path = None
+        self.journal_size = 0
+        self.base = {"type": "empty"}
+        self.file_path = None
+        self.file_name = "Untitled"
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+        self.compact_timer = QTimer(self)
+        self.compact_timer.setInterval(compact_interval)
+        self.compact_timer.timeout.connect(self.compact)
+        self.compact_timer.start()
+
+        self.snapshot_reader = None # FormattingReader of the snapshot being read
+        self.snapshot_revision = None # document revision the snapshot is read at
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.setSingleShot(True)
+        self.snapshot_timer.setInterval(0)
+        self.snapshot_timer.timeout.connect(self.read_snapshot)
+
+        self.snapshot_saver = FileSaver(self)
+        self.snapshot_saver.saved.connect(self.on_snapshot_saved)
+
+        self.set_document(document)
+
+    def set_document(self, document):
+        """Follow another QTextDocument, or none while the document is unloaded."""
+        if self.document is not None:
+            self.flush()
+            self.document.contentsChange.disconnect(self.on_contents_change)
+        self.stop_snapshot()
+        self.document = document
+        if document is not None:
+            document.contentsChange.connect(self.on_contents_change)
+
+    @contextmanager
+    def format_change(self, operations):
+        """Journal the format change made inside as `operations` instead of reading the range it covers.
+
+        Each operation is (position, length, changes, replace) as in
+        UndoHistory.change_format(), made in the order given.
+        """
+        self.format_operations = operations
+        try:
+            yield
+        finally:
+            self.format_operations = None
+
+    def on_contents_change(self, position, removed, added):
+        if self.paused:
+            return
+        if self.format_operations is not None and removed == added:
+            operations, self.format_operations = self.format_operations, [] # Qt reports the edit block once
+            if not operations:
+                return
+            delta = {"o": [list(operation) for operation in operations]}
+        else:
+            text, styles, runs = self.read_range(position, added)
+            delta = {"p": position, "r": removed, "t": text}
+            if runs:
+                delta["s"] = styles
+                delta["f"] = runs
+        self.pending.append(delta)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def read_range(self, position, length):
+        # Text and non-default formatting runs of the inserted range, relative to its
+        # start; the runs index a style table of their own
+        end = min(position + length, self.document.characterCount() - 1)
+        if end <= position:
+            return "", [], []
+
+        cursor = TextCursor(self.document)
+        cursor.setPosition(position)
+        cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
+        text = cursor.selectedText().replace("\u2029", "\n")
+
+        table = StyleTable()
+        runs = [[offset, run_length, table.index(style)] for offset, run_length, style in range_formatting(self.document, position, end)]
+        return text, table.to_list(), runs
+
+    def reset(self, file_path=None, file_name="Untitled"):
+        """Start over from a state that needs no journal: an empty document or a file as it is on disk."""
+        self.pending = []
+        self.flush_timer.stop()
+        self.stop_snapshot()
+        self.snapshot_saver.flush()
+        self.remove_session_files()
+        self.journal_path = None
+        self.journal_size = 0
+        self.file_path = file_path
+        self.file_name = file_name
+        if file_path and os.path.exists(file_path):
+            stat = os.stat(file_path)
+            self.base = {"type": "file", "path": file_path, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+        else:
+            self.base = {"type": "empty"}
+
+    def flush(self):
+        self.write_pending()
+        if self.journal_size > compact_journal_size:
+            self.compact()
+
+    def write_pending(self):
+        if not self.pending:
+            return
+        if self.journal_path is None:
+            self.start_journal(self.base)
+
+        lines = "".join(json.dumps(delta, separators=(",", ":")) + "\n" for delta in self.pending)
+        self.pending = []
+        with open(self.journal_path, 'a', encoding="utf-8") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_size += len(lines)
+
+    def start_journal(self, base):
+        self.open_session()
+        self.sequence += 1
+        self.journal_path = os.path.join(self.session_directory, f"journal-{self.sequence:06d}.jsonl")
+        header = {"base": base, "file_path": self.file_path, "file_name": self.file_name, "created": time.time()}
+        with open(self.journal_path, 'w', encoding="utf-8") as file:
+            file.write(json.dumps(header) + "\n")
+        self.journal_size = 0
+
+    def open_session(self):
+        if self.session_lock is not None:
+            return
+        os.makedirs(self.session_directory, exist_ok=True)
+        self.session_lock = QLockFile(os.path.join(self.session_directory, lock_file_name))
+        self.session_lock.setStaleLockTime(0)
+        self.session_lock.tryLock(0)
+
+    def compact(self):
+        # The snapshot is read a slice at a time and written in the background; the journals
+        # it replaces are only removed once it is on disk, until then they still form a valid chain.
+        if self.document is None or self.snapshot_reader is not None:
+            return # unloaded, the journal is complete as it is, or a snapshot is already being read
+        self.write_pending()
+        if self.journal_path is None or self.journal_size == 0:
+            return
+        self.start_snapshot()
+
+    def start_snapshot(self):
+        self.snapshot_reader = FormattingReader(self.document)
+        self.snapshot_revision = self.document.revision()
+        self.snapshot_timer.start()
+
+    def stop_snapshot(self):
+        self.snapshot_timer.stop()
+        self.snapshot_reader = None
+
+    def read_snapshot(self):
+        if self.document.revision() != self.snapshot_revision:
+            self.start_snapshot() # edited in between, what was read is out of date
+            return
+        formatting = self.snapshot_reader.read(time.perf_counter() + slice_duration)
+        if formatting is None:
+            self.snapshot_timer.start()
+            return
+        self.snapshot_reader = None
+        # Every edit before this revision is journaled, the new journal starts at it
+        self.write_pending()
+        self.open_session()
+
+        self.sequence += 1
+        snapshot_path = os.path.join(self.session_directory, f"snapshot-{self.sequence:06d}.txty")
+        styles, formatting = formatting
+        self.snapshot_saver.submit(SaveSnapshot(
+            file_path=snapshot_path,
+            file_extension=".txty",
+            content=self.document.toPlainText(),
+            styles=styles,
+            formatting=formatting,
+            metadata={"title": self.file_name},
+            revision=self.sequence
+        ))
+        self.start_journal({"type": "snapshot", "path": os.path.basename(snapshot_path)})
+
+    def on_snapshot_saved(self, snapshot):
+        # For snapshots the revision carries the journal sequence number
+        for name in os.listdir(self.session_directory):
+            if 0 < session_file_sequence(name) < snapshot.revision:
+                os.remove(os.path.join(self.session_directory, name))
+
+    def adopt(self, session_directory, file_path=None, file_name="Untitled"):
+        """Continue the journals of a recovered session, so they stay recoverable until compacted."""
+        self.reset()
+        self.file_path = file_path
+        self.file_name = file_name
+        names = [name for name in os.listdir(session_directory) if session_file_sequence(name)]
+        if names:
+            self.open_session()
+            for name in names:
+                os.replace(os.path.join(session_directory, name), os.path.join(self.session_directory, name))
+            # The next journal continues where the adopted ones stop
+            self.sequence = max(session_file_sequence(name) for name in names)
+            self.base = {"type": "previous"}
+        shutil.rmtree(session_directory, ignore_errors=True)
+
+    def remove_session_files(self):
+        if not os.path.isdir(self.session_directory):
+            return
+        for name in os.listdir(self.session_directory):
+            if session_file_sequence(name):
+                os.remove(os.path.join(self.session_directory, name))
+
+    def discard(self):
+        """Forget the session on a clean exit."""
+        self.flush_timer.stop()
+        self.compact_timer.stop()
+        self.stop_snapshot()
+        self.snapshot_saver.flush()
+        self.pending = []
+        if self.session_lock is not None:
+            self.session_lock.unlock()
+            self.session_lock = None
+        shutil.rmtree(self.session_directory, ignore_errors=True)
+
+
+def remove_session(session_directory):
+    shutil.rmtree(session_directory, ignore_errors=True)
+
+
+def session_file_sequence(name):
+    stem, extension = os.path.splitext(name)
+    prefix, _, sequence = stem.partition("-")
+    if prefix in ("journal", "snapshot") and sequence.isdigit():
+        return int(sequence)
+    return 0
+
+
+def find_orphaned_sessions(directory=autosave_directory):
+    """Session directories left behind by editors that did not exit cleanly, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    sessions = []
+    for name in os.listdir(directory):
+        session_directory = os.path.join(directory, name)
+        if not os.path.isdir(session_directory):
+            continue
+        lock = QLockFile(os.path.join(session_directory, lock_file_name))
+        lock.setStaleLockTime(0) # only a dead owner makes a lock stale, not its age
+        if not lock.tryLock(0):
+            continue # still in use
+        lock.unlock()
+        if any(session_file_sequence(file_name) for file_name in os.listdir(session_directory)):
+            sessions.append(session_directory)
+        else:
+            shutil.rmtree(session_directory, ignore_errors=True)
+    return sorted(sessions, key=os.path.getmtime, reverse=True)
+
+
+def read_journal(journal_path):
+    with open(journal_path, 'r', encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        deltas = []
+        for line in file:
+            try:
+                deltas.append(json.loads(line))
+            except ValueError:
+                break # the last line was cut off by the crash
+    return header, deltas
+
+
+def load_base(session_directory, base):
+    """Content, styles and formatting a journal starts from, or None when it is no longer available."""
+    if base["type"] == "empty":
+        return "", [], []
+    if base["type"] == "snapshot":
+        path = os.path.join(session_directory, base["path"])
+        if os.path.exists(path):
+            data = read_txty(path)
+            return data["content"], data["styles"], data["formatting"]
+    if base["type"] == "file" and os.path.exists(base["path"]):
+        stat = os.stat(base["path"])
+        if stat.st_mtime_ns == base["mtime"] and stat.st_size == base["size"]:
+            if os.path.splitext(base["path"])[1].lower() == ".txty":
+                data = read_txty(base["path"])
+                return data["content"], data["styles"], data["formatting"]
+            return read_plain_text(base["path"]), [], []
+    return None
+
+
+def read_session(session_directory):
+    """Find the newest journal whose base still exists and everything written after it.
+
+    Returns (header, content, styles, formatting, deltas) or None when nothing can be recovered.
+    """
+    journals = sorted(name for name in os.listdir(session_directory) if name.startswith("journal-") and session_file_sequence(name))
+    for index in reversed(range(len(journals))):
+        header, deltas = read_journal(os.path.join(session_directory, journals[index]))
+        base = load_base(session_directory, header["base"])
+        if base is None:
+            continue
+        for name in journals[index + 1:]:
+            deltas.extend(read_journal(os.path.join(session_directory, name))[1])
+        content, styles, formatting = base
+        last_header = read_journal(os.path.join(session_directory, journals[-1]))[0]
+        return last_header, content, styles, formatting, deltas
+    return None
+
+
+def apply_deltas(document, deltas):
+    """Replay journal deltas on a document, as a single edit block."""
+    cursor = TextCursor(document)
+    cursor.beginEditBlock()
+    for delta in deltas:
+        end_position = document.characterCount() - 1
+        for position, length, changes, replace in delta.get("o", []):
+            cursor.setPosition(min(position, end_position))
+            cursor.setPosition(min(position + length, end_position), TextCursor.MoveMode.KeepAnchor)
+            if replace:
+                cursor.setCharFormat(change_char_format(changes, replace=True))
+            else:
+                cursor.mergeCharFormat(change_char_format(changes))
+        if "o" in delta:
+            continue # a format change made through UndoHistory
+        start = min(delta["p"], end_position)
+        cursor.setPosition(start)
+        cursor.setPosition(min(delta["p"] + delta["r"], end_position), TextCursor.MoveMode.KeepAnchor)
+        cursor.insertText(delta["t"], TextCharFormat())
+
+        # Journals written before the style table carry a bold/italic/underline bitmask instead
+        styles = [style_from_dict(style_data) for style_data in delta["s"]] if "s" in delta else None
+        for offset, length, style in delta.get("f", []):
+            char_format = char_format_from_style_key(styles[style] if styles is not None else style_from_mask(style))
+            cursor.setPosition(start + offset)
+            cursor.setPosition(start + offset + length, TextCursor.MoveMode.KeepAnchor)
+            cursor.setCharFormat(char_format)
+    cursor.endEditBlock()
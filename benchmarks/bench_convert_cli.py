@@ -0,0 +1,50 @@
+"""Throughput of the txty_cli batch commands in files per second and MB per second.
+
+Usage: python benchmarks/bench_convert_cli.py [--files 500] [--size 64] [--density dense] [--jobs 1 4]
+Size is in KB per file. Every command runs over the same generated files once per
+job count; no Qt is imported.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txty_cli import collect_tasks, run_batch
+from txty_format import write_txty, encode_plain_text, write_bytes_atomic
+from synthetic import generate_document
+
+
+def run(file_count, size, density, job_counts):
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = os.path.join(directory, "inputs")
+        os.makedirs(inputs)
+        for index in range(file_count):
+            data = generate_document(size * 1024, density, seed=index)
+            write_txty(os.path.join(inputs, f"document-{index:05d}.txty"), data["content"], data["styles"], data["formatting"], data["metadata"])
+            write_bytes_atomic(os.path.join(inputs, f"document-{index:05d}.txt"), encode_plain_text(data["content"]))
+
+        for jobs in job_counts:
+            for command in ("validate", "to-txt", "to-txty", "to-html", "to-md"):
+                output = os.path.join(directory, f"{command}-{jobs}")
+                tasks = collect_tasks(command, [inputs], output)
+                started = time.perf_counter()
+                results = run_batch(tasks, jobs)
+                elapsed = time.perf_counter() - started
+                failed = sum(1 for result in results if result.error or result.problems)
+                megabytes = sum(result.size for result in results) / 1024 / 1024
+                print(f"jobs={jobs:<3} {command:<9} files={len(tasks):<6} {megabytes:8.1f} MB {elapsed:7.2f}s "
+                      f"{len(tasks) / elapsed:9.1f} files/s {megabytes / elapsed:8.1f} MB/s"
+                      + (f" failed={failed}" if failed else ""), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--size", type=int, default=64, help="KB per file")
+    parser.add_argument("--density", default="dense")
+    parser.add_argument("--jobs", nargs="+", type=int, default=sorted({1, os.cpu_count() or 1}))
+    arguments = parser.parse_args()
+    run(arguments.files, arguments.size, arguments.density, arguments.jobs)
@@ -0,0 +1,78 @@
+"""Benchmark typing latency with and without syntax highlighting on a large log.
+
+Usage: python benchmarks/bench_highlighting.py [--lines 20000 500000] [--rule-sets Log JSON] [--keys 20]
+Each key is timed until its event turn is done, the highlighter's idle slices
+included. Runs Qt offscreen, so no display is required.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6 import QtWidgets as Widgets
+from PySide6.QtTest import QTest
+
+import main
+
+levels = ["INFO", "DEBUG", "WARN", "ERROR"]
+
+
+def generate_log(lines, seed=0):
+    rnd = random.Random(seed)
+    return "\n".join(f"2024-05-01 12:{i % 60:02d}:{i % 60:02d},123 {rnd.choice(levels)} worker-{i % 7} "
+                     f"request {i} done in {rnd.randint(1, 999)} ms" for i in range(lines))
+
+
+def time_keys(app, window, keys):
+    edit = window.text_edit_field
+    document = edit.document()
+    cursor = edit.textCursor()
+    cursor.setPosition(document.findBlockByNumber(10).position())
+    edit.setTextCursor(cursor)
+    latencies = []
+    for character in ("ERROR " * keys)[:keys]:
+        started = time.perf_counter()
+        QTest.keyClick(edit, character)
+        app.processEvents()
+        latencies.append(time.perf_counter() - started)
+    for _ in range(keys):
+        document.undo()
+    app.processEvents()
+    return latencies
+
+
+def run(line_counts, rule_sets, keys):
+    app = Widgets.QApplication.instance() or Widgets.QApplication(sys.argv)
+    window = main.MainWindow()
+    window.resize(1200, 800)
+    window.show()
+
+    for lines in line_counts:
+        window.load_formatted_content(generate_log(lines), [], [])
+        app.processEvents()
+        for name in [None] + rule_sets:
+            started = time.perf_counter()
+            window.set_highlighting(name)
+            while window.highlighter.timer.isActive():
+                app.processEvents()
+            switch_time = time.perf_counter() - started
+            latencies = time_keys(app, window, keys)
+            print(f"{lines:>8} lines {name or 'None':<9} switch={switch_time:7.3f}s "
+                  f"key mean={sum(latencies) / len(latencies) * 1000:8.2f} ms max={max(latencies) * 1000:8.2f} ms", flush=True)
+
+    window.set_highlighting(None)
+    window.document_modified = False
+    window.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", nargs="+", type=int, default=[20000, 500000])
+    parser.add_argument("--rule-sets", nargs="+", default=["Log", "JSON"])
+    parser.add_argument("--keys", type=int, default=20)
+    arguments = parser.parse_args()
+    run(arguments.lines, arguments.rule_sets, arguments.keys)
@@ -0,0 +1,82 @@
+"""Benchmark applying .txty formatting on open: legacy per-run loop vs bulk load.
+
+Usage: python benchmarks/bench_open_formatting.py [--sizes 1 10] [--densities sparse dense] [--skip-legacy]
+Sizes are in MB. Runs Qt offscreen, so no display is required.
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6 import QtWidgets as Widgets
+from PySide6.QtGui import QFont as Font, QTextCursor as TextCursor, QTextCharFormat as TextCharFormat
+
+import main
+from synthetic import generate_document
+
+
+def legacy_load(window, content, styles, formatting):
+    """The open_file loop as it was before the bulk load path."""
+    window.clear_formatting()
+    window.text_edit_field.setPlainText(content)
+
+    cursor = window.text_edit_field.textCursor()
+    for format_data in formatting:
+        start, end = format_data["range"]
+        style_data = styles[format_data["style"]]
+        cursor.setPosition(start)
+        cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
+        char_format = TextCharFormat()
+
+        if style_data.get("bold", False):
+            char_format.setFontWeight(Font.Bold)
+
+        if style_data.get("italic", False):
+            char_format.setFontItalic(True)
+
+        if style_data.get("underline", False):
+            char_format.setFontUnderline(True)
+
+        cursor.setCharFormat(char_format)
+    window.document_modified = False
+
+
+def timed_load(app, load, window, data):
+    started = time.perf_counter()
+    load(window, data["content"], data["styles"], data["formatting"])
+    app.processEvents()  # include the pending relayout and repaint
+    return time.perf_counter() - started
+
+
+def run(sizes, densities, skip_legacy=False):
+    app = Widgets.QApplication.instance() or Widgets.QApplication(sys.argv)
+    window = main.MainWindow()
+    window.show()
+
+    for size in sizes:
+        for density in densities:
+            data = generate_document(int(size * 1024 * 1024), density)
+            bulk_time = timed_load(app, main.MainWindow.load_formatted_content, window, data)
+            expected = window.get_formatting()
+            line = f"{size:>5} MB {density:<7} runs={len(data['formatting']):<9} bulk={bulk_time:8.3f}s"
+
+            if not skip_legacy:
+                legacy_time = timed_load(app, legacy_load, window, data)
+                same = window.get_formatting() == expected
+                line += f" legacy={legacy_time:8.3f}s speedup={legacy_time / bulk_time:6.1f}x identical={same}"
+            print(line, flush=True)
+
+    window.document_modified = False
+    window.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 10])
+    parser.add_argument("--densities", nargs="+", default=["sparse", "dense"])
+    parser.add_argument("--skip-legacy", action="store_true")
+    arguments = parser.parse_args()
+    run(arguments.sizes, arguments.densities, arguments.skip_legacy)
@@ -0,0 +1,90 @@
+"""Benchmark saving .txty documents: formatting extraction and write time.
+
+Usage: python benchmarks/bench_save_formatting.py [--sizes 1 10 50] [--densities sparse dense]
+Sizes are in MB. Runs Qt offscreen, so no display is required.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6 import QtWidgets as Widgets
+from PySide6.QtGui import QFont as Font, QTextCursor as TextCursor, QTextCharFormat as TextCharFormat
+
+import main
+from synthetic import generate_document
+
+
+def fill_editor(window, data):
+    """Insert content run by run, so setup cost does not depend on the code under test."""
+    document = window.text_edit_field.document()
+    document.clear()
+    cursor = TextCursor(document)
+    cursor.beginEditBlock()
+    content = data["content"]
+    for format_data in data["formatting"]:
+        start, end = format_data["range"]
+        style_data = data["styles"][format_data["style"]]
+        char_format = TextCharFormat()
+        char_format.setFontWeight(Font.Bold if style_data.get("bold") else Font.Normal)
+        char_format.setFontItalic(style_data.get("italic", False))
+        char_format.setFontUnderline(style_data.get("underline", False))
+        cursor.insertText(content[start:end], char_format)
+    cursor.endEditBlock()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(sizes, densities):
+    app = Widgets.QApplication.instance() or Widgets.QApplication(sys.argv)
+    window = main.MainWindow()
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for density in densities:
+                data = generate_document(int(size * 1024 * 1024), density)
+                fill_editor(window, data)
+                app.processEvents()
+
+                started = time.perf_counter()
+                _, runs = window.get_formatting()
+                extract_time = time.perf_counter() - started
+
+                path = os.path.join(directory, f"bench-{size}-{density}.txty")
+                started = time.perf_counter()
+                window.write_file(path)
+                window.file_saver.flush() # the write itself happens on the FileSaver thread
+                save_time = time.perf_counter() - started
+
+                # Memory is measured in a second pass, tracing slows the timed one down
+                tracemalloc.start()
+                window.write_file(path)
+                window.file_saver.flush()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                results.append((size, density, len(runs), extract_time, save_time, peak / 1024 / 1024, peak_rss_mb()))
+                print(f"{size:>5} MB {density:<7} runs={len(runs):<9} get_formatting={extract_time:8.3f}s "
+                      f"save={save_time:8.3f}s python_peak={peak / 1024 / 1024:8.1f} MB rss_peak={peak_rss_mb():8.1f} MB",
+                      flush=True)
+
+    window.document_modified = False
+    window.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 10, 50])
+    parser.add_argument("--densities", nargs="+", default=["sparse", "dense"])
+    arguments = parser.parse_args()
+    run(arguments.sizes, arguments.densities)
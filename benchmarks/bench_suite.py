@@ -0,0 +1,223 @@
+"""End-to-end benchmark suite: open, edit, format and save synthetic documents in a headless MainWindow.
+
+Usage: python benchmarks/bench_suite.py [--sizes 1 5] [--densities sparse dense] [--repeat 3]
+                                        [--baseline benchmarks/baseline.json] [--save-baseline] [--tolerance 0.25]
+
+Every scenario, a generated .txt or a .txty of a given size (MB) and formatting
+density, runs in a process of its own with Qt offscreen and empty config, data
+and cache directories, so no session, recovery prompt, recent file snapshot or
+earlier scenario can skew it and the peak RSS belongs to that scenario alone. The median of the repeats
+is compared with the baseline: a metric that grew by more than the tolerance
+(and by more than a small absolute margin, so that noise on tiny timings does
+not count) is reported as a regression and the exit status is 1. Baselines only
+mean something on the machine that wrote them, --save-baseline writes one.
+Without a baseline, or with scenarios it does not have, the suite fails too
+rather than passing with nothing compared.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_document
+from txty_format import write_txty, encode_plain_text, write_bytes_atomic
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+typed_text = "The quick brown fox "
+edit_positions = 5 # places in the document where typed_text is typed
+format_length = 10_000 # characters selected for each format toggle
+absolute_margins = {"s": 0.005, "bytes": 8 * 1024 * 1024} # growth below this is never a regression
+informational_metrics = {"key max"} # reported, too noisy to fail a run on
+
+
+def metric_unit(name):
+    return "bytes" if name.endswith("rss") else "s"
+
+
+def scenario_name(extension, size, density):
+    return f"{extension[1:]}-{size:g}MB" + (f"-{density}" if extension == ".txty" else "")
+
+
+def write_inputs(directory, sizes, densities):
+    """Generate the input files, returns (scenario name, path) in run order."""
+    scenarios = []
+    for size in sizes:
+        data = generate_document(int(size * 1024 * 1024), "none")
+        path = os.path.join(directory, scenario_name(".txt", size, None) + ".txt")
+        write_bytes_atomic(path, encode_plain_text(data["content"]))
+        scenarios.append((scenario_name(".txt", size, None), path))
+        for density in densities:
+            data = generate_document(int(size * 1024 * 1024), density)
+            name = scenario_name(".txty", size, density)
+            path = os.path.join(directory, name + ".txty")
+            write_txty(path, data["content"], data["styles"], data["formatting"], data["metadata"])
+            scenarios.append((name, path))
+    return scenarios
+
+
+def run_scenario(input_path, output_directory):
+    import resource
+    import time
+    from PySide6 import QtWidgets as Widgets
+    from PySide6.QtGui import QTextCursor as TextCursor
+    from PySide6.QtTest import QTest
+    import main
+    from instrumentation import metrics
+
+    app = Widgets.QApplication.instance() or Widgets.QApplication(sys.argv[:1])
+    window = main.MainWindow()
+    window.resize(1200, 800)
+    window.show()
+    app.processEvents()
+    metrics.enabled = True # phase timings from the editor's own instrumentation
+    results = {}
+
+    started = time.perf_counter()
+    window.open_path(input_path)
+    while window.file_loader is not None:
+        app.processEvents()
+    app.processEvents()
+    results["open"] = time.perf_counter() - started
+
+    edit = window.text_edit_field
+    document = edit.document()
+    edit.setFocus()
+    latencies = []
+    for index in range(edit_positions):
+        cursor = edit.textCursor()
+        cursor.setPosition(document.characterCount() * index // edit_positions)
+        edit.setTextCursor(cursor)
+        for character in typed_text:
+            key_started = time.perf_counter()
+            QTest.keyClick(edit, character)
+            app.processEvents()
+            latencies.append(time.perf_counter() - key_started)
+    results["key mean"] = sum(latencies) / len(latencies)
+    results["key max"] = max(latencies)
+
+    started = time.perf_counter()
+    for toggle in (window.make_bold, window.make_italic, window.make_underline, window.make_bold):
+        cursor = TextCursor(document)
+        cursor.setPosition(document.characterCount() // 3)
+        cursor.setPosition(min(document.characterCount() - 1, cursor.position() + format_length), TextCursor.MoveMode.KeepAnchor)
+        edit.setTextCursor(cursor)
+        toggle()
+        app.processEvents()
+    results["format toggles"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    window.get_formatting()
+    results["get_formatting"] = time.perf_counter() - started
+
+    for extension in (".txty", ".txt"):
+        started = time.perf_counter()
+        window.write_file(os.path.join(output_directory, "saved" + extension))
+        window.file_saver.flush()
+        app.processEvents()
+        results[f"save {extension[1:]}"] = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak rss"] = peak if sys.platform == "darwin" else peak * 1024
+    phases = {summary["name"]: summary["total"] for summary in metrics.summaries() if summary["unit"] == "s"}
+
+    for tab in window.tabs:
+        tab.modified = False
+    window.document_modified = False
+    return {"metrics": results, "phases": phases}
+
+
+def run_in_child(input_path):
+    # Fresh process and fresh Qt config/data/cache directories per run
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, QT_QPA_PLATFORM="offscreen",
+                           XDG_CONFIG_HOME=os.path.join(directory, "config"), XDG_DATA_HOME=os.path.join(directory, "data"),
+                           XDG_CACHE_HOME=os.path.join(directory, "cache"))
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", input_path, directory],
+                                   env=environment, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"scenario {os.path.basename(input_path)} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def compare(results, baseline, tolerance):
+    """Regressions as (scenario, metric, baseline value, current value)."""
+    regressions = []
+    for name, scenario_metrics in results.items():
+        for metric, value in scenario_metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if expected is None or metric in informational_metrics:
+                continue
+            if value > expected * (1 + tolerance) and value - expected > absolute_margins[metric_unit(metric)]:
+                regressions.append((name, metric, expected, value))
+    return regressions
+
+
+def format_metric(metric, value):
+    if metric_unit(metric) == "bytes":
+        return f"{value / 1024 / 1024:8.1f} MB"
+    return f"{value * 1000:8.1f} ms"
+
+
+def run(sizes, densities, repeat, baseline_path, save_baseline, tolerance):
+    if not save_baseline and not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}, write one with --save-baseline", file=sys.stderr)
+        return 2
+
+    results = {}
+    phases = {} # per scenario, the instrumentation's phase totals, kept with a saved baseline for reference
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in write_inputs(directory, sizes, densities):
+            runs = [run_in_child(path) for _ in range(repeat)]
+            results[name] = {metric: median([run["metrics"][metric] for run in runs]) for metric in runs[0]["metrics"]}
+            phases[name] = {phase: median([run["phases"].get(phase, 0) for run in runs]) for phase in runs[0]["phases"]}
+            print(f"{name:<20} " + "  ".join(f"{metric}={format_metric(metric, value).strip()}"
+                                              for metric, value in results[name].items()), flush=True)
+
+    if save_baseline:
+        with open(baseline_path, 'w', encoding="utf-8") as file:
+            json.dump({"scenarios": results, "phases": phases, "repeat": repeat}, file, indent=2)
+        print(f"Baseline written to {baseline_path}")
+        return 0
+
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)["scenarios"]
+    missing = [name for name in results if name not in baseline]
+    for name in missing:
+        print(f"NOT IN BASELINE {name}, write a new one with --save-baseline", file=sys.stderr)
+    regressions = compare(results, baseline, tolerance)
+    for name, metric, expected, value in regressions:
+        print(f"REGRESSION {name:<20} {metric:<15} {format_metric(metric, expected)} -> {format_metric(metric, value)} "
+              f"({(value / expected - 1) * 100:+.0f}%)", file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {tolerance:.0%} against {baseline_path}", file=sys.stderr)
+    if regressions or missing:
+        return 1
+    print(f"No regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run-scenario":
+        print(json.dumps(run_scenario(sys.argv[2], sys.argv[3])))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 5], help="MB per document")
+    parser.add_argument("--densities", nargs="+", default=["sparse", "dense"])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the median is kept")
+    parser.add_argument("--baseline", default=default_baseline)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth, 0.25 is 25%%")
+    arguments = parser.parse_args()
+    sys.exit(run(arguments.sizes, arguments.densities, arguments.repeat, arguments.baseline,
+                 arguments.save_baseline, arguments.tolerance))
@@ -0,0 +1,49 @@
+"""Compare .txty versions 1 (JSON), 2 (binary) and 3 (binary with a style table): file size, save and load time.
+
+Usage: python benchmarks/bench_txty_format.py [--sizes 1 10 50] [--densities sparse dense] [--rich]
+Sizes are in MB. --rich gives the styles fonts, sizes and colours as well, which
+version 2 cannot store. Needs no Qt, the codec is exercised directly.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txty_format import read_txty, write_txty
+from synthetic import generate_document
+
+
+def timed(function, *arguments, **keywords):
+    started = time.perf_counter()
+    result = function(*arguments, **keywords)
+    return result, time.perf_counter() - started
+
+
+def run(sizes, densities, rich=False):
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for density in densities:
+                data = generate_document(int(size * 1024 * 1024), density, rich=rich)
+                line = f"{size:>5} MB {density:<7} runs={len(data['formatting']):<9} styles={len(data['styles']):<4}"
+                for version in (1, 2, 3):
+                    path = os.path.join(directory, f"bench-v{version}.txty")
+                    _, save_time = timed(write_txty, path, data["content"], data["styles"], data["formatting"], data["metadata"], version=version)
+                    loaded, load_time = timed(read_txty, path)
+                    assert loaded["content"] == data["content"]
+                    if version != 2 or not rich:
+                        assert loaded["styles"] == data["styles"] and loaded["formatting"] == data["formatting"]
+                    line += (f" | v{version} size={os.path.getsize(path) / 1024 / 1024:8.2f} MB"
+                             f" save={save_time:7.3f}s load={load_time:7.3f}s")
+                print(line, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 10, 50])
+    parser.add_argument("--densities", nargs="+", default=["sparse", "dense"])
+    parser.add_argument("--rich", action="store_true")
+    arguments = parser.parse_args()
+    run(arguments.sizes, arguments.densities, arguments.rich)
@@ -0,0 +1,66 @@
+"""Synthetic document generator shared by the benchmark scripts."""
+import random
+from txty_format import StyleTable, plain_style
+
+words = ("lorem", "ipsum", "dolor", "sit", "amet", "texty", "toolbox", "format",
+         "bold", "italic", "underline", "window", "editor", "benchmark", "run")
+
+fonts = (None, "Arial", "Courier New", "Georgia")
+sizes = (None, 10, 12, 14.5, 18)
+colors = (None, "#000000", "#c0392b", "#2e86c1", "#80f1c40f")
+
+# Average number of characters per formatting run
+densities = {
+    "none": None,
+    "sparse": 10_000,
+    "dense": 24,
+}
+
+
+def generate_content(size, seed=0):
+    """Generate roughly `size` characters of word-wrapped plain text."""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        line = " ".join(rng.choice(words) for _ in range(rng.randint(4, 16)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def generate_formatting(length, density="sparse", seed=0, rich=False):
+    """Generate contiguous formatting runs and their style table in the .txty layout.
+
+    Styles use bold, italic and underline only, unless `rich` adds fonts, sizes,
+    colours and highlights to them.
+    """
+    run_length = densities[density]
+    if not run_length:
+        return ([{}], [{"style": 0, "range": [0, length]}]) if length else ([], [])
+
+    rng = random.Random(seed)
+    table = StyleTable()
+    formatting = []
+    position = 0
+    while position < length:
+        end = min(length, position + rng.randint(1, run_length * 2))
+        mask = rng.randrange(8)
+        style = (bool(mask & 1), bool(mask & 2), bool(mask & 4)) + plain_style[3:]
+        if rich:
+            style = style[:3] + (rng.choice(fonts), rng.choice(sizes), rng.choice(colors), rng.choice(colors))
+        formatting.append({"style": table.index(style), "range": [position, end]})
+        position = end
+    return table.to_list(), formatting
+
+
+def generate_document(size, density="sparse", seed=0, rich=False):
+    """Return a .txty style dict with content, styles and formatting."""
+    content = generate_content(size, seed)
+    styles, formatting = generate_formatting(len(content), density, seed, rich)
+    return {
+        "metadata": {"title": f"synthetic-{size}-{density}.txty"},
+        "content": content,
+        "styles": styles,
+        "formatting": formatting
+    }
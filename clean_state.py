@@ -0,0 +1,161 @@
+"""Recognising a document edited back to its saved text by hand.
+
+When a document is marked unmodified, a short digest of every block (its text
+and styled runs) is taken, a few milliseconds per turn of the event loop, so a
+large file does not hold up the editor after it has been opened or saved.
+
+Every change Qt reports then only moves two bounds: how far from the start and
+how far from the end the document is still untouched. When the document has
+its saved length again, only the blocks between those bounds are digested and
+compared with the saved ones; the blocks before and after them are the saved
+blocks themselves. A change made before the saved blocks have all been digested
+leaves nothing to compare with, and the document stays modified until undone
+to its saved state or saved.
+"""
+import time
+from array import array
+from PySide6.QtCore import QObject, QTimer
+from text_formats import style_key
+
+slice_duration = 0.008 # seconds of digesting saved blocks per turn of the event loop
+compare_limit = 256 * 1024 # characters between the untouched start and end digested at most, longer edits stay modified
+
+
+class BlockDigests:
+    """Digests of consecutive blocks' text and styled runs, one format index's style looked up once.
+
+    A digest is Python's hash() of the block, only ever compared within one run of the editor.
+    """
+
+    def __init__(self):
+        self.styles = {} # char format index -> style
+
+    def digest(self, block):
+        # Fragments of the same style are joined, how Qt happens to split the text does not count
+        runs = []
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            style = self.styles.get(fragment.charFormatIndex())
+            if style is None:
+                style = self.styles[fragment.charFormatIndex()] = style_key(fragment.charFormat())
+            if not runs or runs[-1][1] != style:
+                runs.append((fragment.position() - block.position(), style))
+            iterator += 1
+        return hash((block.text(), tuple(runs)))
+
+
+class CleanState(QObject):
+    """The saved state of one QTextDocument, to compare the document with."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = None
+        self.paused = False # set while the document is replaced as a whole, it is marked clean or modified after
+        self.length = None # characterCount() of the saved state
+        self.block_count = 0
+        self.digests = None # array of one digest per saved block, None while not known
+        self.next_block = None # the block to digest next while the saved blocks are being digested
+        self.block_digests = None
+        self.head = None # characters at the start untouched since the saved state, None for all of them
+        self.tail = None # characters at the end untouched since the saved state
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.digest_pending)
+
+    def set_document(self, document):
+        """Follow another QTextDocument, or none while the document is unloaded. What was saved is kept."""
+        if self.document is not None:
+            self.document.contentsChange.disconnect(self.on_contents_change)
+        self.document = document
+        self.stop_digesting()
+        if document is not None:
+            document.contentsChange.connect(self.on_contents_change)
+
+    def mark_clean(self):
+        """Take the document as it is now as the saved state."""
+        self.forget()
+        if self.document is None:
+            return
+        self.length = self.document.characterCount()
+        self.block_count = self.document.blockCount()
+        self.digests = array("q")
+        self.next_block = self.document.begin()
+        self.block_digests = BlockDigests()
+        self.timer.start()
+
+    def forget(self):
+        self.stop_digesting()
+        self.length = None
+        self.digests = None
+        self.head = self.tail = None
+
+    def keep(self):
+        """What is known about the saved state, to restore() into a document loaded again with the same content."""
+        return self.length, self.block_count, self.digests, self.head, self.tail
+
+    def restore(self, kept):
+        self.stop_digesting()
+        self.length, self.block_count, self.digests, self.head, self.tail = kept
+
+    def stop_digesting(self):
+        self.timer.stop()
+        if self.next_block is not None:
+            self.digests = None # only part of the saved blocks, nothing to compare with
+        self.next_block = None
+        self.block_digests = None
+
+    def digest_pending(self):
+        deadline = time.perf_counter() + slice_duration
+        block, block_digests = self.next_block, self.block_digests
+        while block.isValid():
+            self.digests.append(block_digests.digest(block))
+            block = block.next()
+            if time.perf_counter() > deadline:
+                break
+        if block.isValid():
+            self.next_block = block
+            self.timer.start()
+        else:
+            self.next_block = None
+            self.block_digests = None
+
+    def on_contents_change(self, position, removed, added):
+        if self.paused or not (removed or added) or self.length is None:
+            return
+        if self.next_block is not None:
+            self.stop_digesting() # the saved state is gone before it was all digested
+        self.head = position if self.head is None else min(self.head, position)
+        # Text after the change keeps its distance from the end
+        tail = self.document.characterCount() - (position + added)
+        self.tail = tail if self.tail is None else min(self.tail, tail)
+
+    def matches(self):
+        """Whether the document has the saved text and formats again, looking only at the blocks edited since."""
+        document = self.document
+        if document is None or self.digests is None or self.next_block is not None:
+            return False
+        if document.characterCount() != self.length or document.blockCount() != self.block_count:
+            return False
+        if self.head is None:
+            return True
+        end = self.length - 1 - self.tail
+        if end - self.head > compare_limit:
+            return False
+        first = document.findBlock(self.head)
+        last = document.findBlock(max(self.head, end))
+        if not last.isValid():
+            last = document.lastBlock()
+        block_digests = BlockDigests()
+        number = first.blockNumber()
+        block = first
+        while True:
+            if block_digests.digest(block) != self.digests[number]:
+                return False
+            if block == last:
+                break
+            block = block.next()
+            number += 1
+        self.head = self.tail = None # all of it is the saved state again
+        return True
@@ -0,0 +1,126 @@
+"""Per-document state of the tabbed editor.
+
+A DocumentTab owns a QTextDocument only while it is loaded. When the loaded
+documents grow past the memory budget, tabs that are not visible are unloaded:
+an unmodified file is dropped and read from disk again when its tab is shown,
+anything else is kept as zlib-compressed binary .txty bytes of the current
+version. Tabs restored from a previous session start out unloaded, so only the
+visible one is read.
+"""
+import os
+import zlib
+import itertools
+from PySide6.QtGui import QTextDocument
+from autosave import AutosaveJournal
+from file_saver import FileSaver
+from highlighting import Highlighter
+from undo_history import UndoHistory
+from clean_state import CleanState
+from text_formats import document_formatting
+from txty_format import encode_binary_txty, decode_binary_txty
+
+memory_budget = 512 * 1024 * 1024 # bytes, estimated size of all loaded documents before hidden tabs are unloaded
+block_overhead = 200 # bytes, rough cost of a text block besides its characters
+compression_level = 1 # the packed form only lives in memory, fast beats small
+activation_counter = itertools.count(1)
+
+
+class DocumentTab:
+    """One open document and everything that belongs to it rather than to the window."""
+
+    def __init__(self, parent, file_path=None, file_name="Untitled"):
+        self.parent = parent # QObject that owns the document, journal and saver
+        self.file_path = file_path
+        self.file_name = file_name
+        self.document = None
+        self.packed = None # compressed .txty bytes while unloaded in memory
+        self.large_file_view = None
+        self.text_encoding = None # TextEncoding of the .txt file the text was read from, None for the default
+
+        self.modified = False
+        self.edit_revision = 0 # bumped on every change, tells whether a finished save is still current
+        self.cursor_position = 0
+        self.scroll_position = 0
+        self.last_activated = 0
+
+        self.file_saver = FileSaver(parent)
+        self.autosave_journal = AutosaveJournal(None, parent=parent)
+        self.highlighter = Highlighter(parent)
+        self.undo_history = UndoHistory(parent)
+        self.undo_history.format_journal = self.autosave_journal.format_change
+        self.clean_state = CleanState(parent)
+
+    def is_loaded(self):
+        return self.document is not None
+
+    def is_pristine(self):
+        """An untitled, empty and unchanged tab that opening a file may reuse."""
+        return (self.file_path is None and not self.modified and self.large_file_view is None
+                and self.packed is None and (self.document is None or self.document.isEmpty()))
+
+    def activate(self):
+        self.last_activated = next(activation_counter)
+
+    def create_document(self, font):
+        self.document = QTextDocument(self.parent)
+        self.document.setDefaultFont(font)
+        self.autosave_journal.set_document(self.document)
+        self.highlighter.set_document(self.document)
+        self.undo_history.set_document(self.document)
+        self.clean_state.set_document(self.document)
+        return self.document
+
+    def estimated_size(self):
+        if self.document is None:
+            return 0
+        return self.document.characterCount() * 2 + self.document.blockCount() * block_overhead
+
+    def unload(self):
+        """Free the document, keeping only what is needed to show it again."""
+        if self.document is None:
+            return
+        on_disk = self.file_path is not None and not self.modified and os.path.exists(self.file_path)
+        if not on_disk:
+            data = encode_binary_txty(self.document.toPlainText(), *document_formatting(self.document))
+            self.packed = zlib.compress(data, compression_level)
+        self.release_document()
+
+    def unpack(self):
+        """Content, styles and formatting of a tab unloaded in memory."""
+        data = decode_binary_txty(zlib.decompress(self.packed))
+        self.packed = None
+        return data["content"], data["styles"], data["formatting"]
+
+    def release_document(self):
+        if self.document is not None:
+            self.autosave_journal.set_document(None)
+            self.highlighter.set_document(None)
+            self.undo_history.set_document(None)
+            self.clean_state.set_document(None)
+            self.document.deleteLater()
+            self.document = None
+
+    def mark_saved(self, snapshot):
+        self.modified = False
+        if self.document is not None:
+            self.document.setModified(False)
+            self.clean_state.mark_clean()
+        else:
+            self.clean_state.forget() # unloaded while the save was running, taken again when it is loaded
+        self.autosave_journal.reset(snapshot.file_path, os.path.basename(snapshot.file_path))
+
+    def close(self):
+        """Let a pending save finish and forget the autosave session."""
+        self.file_saver.flush()
+        self.file_saver.deleteLater()
+        self.autosave_journal.discard()
+        self.autosave_journal.deleteLater()
+        self.highlighter.deleteLater()
+        self.undo_history.deleteLater()
+        self.clean_state.deleteLater()
+        if self.large_file_view is not None:
+            self.large_file_view.close_file()
+            self.large_file_view.deleteLater()
+            self.large_file_view = None
+        self.release_document()
+        self.packed = None
@@ -0,0 +1,138 @@
+import os
+import time
+from PySide6.QtCore import QThread, Signal
+from txty_format import is_binary_txty, read_binary_txty, parse_json_txty
+from text_encoding import detect_file_encoding, decode_chunks, next_fallback, detection_cache
+from recent_files import write_snapshot
+
+first_chunk_size = 64 * 1024 # bytes, small so the first paint happens quickly
+chunk_size = 2 * 1024 * 1024 # bytes
+read_size = 4 * 1024 * 1024 # bytes per read of a .txty file
+
+
+class FileLoader(QThread):
+    """Read and decode a file on a worker thread, handing it to the GUI in pieces.
+
+    Plain text is emitted chunk by chunk through `text_loaded` so the editor can
+    show the start of the file while the rest is still being read. A .txty file
+    has to be parsed as a whole, so it is emitted once through `document_loaded`.
+    Plain text whose detected encoding turns out to be wrong further into the
+    file is read again from the start in a fallback encoding, after `restarted`.
+
+    With a `snapshot_path` a JSON .txty file is read from its snapshot when
+    `cached`, and otherwise has one written there once it is parsed.
+    """
+
+    text_loaded = Signal(str)
+    document_loaded = Signal(object)
+    progress = Signal(int, int) # bytes read, total bytes
+    failed = Signal(str)
+    restarted = Signal() # the text emitted so far is to be dropped
+
+    def __init__(self, file_path, parent=None, snapshot_path=None, cached=False):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.file_extension = os.path.splitext(file_path)[1].lower()
+        self.snapshot_path = snapshot_path
+        self.cached = cached # the snapshot is up to date with the file
+        self.snapshot_written = False
+        self.stat = None # of the file, taken before it is read
+        self.total_size = 0
+        self.cancelled = False
+        self.error = None
+        self.text_encoding = None # TextEncoding a plain text file was read with
+        self.timings = {} # phase -> seconds spent on this thread, read once the thread has finished
+
+    def cancel(self):
+        """Ask the worker to stop at the next chunk boundary."""
+        self.cancelled = True
+        self.requestInterruption()
+
+    def run(self):
+        try:
+            self.stat = os.stat(self.file_path)
+            self.total_size = self.stat.st_size
+            if self.file_extension == ".txty":
+                self.load_txty()
+            else:
+                self.load_text()
+        except (OSError, ValueError, KeyError) as error:
+            if not self.isInterruptionRequested():
+                self.error = str(error)
+                self.failed.emit(self.error)
+
+    def load_text(self):
+        reading = 0
+        with open(self.file_path, 'rb') as file:
+            started = time.perf_counter()
+            self.text_encoding = detect_file_encoding(file, self.file_path)
+            self.timings["detect encoding"] = time.perf_counter() - started
+            while True:
+                try:
+                    pieces = decode_chunks(file, self.text_encoding, first_chunk_size, chunk_size)
+                    while not self.isInterruptionRequested():
+                        started = time.perf_counter()
+                        chunk = next(pieces, None)
+                        reading += time.perf_counter() - started
+                        if chunk is None:
+                            break
+                        self.text_loaded.emit(chunk)
+                        self.progress.emit(file.tell(), self.total_size)
+                    break
+                except UnicodeDecodeError:
+                    self.text_encoding = next_fallback(self.text_encoding)
+                    detection_cache.put(self.file_path, self.text_encoding)
+                    self.restarted.emit()
+        self.timings["read"] = reading
+
+    def load_txty(self):
+        if self.cached and self.load_snapshot():
+            return
+        if is_binary_txty(self.file_path):
+            # The text section is decoded straight from a memory map, no chunking needed
+            started = time.perf_counter()
+            data = read_binary_txty(self.file_path)
+            self.timings["parse"] = time.perf_counter() - started
+            self.progress.emit(self.total_size, self.total_size)
+            self.document_loaded.emit(data)
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        bytes_read = 0
+        with open(self.file_path, 'rb') as file:
+            while not self.isInterruptionRequested():
+                chunk = file.read(read_size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                bytes_read += len(chunk)
+                self.progress.emit(bytes_read, self.total_size)
+
+        if self.isInterruptionRequested():
+            return
+        self.timings["read"] = time.perf_counter() - started
+        started = time.perf_counter()
+        data = parse_json_txty(b"".join(chunks))
+        self.timings["parse"] = time.perf_counter() - started
+        self.document_loaded.emit(data)
+        if self.snapshot_path is not None and not self.isInterruptionRequested():
+            started = time.perf_counter()
+            try:
+                write_snapshot(self.snapshot_path, data["content"], data["styles"], data["formatting"], data["metadata"])
+                self.snapshot_written = True
+            except (OSError, ValueError, TypeError):
+                pass # the file opens without a snapshot next time too
+            self.timings["write snapshot"] = time.perf_counter() - started
+
+    def load_snapshot(self):
+        # Read like a binary .txty file, a snapshot that cannot be read is passed over for the file itself
+        started = time.perf_counter()
+        try:
+            data = read_binary_txty(self.snapshot_path)
+        except (OSError, ValueError):
+            return False
+        self.timings["read snapshot"] = time.perf_counter() - started
+        self.progress.emit(self.total_size, self.total_size)
+        self.document_loaded.emit(data)
+        return True
@@ -0,0 +1,84 @@
+import time
+import threading
+from dataclasses import dataclass, field
+from PySide6.QtCore import QThread, Signal
+from txty_format import encode_txty, write_bytes_atomic
+from text_encoding import detection_cache, default_encoding, encode_text_or_utf8
+
+
+@dataclass
+class SaveSnapshot:
+    """Everything needed to write a document, captured on the GUI thread."""
+    file_path: str
+    file_extension: str
+    content: str
+    styles: list
+    formatting: list
+    metadata: dict
+    revision: int
+    text_encoding: object = None # TextEncoding of a .txt file, None for the default; the one written once saved
+    timings: dict = field(default_factory=dict) # phase -> seconds, filled in by the FileSaver
+
+
+class FileSaver(QThread):
+    """Serialize and write snapshots on a worker thread.
+
+    Submitting while a save is running replaces any snapshot still waiting,
+    so a burst of saves only writes the first and the latest state.
+    """
+
+    saved = Signal(object)
+    failed = Signal(object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.pending = None
+        self.active = False
+        self.error = None # message of the last write if it failed
+
+    def submit(self, snapshot):
+        with self.lock:
+            self.pending = snapshot
+            start = not self.active
+            self.active = True
+        if start:
+            self.wait() # a previous run may still be returning
+            self.start()
+
+    def flush(self):
+        """Block until every submitted snapshot has been written, True if the last one was."""
+        self.wait()
+        return self.error is None
+
+    def run(self):
+        while True:
+            with self.lock:
+                snapshot = self.pending
+                self.pending = None
+                if snapshot is None:
+                    self.active = False
+                    return
+            try:
+                started = time.perf_counter()
+                data = encode_snapshot(snapshot)
+                snapshot.timings["encode"] = time.perf_counter() - started
+                started = time.perf_counter()
+                write_bytes_atomic(snapshot.file_path, data)
+                snapshot.timings["write"] = time.perf_counter() - started
+                if snapshot.file_extension != ".txty":
+                    # Opening the file again needs no detection
+                    detection_cache.put(snapshot.file_path, snapshot.text_encoding or default_encoding)
+            except (OSError, ValueError) as error:
+                self.error = str(error)
+                self.failed.emit(snapshot, self.error)
+            else:
+                self.error = None
+                self.saved.emit(snapshot)
+
+
+def encode_snapshot(snapshot):
+    if snapshot.file_extension == ".txty":
+        return encode_txty(snapshot.content, snapshot.styles, snapshot.formatting, snapshot.metadata)
+    data, snapshot.text_encoding = encode_text_or_utf8(snapshot.content, snapshot.text_encoding)
+    return data
@@ -0,0 +1,323 @@
+"""Find and replace for the editor.
+
+SearchEngine keeps the matches of the current pattern per text block. When the
+document changes only the blocks touched by the change are searched again, so a
+match count and highlights stay current while typing in a large document. Matches
+never span blocks, a regular expression is applied to one line at a time.
+
+Replacing hands the matched ranges and their replacements to the undo history
+(UndoHistory.replace_ranges()), which makes the edit and keeps only those ranges
+to undo it.
+"""
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from PySide6.QtCore import QObject, QPoint, QTimer, Signal
+from PySide6.QtGui import QColor as Color, QTextCursor as TextCursor
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QLineEdit, QPushButton, QCheckBox, QLabel, QTextEdit
+from txty_format import run_value_type
+
+changed_blocks_threshold = 10000 # blocks, a change touching more searches the whole text again
+block_step_limit = 16 # blocks, a block further on is looked up by number instead of stepped to
+highlight_color = Color(255, 235, 120)
+current_highlight_color = Color(255, 170, 60)
+
+
+class SearchEngine(QObject):
+    """Per-block match index over a QTextDocument's plain text."""
+
+    matches_changed = Signal(int) # total match count
+
+    def __init__(self, document, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.pattern = None
+        self.replacement_is_template = False
+        self.block_matches = [] # per block number, list of (start in block, length)
+        self.match_count = 0
+        document.contentsChange.connect(self.on_contents_change)
+
+    def set_document(self, document):
+        """Search another document with the same pattern."""
+        self.document.contentsChange.disconnect(self.on_contents_change)
+        self.document = document
+        document.contentsChange.connect(self.on_contents_change)
+        self.rebuild()
+
+    def set_pattern(self, text, regex=False, case_sensitive=False):
+        """Compile and search the whole document once. Raises re.error for an invalid expression."""
+        if not text:
+            self.pattern = None
+        else:
+            # Multiline so that ^ and $ mean the same over the whole text as over one block
+            flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+            self.pattern = re.compile(text if regex else re.escape(text), flags)
+        self.replacement_is_template = regex
+        self.rebuild()
+
+    def rebuild(self):
+        # One pass over the whole plain text instead of a search per block, each match
+        # is put in its block by bisecting the line starts; blocks without matches share
+        # an empty tuple
+        self.block_matches = []
+        if self.pattern is not None:
+            # The raw text, as block.text() has it, toPlainText() turns non-breaking spaces into spaces
+            text = self.document.toRawText().replace("\u2029", "\n")
+            line_starts = list(accumulate((len(line) + 1 for line in text.split("\n")), initial=0))
+            self.block_matches = [()] * self.document.blockCount()
+            line = 0
+            position = 0
+            while position is not None:
+                resume = None
+                for match in self.pattern.finditer(text, position):
+                    start, end = match.span()
+                    if start == end:
+                        continue
+                    line = bisect_right(line_starts, start, line) - 1
+                    if end >= line_starts[line + 1]:
+                        # The expression ran across a line break, search the lines it covers one by one
+                        last = bisect_right(line_starts, end, line) - 1
+                        for number in range(line, last + 1):
+                            self.block_matches[number] = self.match_block(text[line_starts[number]:line_starts[number + 1] - 1])
+                        line = last + 1
+                        resume = line_starts[line] if line < len(line_starts) - 1 else None
+                        break
+                    matches = self.block_matches[line]
+                    if not matches:
+                        matches = self.block_matches[line] = []
+                    matches.append((start - line_starts[line], end - start))
+                position = resume
+        self.match_count = sum(map(len, self.block_matches))
+        self.matches_changed.emit(self.match_count)
+
+    def match_block(self, text):
+        # Zero-length matches are skipped, there is nothing to highlight or replace
+        return [(match.start(), match.end() - match.start()) for match in self.pattern.finditer(text) if match.end() > match.start()]
+
+    def on_contents_change(self, position, removed, added):
+        if self.pattern is None:
+            return
+        first_block = self.document.findBlock(position)
+        last_block = self.document.findBlock(position + added)
+        if not last_block.isValid():
+            last_block = self.document.lastBlock()
+        first = first_block.blockNumber()
+        last = last_block.blockNumber()
+        if last - first > changed_blocks_threshold:
+            self.rebuild()
+            return
+        # Blocks after the change keep their matches, only their numbers shift
+        last_old = last - (self.document.blockCount() - len(self.block_matches))
+
+        fresh = []
+        block = first_block
+        while block.isValid() and block.blockNumber() <= last:
+            fresh.append(self.match_block(block.text()))
+            block = block.next()
+
+        self.match_count -= sum(len(matches) for matches in self.block_matches[first:last_old + 1])
+        self.match_count += sum(len(matches) for matches in fresh)
+        self.block_matches[first:last_old + 1] = fresh
+        self.matches_changed.emit(self.match_count)
+
+    def matches_in_blocks(self, first, last):
+        """Absolute (start, length) of the matches in blocks first to last."""
+        for number in range(first, min(last, len(self.block_matches) - 1) + 1):
+            if self.block_matches[number]:
+                block = self.document.findBlockByNumber(number)
+                for start, length in self.block_matches[number]:
+                    yield block.position() + start, length
+
+    def find(self, position, backward=False):
+        """The first match starting at or after `position` (or starting before it), wrapping around."""
+        if not self.match_count:
+            return None
+        block_count = len(self.block_matches)
+        first = self.document.findBlock(position).blockNumber()
+        for step in range(block_count + 1):
+            number = (first - step if backward else first + step) % block_count
+            matches = self.block_matches[number]
+            if not matches:
+                continue
+            block_position = self.document.findBlockByNumber(number).position()
+            candidates = [(block_position + start, length) for start, length in matches]
+            if step == 0:
+                if backward:
+                    candidates = [match for match in candidates if match[0] < position]
+                else:
+                    candidates = [match for match in candidates if match[0] >= position]
+            if candidates:
+                return candidates[-1] if backward else candidates[0]
+        return None
+
+    def expand(self, match, replacement):
+        return match.expand(replacement) if self.replacement_is_template else replacement
+
+    def blocks_by_number(self, numbers):
+        # The blocks of ascending block numbers, stepping to near ones rather than looking each one up
+        block = None
+        block_number = 0
+        for number in numbers:
+            if block is None or number - block_number > block_step_limit:
+                block = self.document.findBlockByNumber(number)
+            else:
+                for _ in range(number - block_number):
+                    block = block.next()
+            block_number = number
+            yield block
+
+    def replace_all(self, replacement, replace_ranges):
+        """Replace every match through replace_ranges(starts, lengths, texts) as one undoable edit.
+
+        Returns the number of replacements.
+        """
+        if not self.match_count:
+            return 0
+        numbers = [number for number, matches in enumerate(self.block_matches) if matches]
+        blocks = list(self.blocks_by_number(numbers))
+        positions = [block.position() for block in blocks]
+        if self.replacement_is_template:
+            found = [(position, match) for block, position in zip(blocks, positions) for match in self.pattern.finditer(block.text())
+                     if match.end() > match.start()]
+            starts = array(run_value_type, [position + match.start() for position, match in found])
+            lengths = array(run_value_type, [match.end() - match.start() for _, match in found])
+            texts = [match.expand(replacement) for _, match in found]
+        else:
+            starts = array(run_value_type, [position + start for number, position in zip(numbers, positions)
+                                            for start, _ in self.block_matches[number]])
+            lengths = array(run_value_type, [length for number in numbers for _, length in self.block_matches[number]])
+            texts = [replacement] * len(starts)
+        replace_ranges(starts, lengths, texts)
+        return len(starts)
+
+
+class FindReplacePanel(QWidget):
+    """Find and replace bar shown below the editor."""
+
+    def __init__(self, text_edit_field, replace_ranges, status_bar, parent=None):
+        super().__init__(parent)
+        self.text_edit_field = text_edit_field
+        self.replace_ranges = replace_ranges # (starts, lengths, texts) -> None, see UndoHistory.replace_ranges()
+        self.status_bar = status_bar
+        self.engine = SearchEngine(text_edit_field.document(), self)
+        self.engine.matches_changed.connect(self.on_matches_changed)
+        self.current_match = None
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(4, 2, 4, 2)
+        self.find_field = QLineEdit(self); self.find_field.setPlaceholderText("Find")
+        self.replace_field = QLineEdit(self); self.replace_field.setPlaceholderText("Replace with")
+        self.regex_box = QCheckBox("Regex", self)
+        self.case_box = QCheckBox("Match case", self)
+        previous_button = QPushButton("Previous", self)
+        next_button = QPushButton("Next", self)
+        replace_button = QPushButton("Replace", self)
+        replace_all_button = QPushButton("Replace All", self)
+        self.count_label = QLabel(self)
+        close_button = QPushButton("✖", self); close_button.setFixedWidth(30)
+
+        for widget in (self.find_field, self.replace_field, self.regex_box, self.case_box, previous_button,
+                       next_button, replace_button, replace_all_button, self.count_label, close_button):
+            layout.addWidget(widget)
+
+        self.find_field.textChanged.connect(self.update_pattern)
+        self.regex_box.toggled.connect(self.update_pattern)
+        self.case_box.toggled.connect(self.update_pattern)
+        self.find_field.returnPressed.connect(self.find_next)
+        self.replace_field.returnPressed.connect(self.replace)
+        previous_button.clicked.connect(self.find_previous)
+        next_button.clicked.connect(self.find_next)
+        replace_button.clicked.connect(self.replace)
+        replace_all_button.clicked.connect(self.replace_all)
+        close_button.clicked.connect(self.close_panel)
+
+        # Highlights only cover what is on screen, they are refreshed once per batch of changes or scrolling
+        self.highlight_timer = QTimer(self)
+        self.highlight_timer.setSingleShot(True)
+        self.highlight_timer.setInterval(0)
+        self.highlight_timer.timeout.connect(self.update_highlights)
+        text_edit_field.verticalScrollBar().valueChanged.connect(self.highlight_timer.start)
+
+    def open_panel(self, replace=False):
+        self.show()
+        field = self.replace_field if replace else self.find_field
+        selected = self.text_edit_field.textCursor().selectedText()
+        if selected and "\u2029" not in selected and not replace:
+            self.find_field.setText(selected)
+        field.setFocus()
+        field.selectAll()
+
+    def set_document(self, document):
+        self.current_match = None
+        self.engine.set_document(document)
+
+    def close_panel(self):
+        self.hide()
+        self.engine.set_pattern("")
+        self.text_edit_field.setFocus()
+
+    def update_pattern(self):
+        try:
+            self.engine.set_pattern(self.find_field.text(), self.regex_box.isChecked(), self.case_box.isChecked())
+        except re.error as error:
+            self.engine.set_pattern("")
+            self.count_label.setText(f"Invalid expression: {error}")
+
+    def on_matches_changed(self, count):
+        self.count_label.setText(f"{count:,} matches" if self.engine.pattern is not None else "")
+        self.highlight_timer.start()
+
+    def find_next(self):
+        cursor = self.text_edit_field.textCursor()
+        # Step past a match that is already selected
+        self.go_to_match(self.engine.find(cursor.selectionStart() + (1 if cursor.hasSelection() else 0)))
+
+    def find_previous(self):
+        self.go_to_match(self.engine.find(self.text_edit_field.textCursor().selectionStart(), backward=True))
+
+    def go_to_match(self, match):
+        if match is None:
+            self.status_bar.showMessage("No matches", 2000)
+            return
+        start, length = match
+        cursor = self.text_edit_field.textCursor()
+        cursor.setPosition(start)
+        cursor.setPosition(start + length, TextCursor.MoveMode.KeepAnchor)
+        self.text_edit_field.setTextCursor(cursor)
+        self.text_edit_field.ensureCursorVisible()
+        self.current_match = match
+        self.highlight_timer.start()
+
+    def replace(self):
+        cursor = self.text_edit_field.textCursor()
+        block = cursor.block()
+        start = cursor.selectionStart() - block.position()
+        if self.engine.pattern is not None and cursor.hasSelection() and (start, cursor.selectionEnd() - cursor.selectionStart()) in self.engine.block_matches[block.blockNumber()]:
+            match = self.engine.pattern.match(block.text(), start)
+            self.replace_ranges([cursor.selectionStart()], [cursor.selectionEnd() - cursor.selectionStart()],
+                                [self.engine.expand(match, self.replace_field.text())])
+        self.find_next()
+
+    def replace_all(self):
+        try:
+            count = self.engine.replace_all(self.replace_field.text(), self.replace_ranges)
+        except (re.error, IndexError) as error:
+            self.status_bar.showMessage(f"Invalid replacement: {error}", 2000)
+            return
+        self.status_bar.showMessage(f"Replaced {count:,} matches", 2000)
+
+    def update_highlights(self):
+        selections = []
+        if self.isVisible() and self.engine.pattern is not None and self.engine.match_count:
+            viewport = self.text_edit_field.viewport()
+            first = self.text_edit_field.cursorForPosition(QPoint(0, 0)).blockNumber()
+            last = self.text_edit_field.cursorForPosition(QPoint(viewport.width(), viewport.height())).blockNumber()
+            for start, length in self.engine.matches_in_blocks(first, last):
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = TextCursor(self.text_edit_field.document())
+                selection.cursor.setPosition(start)
+                selection.cursor.setPosition(start + length, TextCursor.MoveMode.KeepAnchor)
+                selection.format.setBackground(current_highlight_color if (start, length) == self.current_match else highlight_color)
+                selections.append(selection)
+        self.text_edit_field.setExtraSelections(selections)
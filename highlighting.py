@@ -0,0 +1,401 @@
+"""Syntax highlighting of JSON, INI, log and Markdown text.
+
+A RuleSet is a list of regular expressions with the style of what they match,
+plus regions such as Markdown's fenced code that run over several lines. The
+built-in sets are in rule_sets, register_rule_set() adds more.
+
+Highlighting sets the additional formats of the block layouts, as
+QSyntaxHighlighter does: they never become part of the text, so they stay out
+of document_formatting(), the undo stack and the modified state. It does not use
+QSyntaxHighlighter itself, which marks the document dirty once for every block
+it formats; a QTextEdit answers each of those marks with a layout pass over the
+rest of the document, about half a second in a 500,000 line file. Instead the
+blocks an edit touched are formatted while Qt reports the change, so they are
+laid out in the pass the edit causes anyway, and the visible blocks are formatted
+in one batch with a single mark. Off screen only the line states (inside a
+region or not) are carried down, a few milliseconds at a time, which needs no
+layout; those blocks are formatted when they are scrolled into view.
+"""
+import re
+import time
+from itertools import accumulate
+from PySide6.QtCore import QObject, QPoint, QTimer
+from PySide6.QtGui import QTextCursor, QTextLayout
+from text_formats import highlight_char_format
+from txty_format import style_from_dict, utf16_length
+
+edit_block_limit = 64 # blocks an edit may touch and still be formatted right away, larger changes are queued
+slice_duration = 0.008 # seconds of carrying line states down per turn of the event loop
+scroll_delay = 40 # milliseconds, the visible blocks are formatted once scrolling pauses
+visible_block_limit = 500 # blocks taken as visible at most, a screen holds far fewer
+no_region = -1 # line state outside any multi-line region, also the state Qt gives new blocks
+
+
+class RuleSet:
+    """A named set of highlighting rules.
+
+    rules are (pattern, style) or (pattern, style, group) tuples, matched against
+    one line at a time and applied in order, so later rules win where matches
+    overlap. style is a .txty style dict, group the part of the match to format.
+    regions are (start pattern, end pattern, style) tuples for constructs that
+    span lines; no rule applies inside them.
+    """
+
+    def __init__(self, name, rules, regions=()):
+        self.name = name
+        self.rule_specs = rules
+        self.region_specs = regions
+        self.rules = None # compiled on first use
+        self.regions = None
+
+    def compile(self):
+        if self.rules is None:
+            self.rules = [(re.compile(spec[0]), highlight_char_format(style_from_dict(spec[1])), spec[2] if len(spec) > 2 else 0)
+                          for spec in self.rule_specs]
+            self.regions = [(re.compile(start), re.compile(end), highlight_char_format(style_from_dict(style)))
+                            for start, end, style in self.region_specs]
+        return self
+
+    def format_line(self, text, state):
+        """Non-overlapping (start, end, char format) ranges of a line and the state it ends in."""
+        ranges = []
+        position = 0
+        if 0 <= state < len(self.regions):
+            _, region_end, char_format = self.regions[state]
+            closing = region_end.search(text)
+            if closing is None:
+                return [(0, len(text), char_format)] if text else [], state
+            position = closing.end()
+            ranges.append((0, position, char_format))
+
+        while True:
+            index, opening = self.next_region(text, position)
+            stop = opening.start() if opening is not None else len(text)
+            for pattern, char_format, group in self.rules:
+                for match in pattern.finditer(text, position, stop):
+                    start, end = match.span(group)
+                    if end > start:
+                        ranges = overlay(ranges, start, end, char_format)
+            if opening is None:
+                return ranges, no_region
+
+            _, region_end, char_format = self.regions[index]
+            closing = region_end.search(text, opening.end())
+            if closing is None:
+                ranges.append((opening.start(), len(text), char_format))
+                return ranges, index
+            ranges.append((opening.start(), closing.end(), char_format))
+            position = max(closing.end(), opening.start() + 1)
+
+    def line_state(self, text, state):
+        """The state a line ends in, format_line() without the formats."""
+        position = 0
+        if 0 <= state < len(self.regions):
+            closing = self.regions[state][1].search(text)
+            if closing is None:
+                return state
+            position = closing.end()
+        while True:
+            index, opening = self.next_region(text, position)
+            if opening is None:
+                return no_region
+            closing = self.regions[index][1].search(text, opening.end())
+            if closing is None:
+                return index
+            position = max(closing.end(), opening.start() + 1)
+
+    def next_region(self, text, position):
+        # (index, match) of the region starting first from position on, (None, None) when none does
+        found = (None, None)
+        for index, (region_start, _, _) in enumerate(self.regions):
+            match = region_start.search(text, position)
+            if match is not None and (found[1] is None or match.start() < found[1].start()):
+                found = (index, match)
+        return found
+
+
+def overlay(ranges, start, end, char_format):
+    # Lays a range over the earlier ones, cutting away what it covers
+    result = []
+    for range_start, range_end, range_format in ranges:
+        if range_end <= start or range_start >= end:
+            result.append((range_start, range_end, range_format))
+            continue
+        if range_start < start:
+            result.append((range_start, start, range_format))
+        if range_end > end:
+            result.append((end, range_end, range_format))
+    result.append((start, end, char_format))
+    return result
+
+
+rule_sets = {} # name -> RuleSet, in menu order
+
+
+def register_rule_set(rule_set):
+    rule_sets[rule_set.name] = rule_set
+    return rule_set
+
+
+register_rule_set(RuleSet("JSON", [
+    (r"-?\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b", {"color": "#098658"}),
+    (r"\b(?:true|false|null)\b", {"color": "#0000ff", "bold": True}),
+    (r'"(?:[^"\\]|\\.)*"', {"color": "#a31515"}),
+    (r'("(?:[^"\\]|\\.)*")\s*:', {"color": "#0451a5"}, 1),
+]))
+
+register_rule_set(RuleSet("INI", [
+    (r"^\s*([^=:;#\s\[][^=:]*?)\s*[=:]", {"color": "#0451a5"}, 1),
+    (r"^\s*\[[^\]]*\]", {"color": "#800080", "bold": True}),
+    (r"^\s*[;#].*", {"color": "#808080", "italic": True}),
+]))
+
+register_rule_set(RuleSet("Log", [
+    (r"^\[?\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?\]?", {"color": "#808080"}),
+    (r"\b(?:TRACE|DEBUG)\b", {"color": "#808080"}),
+    (r"\bINFO\b", {"color": "#0451a5"}),
+    (r"\bWARN(?:ING)?\b", {"color": "#b36b00", "bold": True}),
+    (r"\b(?:ERROR|FATAL|CRITICAL|SEVERE)\b", {"color": "#cd3131", "bold": True}),
+]))
+
+register_rule_set(RuleSet("Markdown", [
+    (r"^\s*(?:[-*+]|\d+[.)])\s", {"color": "#b36b00", "bold": True}),
+    (r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1", {"bold": True}),
+    (r"(?<![*_\w])([*_])(?=\S)(.+?)(?<=\S)\1(?![*_\w])", {"italic": True}),
+    (r"\[[^\]]*\]\([^)\s]*\)", {"color": "#0451a5", "underline": True}),
+    (r"`[^`]+`", {"color": "#a31515", "highlight": "#f0f0f0"}),
+    (r"^\s*>.*", {"color": "#808080", "italic": True}),
+    (r"^#{1,6}\s.*", {"color": "#800080", "bold": True}),
+], regions=[
+    (r"^\s*(?:```|~~~)", r"^\s*(?:```|~~~)\s*$", {"color": "#a31515", "highlight": "#f0f0f0"}),
+]))
+
+
+def utf16_offsets(text):
+    """UTF-16 position of every character boundary, None when they equal the indices."""
+    if text.isascii() or utf16_length(text) == len(text):
+        return None
+    return list(accumulate((2 if ord(character) > 0xFFFF else 1 for character in text), initial=0))
+
+
+class Highlighter(QObject):
+    """Incremental highlighting of one document with a RuleSet."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = None
+        self.rule_set = None
+        self.view = None # the QTextEdit showing the document, queued work only runs while there is one
+        self.paused = False # set while a file is read in, changes are then only queued
+        self.dirty = [] # [start, end] QTextCursor pairs at block starts whose formats are out of date, end None for the document end
+        self.has_states = False # whether any block may be in a state other than no_region
+        self.unsettled = [] # [cursor, to_end] to carry line states down from, to_end goes on past blocks that agree
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.highlight_pending)
+
+    def set_document(self, document):
+        """Follow a new, still empty document, or None."""
+        if self.document is not None:
+            self.document.contentsChange.disconnect(self.on_contents_change)
+        self.document = document
+        self.dirty = []
+        self.unsettled = []
+        self.has_states = False
+        self.timer.stop()
+        if document is not None:
+            document.contentsChange.connect(self.on_contents_change)
+
+    def set_rule_set(self, rule_set):
+        if rule_set is self.rule_set:
+            return
+        self.rule_set = rule_set.compile() if rule_set is not None else None
+        if self.document is not None:
+            self.queue(0, self.document.characterCount(), to_end=True) # also clears the old formats
+
+    def set_view(self, view):
+        """Run the queued work while `view` shows the document, None pauses it."""
+        if self.view is not None:
+            self.view.verticalScrollBar().valueChanged.disconnect(self.on_scrolled)
+            self.view.verticalScrollBar().rangeChanged.disconnect(self.on_scrolled)
+        self.view = view
+        if view is None:
+            self.timer.stop()
+            return
+        view.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+        view.verticalScrollBar().rangeChanged.connect(self.on_scrolled)
+        if self.dirty or self.unsettled:
+            self.timer.start(0)
+
+    def on_scrolled(self, *_):
+        if self.dirty:
+            self.timer.start(scroll_delay)
+
+    def on_contents_change(self, position, removed, added):
+        if self.rule_set is None and not self.dirty:
+            return # nothing is formatted
+        first = self.document.findBlock(position)
+        last = self.document.findBlock(position + added)
+        if not last.isValid():
+            last = self.document.lastBlock()
+        if self.paused or last.blockNumber() - first.blockNumber() >= edit_block_limit:
+            self.queue(first.position(), last.position() + last.length())
+            return
+        # Marked while Qt reports the change, the blocks are laid out with it
+        self.format_blocks(first, last)
+
+    def highlight_pending(self):
+        if self.view is None or self.document is None:
+            return
+        # On screen and a screen above and below, in one batch: every batch
+        # costs the editor a layout pass over the rest of the document
+        first, last = self.visible_blocks()
+        start, end = first.position(), last.position() + last.length()
+        spans = [(max(span_start, start), min(span_end, end)) for span_start, span_end in self.dirty_spans()
+                 if span_start < end and span_end > start]
+        if spans:
+            self.format_blocks(self.document.findBlock(spans[0][0]), self.document.findBlock(spans[-1][1] - 1))
+
+        deadline = time.perf_counter() + slice_duration
+        while self.unsettled and time.perf_counter() < deadline:
+            self.settle_states(deadline)
+        if self.unsettled:
+            self.timer.start(0)
+
+    def visible_blocks(self):
+        # Hit tests in the document margin can land anywhere, the points are just inside
+        # it; while the document is still being laid out they can still be off
+        view = self.view
+        x = int(self.document.documentMargin()) + 1
+        top = view.cursorForPosition(QPoint(x, 0)).blockNumber()
+        bottom = view.cursorForPosition(QPoint(x, view.viewport().height() - 1)).blockNumber()
+        top, bottom = min(top, bottom), min(max(top, bottom), min(top, bottom) + visible_block_limit)
+        margin = bottom - top + 1
+        return (self.document.findBlockByNumber(max(0, top - margin)),
+                self.document.findBlockByNumber(min(self.document.blockCount() - 1, bottom + margin)))
+
+    def format_blocks(self, first, last):
+        # Formats and states of the blocks from first to last under one mark; a state
+        # that changed at the end is queued to be carried on
+        block = first
+        previous = first.previous()
+        state = previous.userState() if previous.isValid() else no_region
+        changed = False
+        while block.isValid() and block.position() <= last.position():
+            text = block.text()
+            if self.rule_set is not None:
+                ranges, state = self.rule_set.format_line(text, state)
+            else:
+                ranges, state = [], no_region
+            block.layout().setFormats(self.format_ranges(text, ranges))
+            changed = state != block.userState()
+            if changed:
+                block.setUserState(state)
+                self.has_states = self.has_states or state != no_region
+            block = block.next()
+
+        end = last.position() + last.length()
+        self.mark_clean(first.position(), end)
+        self.document.markContentsDirty(first.position(), end - first.position())
+        following = last.next()
+        if changed and following.isValid():
+            self.queue(following.position(), following.position() + following.length())
+
+    def format_ranges(self, text, ranges):
+        offsets = utf16_offsets(text)
+        format_ranges = []
+        for start, end, char_format in ranges:
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            format_range = QTextLayout.FormatRange()
+            format_range.start = start
+            format_range.length = end - start
+            format_range.format = char_format
+            format_ranges.append(format_range)
+        return format_ranges
+
+    def settle_states(self, deadline):
+        # Carries line states down from the earliest unsettled block until one ends in the
+        # state it already had; the block after a changed one has to be formatted again
+        self.unsettled.sort(key=lambda entry: entry[0].position())
+        cursor, to_end = self.unsettled.pop(0)
+        block = self.document.findBlock(cursor.position())
+        previous = block.previous()
+        state = previous.userState() if previous.isValid() else no_region
+        regions = self.rule_set.regions if self.rule_set is not None else None
+        if not regions and not self.has_states:
+            return # every block is in no_region already
+        changed_from = changed_to = None
+        while block.isValid():
+            if time.perf_counter() > deadline:
+                self.unsettled.append([QTextCursor(block), to_end])
+                break
+            state = self.rule_set.line_state(block.text(), state) if regions else no_region
+            if state != block.userState():
+                block.setUserState(state)
+                self.has_states = self.has_states or state != no_region
+                if changed_from is None:
+                    changed_from = block.position() + block.length()
+                changed_to = block.position() + block.length()
+            elif not to_end:
+                break
+            block = block.next()
+        if to_end and not block.isValid() and not regions:
+            self.has_states = False
+        if changed_from is not None and changed_from < self.document.characterCount():
+            following = self.document.findBlock(changed_to)
+            self.mark_dirty(changed_from, following.position() + following.length() if following.isValid() else changed_to)
+
+    def queue(self, start, end, to_end=False):
+        # Formats of the range out of date, line states to be carried down from its start
+        first = self.document.findBlock(start)
+        if not first.isValid():
+            first = self.document.lastBlock()
+        self.unsettled.append([QTextCursor(first), to_end])
+        self.mark_dirty(first.position(), end)
+        if self.view is not None:
+            self.timer.start(0)
+
+    def dirty_spans(self):
+        """(start, end) positions of the out of date ranges in document order, dropping those edits emptied."""
+        spans = []
+        for region in self.dirty[:]:
+            start, end = self.region_span(region)
+            if start < end:
+                spans.append((start, end))
+            else:
+                self.dirty.remove(region)
+        return sorted(spans)
+
+    def region_span(self, region):
+        start, end = region
+        return start.position(), end.position() if end is not None else self.document.characterCount()
+
+    def mark_dirty(self, start, end):
+        for region in self.dirty[:]:
+            region_start, region_end = self.region_span(region)
+            if region_start <= end and start <= region_end:
+                start, end = min(start, region_start), max(end, region_end)
+                self.dirty.remove(region)
+        self.dirty.append(self.region(start, end))
+
+    def mark_clean(self, start, end):
+        for region in self.dirty[:]:
+            region_start, region_end = self.region_span(region)
+            if region_start >= end or region_end <= start:
+                continue
+            self.dirty.remove(region)
+            if region_start < start:
+                self.dirty.append(self.region(region_start, start))
+            if region_end > end:
+                self.dirty.append(self.region(end, region_end))
+
+    def region(self, start, end):
+        # Widened to whole blocks: a cursor made from a block is placed without laying
+        # out the document up to it, which setPosition() does to find the cursor's x.
+        # The start stays put for text typed right at it, the end moves along
+        first = self.document.findBlock(start)
+        start_cursor = QTextCursor(first if first.isValid() else self.document.lastBlock())
+        start_cursor.setKeepPositionOnInsert(True)
+        after = self.document.findBlock(max(end - 1, start)).next()
+        return [start_cursor, QTextCursor(after) if after.isValid() else None]
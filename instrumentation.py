@@ -0,0 +1,277 @@
+"""Timing of the editor's hot paths, shown in the Performance panel and exported as JSON lines.
+
+`metrics` records named measurements: keystroke to paint, the phases of opening
+and saving a file, get_formatting and the formatting actions, plus samples of
+the memory the documents take. Nothing is recorded until it is enabled, a
+disabled recorder costs one attribute check per call. Phases that run on a
+loader or saver thread are timed there and handed over with the result, so
+`metrics` is only used on the GUI thread.
+
+An export starts with an environment line, followed by one line per measurement
+and a summary line per metric, so runs of two builds under the same workload can
+be compared with any JSON tool. `python main.py --metrics FILE` records from the
+start and writes FILE when the editor exits.
+"""
+import os
+import sys
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from PySide6 import __version__ as pyside_version
+from PySide6.QtCore import QObject, QEvent, QTimer, Qt
+from PySide6.QtWidgets import (QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QTreeWidget, QTreeWidgetItem,
+                               QLabel, QPushButton, QCheckBox, QFileDialog)
+
+history_limit = 100_000 # measurements kept, the oldest are dropped first
+memory_sample_interval = 2000 # milliseconds between memory samples while recording
+panel_refresh_interval = 500 # milliseconds, the panel is not redrawn per measurement
+modifier_keys = {Qt.Key_Shift, Qt.Key_Control, Qt.Key_Alt, Qt.Key_Meta, Qt.Key_AltGr, Qt.Key_CapsLock}
+
+
+@dataclass
+class Measurement:
+    name: str
+    value: float
+    unit: str # "s", "bytes" or "count"
+    time: float # seconds since the epoch
+    details: dict = field(default_factory=dict)
+
+
+class Metrics:
+    """Measurements of the running editor, newest last."""
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.measurements = deque(maxlen=history_limit)
+
+    def record(self, name, value, unit="s", **details):
+        if self.enabled:
+            self.measurements.append(Measurement(name, value, unit, time.time(), details))
+
+    @contextmanager
+    def measure(self, name, **details):
+        """Record how long the body of the with statement took."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, **details)
+
+    def record_phases(self, prefix, timings, **details):
+        for phase, seconds in timings.items():
+            self.record(f"{prefix}: {phase}", seconds, **details)
+
+    def clear(self):
+        self.measurements.clear()
+
+    def summaries(self):
+        """Count, total, mean, median, 95th percentile and maximum per metric, by name."""
+        values = {}
+        last = {}
+        for measurement in self.measurements:
+            values.setdefault((measurement.name, measurement.unit), []).append(measurement.value)
+            last[measurement.name] = measurement.value
+        summaries = []
+        for (name, unit), metric_values in sorted(values.items()):
+            metric_values.sort()
+            count = len(metric_values)
+            summaries.append({
+                "name": name, "unit": unit, "count": count, "total": sum(metric_values), "last": last[name],
+                "mean": sum(metric_values) / count, "median": metric_values[count // 2],
+                "p95": metric_values[min(count - 1, int(count * 0.95))], "max": metric_values[-1],
+            })
+        return summaries
+
+    def environment(self):
+        import platform # only needed for an export, kept out of the start-up
+        return {
+            "type": "environment",
+            "python": platform.python_version(),
+            "pyside": pyside_version,
+            "platform": platform.platform(),
+            "executable": sys.executable,
+            "arguments": sys.argv[1:],
+            "started": self.started,
+        }
+
+    def write_jsonl(self, file_path):
+        with open(file_path, 'w', encoding="utf-8") as file:
+            file.write(json.dumps(self.environment()) + "\n")
+            for measurement in self.measurements:
+                file.write(json.dumps({"type": "measurement", **asdict(measurement)}) + "\n")
+            for summary in self.summaries():
+                file.write(json.dumps({"type": "summary", **summary}) + "\n")
+
+
+metrics = Metrics()
+
+
+def process_memory():
+    """Resident memory of the editor process in bytes, None where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # the peak, the current size is not available
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class EditorProbe(QObject):
+    """Measures keystroke to paint latency of a text edit and samples memory while recording.
+
+    A key press starts the clock, the first paint of the viewport that follows
+    stops it once the paint is done. Presses of modifier keys and shortcuts are
+    left out, they do not always lead to a paint.
+    """
+
+    def __init__(self, text_edit_field, document_memory, parent=None):
+        super().__init__(parent)
+        self.text_edit_field = text_edit_field
+        self.document_memory = document_memory # () -> dict of memory figures in bytes
+        self.key_pressed = None
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(memory_sample_interval)
+        self.memory_timer.timeout.connect(self.sample_memory)
+
+    def set_enabled(self, enabled):
+        if enabled == metrics.enabled:
+            return
+        metrics.enabled = enabled
+        self.key_pressed = None
+        if enabled:
+            self.text_edit_field.installEventFilter(self)
+            self.text_edit_field.viewport().installEventFilter(self)
+            self.memory_timer.start()
+            self.sample_memory()
+        else:
+            self.text_edit_field.removeEventFilter(self)
+            self.text_edit_field.viewport().removeEventFilter(self)
+            self.memory_timer.stop()
+
+    def eventFilter(self, watched, event):
+        event_type = event.type()
+        if event_type == QEvent.KeyPress and watched is self.text_edit_field:
+            if (self.key_pressed is None and event.key() not in modifier_keys
+                    and not event.modifiers() & (Qt.ControlModifier | Qt.AltModifier | Qt.MetaModifier)):
+                self.key_pressed = time.perf_counter()
+        elif event_type == QEvent.Paint and self.key_pressed is not None:
+            # Timers run after the paint event has been handled
+            QTimer.singleShot(0, self.on_painted)
+        return False
+
+    def on_painted(self):
+        if self.key_pressed is not None:
+            metrics.record("keystroke to paint", time.perf_counter() - self.key_pressed,
+                           blocks=self.text_edit_field.document().blockCount())
+            self.key_pressed = None
+
+    def sample_memory(self):
+        for name, value in self.document_memory().items():
+            metrics.record(f"memory: {name}", value, "bytes")
+        rss = process_memory()
+        if rss is not None:
+            metrics.record("memory: process", rss, "bytes")
+
+
+def format_value(value, unit):
+    if unit == "bytes":
+        return f"{value / 1024 / 1024:.1f} MB"
+    if unit == "count":
+        return f"{value:.4g}"
+    return f"{value * 1000:.2f} ms"
+
+
+class InstrumentationPanel(QDockWidget):
+    """Dockable table of the recorded metrics with recording, clearing and export."""
+
+    columns = ["Metric", "Count", "Last", "Mean", "Median", "95th", "Max"]
+
+    def __init__(self, probe, parent=None):
+        super().__init__("Performance", parent)
+        self.setObjectName("performance_panel")
+        self.probe = probe
+
+        contents = QWidget(self)
+        layout = QVBoxLayout(contents)
+        layout.setContentsMargins(4, 4, 4, 4)
+        self.table = QTreeWidget(contents)
+        self.table.setRootIsDecorated(False)
+        self.table.setHeaderLabels(self.columns)
+        self.memory_label = QLabel(contents)
+
+        buttons = QHBoxLayout()
+        self.recording_box = QCheckBox("Record", contents)
+        self.recording_box.setChecked(metrics.enabled)
+        clear_button = QPushButton("Clear", contents)
+        export_button = QPushButton("Export...", contents)
+        for widget in (self.recording_box, clear_button, export_button):
+            buttons.addWidget(widget)
+        buttons.addStretch()
+
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        layout.addWidget(self.memory_label)
+        self.setWidget(contents)
+
+        self.recording_box.toggled.connect(self.set_recording)
+        clear_button.clicked.connect(self.clear)
+        export_button.clicked.connect(self.export)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(panel_refresh_interval)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+
+    def set_recording(self, recording):
+        self.probe.set_enabled(recording)
+        self.refresh()
+
+    def clear(self):
+        metrics.clear()
+        self.refresh()
+
+    def refresh(self):
+        self.recording_box.setChecked(metrics.enabled)
+        summaries = metrics.summaries()
+        self.table.clear()
+        memory = []
+        for summary in summaries:
+            unit = summary["unit"]
+            if unit == "bytes":
+                memory.append(f"{summary['name'][len('memory: '):]} {format_value(summary['last'], unit)}")
+            values = [format_value(summary[key], unit) for key in ("last", "mean", "median", "p95", "max")]
+            item = QTreeWidgetItem([summary["name"], str(summary["count"]), *values])
+            for column in range(1, len(self.columns)):
+                item.setTextAlignment(column, Qt.AlignRight | Qt.AlignVCenter)
+            self.table.addTopLevelItem(item)
+        for column in range(len(self.columns)):
+            self.table.resizeColumnToContents(column)
+        self.memory_label.setText("Memory: " + ", ".join(memory) if memory else
+                                  "Recording is off" if not metrics.enabled else "")
+
+    def export(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export Metrics", "texty-metrics.jsonl", "JSON Lines (*.jsonl);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            metrics.write_jsonl(file_path)
+        except OSError as error:
+            self.memory_label.setText(f"Could not export metrics : {error}")
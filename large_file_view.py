@@ -0,0 +1,222 @@
+"""Read-only viewer for files too large to load into a QTextDocument.
+
+The file is memory-mapped and never decoded as a whole. A LineIndexer thread
+records where every `index_stride`-th line starts, and the view only decodes and
+paints the lines that are visible. The vertical scroll bar counts lines, so
+scrolling and going to a line cost the same whatever the size of the file.
+Lines are decoded in the file's detected encoding, which has to keep line
+breaks as single b"\n" bytes (UTF-16 and UTF-32 files are loaded as a whole).
+"""
+import os
+import mmap
+from array import array
+from itertools import accumulate
+from PySide6.QtCore import Qt, QThread, Signal
+from PySide6.QtGui import QPainter, QFont as Font, QFontMetrics as FontMetrics
+from PySide6.QtWidgets import QAbstractScrollArea
+from text_encoding import detect_file_encoding
+
+index_stride = 32 # lines between two indexed line starts
+index_chunk_size = 16 * 1024 * 1024 # bytes scanned per step
+max_line_bytes = 16 * 1024 # longer lines are cut off when painted
+tab_width = 4
+
+
+class LineIndexer(QThread):
+    """Scan a memory-mapped file for line starts in the background."""
+
+    lines_indexed = Signal(object, int) # new line start checkpoints, total lines so far
+    indexed = Signal(int) # total line count
+
+    def __init__(self, file_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+
+    def run(self):
+        line_count = 1
+        with open(self.file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                self.indexed.emit(line_count)
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for chunk_start in range(0, len(mapped), index_chunk_size):
+                    if self.isInterruptionRequested():
+                        return
+                    pieces = mapped[chunk_start:chunk_start + index_chunk_size].split(b"\n")
+                    # Position right after each newline in this chunk, i.e. where the next line starts
+                    starts = list(accumulate(len(piece) + 1 for piece in pieces[:-1]))
+                    first = (-line_count) % index_stride
+                    checkpoints = array('Q', (chunk_start + start for start in starts[first::index_stride]))
+                    line_count += len(starts)
+                    self.lines_indexed.emit(checkpoints, line_count)
+        self.indexed.emit(line_count)
+
+
+class LargeFileView(QAbstractScrollArea):
+    """Paint the visible lines of a memory-mapped file."""
+
+    line_count_changed = Signal(int, bool) # lines known so far, whether indexing is done
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file = None
+        self.mapped = None
+        self.file_path = None
+        self.encoding = "utf-8"
+        self.text_start = 0 # bytes of the byte order mark, if any
+        self.checkpoints = array('Q', [0])
+        self.line_count = 0
+        self.indexer = None
+        self.widest_line = 0
+
+        self.setFont(Font("Courier New", 12))
+        self.viewport().setCursor(Qt.IBeamCursor)
+        self.setFocusPolicy(Qt.StrongFocus)
+
+    def open(self, file_path):
+        self.close_file()
+        self.file_path = file_path
+        self.file = open(file_path, 'rb')
+        text_encoding = detect_file_encoding(self.file, file_path)
+        self.encoding, self.text_start = text_encoding.encoding, len(text_encoding.bom)
+        if os.fstat(self.file.fileno()).st_size:
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.line_count = 1
+        self.widest_line = 0
+
+        self.indexer = LineIndexer(file_path, self)
+        self.indexer.lines_indexed.connect(self.on_lines_indexed)
+        self.indexer.indexed.connect(self.on_indexed)
+        self.indexer.start()
+
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+        self.update_scroll_bars()
+        self.viewport().update()
+
+    def close_file(self):
+        if self.indexer is not None:
+            self.indexer.requestInterruption()
+            self.indexer.wait()
+            self.indexer.deleteLater()
+            self.indexer = None
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.file_path = None
+        self.checkpoints = array('Q', [0])
+        self.line_count = 0
+
+    def on_lines_indexed(self, checkpoints, line_count):
+        if self.sender() is not self.indexer:
+            return
+        self.checkpoints.extend(checkpoints)
+        self.line_count = line_count
+        self.update_scroll_bars()
+        self.viewport().update()
+        self.line_count_changed.emit(line_count, False)
+
+    def on_indexed(self, line_count):
+        if self.sender() is not self.indexer:
+            return
+        self.line_count = line_count
+        self.update_scroll_bars()
+        self.line_count_changed.emit(line_count, True)
+
+    def line_height(self):
+        return FontMetrics(self.font()).lineSpacing()
+
+    def visible_line_count(self):
+        return max(1, self.viewport().height() // self.line_height())
+
+    def update_scroll_bars(self):
+        vertical = self.verticalScrollBar()
+        vertical.setRange(0, max(0, self.line_count - self.visible_line_count()))
+        vertical.setPageStep(self.visible_line_count())
+        vertical.setSingleStep(1)
+
+        horizontal = self.horizontalScrollBar()
+        horizontal.setRange(0, max(0, self.widest_line - self.viewport().width()))
+        horizontal.setPageStep(self.viewport().width())
+        horizontal.setSingleStep(FontMetrics(self.font()).horizontalAdvance(" ") * tab_width)
+
+    def line_start(self, line_number):
+        # Start from the nearest checkpoint, at most index_stride - 1 lines are skipped
+        position = self.checkpoints[line_number // index_stride]
+        for _ in range(line_number % index_stride):
+            position = self.mapped.find(b"\n", position) + 1
+        return position
+
+    def lines(self, first_line, count):
+        """Decoded text of `count` lines starting at `first_line`, fewer at the end of the file."""
+        if self.mapped is None:
+            return [""] if first_line == 0 and count else []
+        if first_line // index_stride >= len(self.checkpoints):
+            return [] # not indexed yet
+
+        lines = []
+        position = self.line_start(first_line)
+        size = len(self.mapped)
+        for _ in range(min(count, self.line_count - first_line)):
+            if position > size:
+                break
+            end = self.mapped.find(b"\n", position, position + max_line_bytes)
+            stop = end if end != -1 else min(size, position + max_line_bytes)
+            lines.append(self.mapped[position or self.text_start:stop].rstrip(b"\r").decode(self.encoding, "replace").expandtabs(tab_width))
+            if end == -1:
+                # Cut off line, continue after its real end
+                end = self.mapped.find(b"\n", stop)
+                if end == -1:
+                    break
+            position = end + 1
+        return lines
+
+    def go_to_line(self, line_number):
+        """Scroll so that the 1-based `line_number` is the first visible line."""
+        self.verticalScrollBar().setValue(max(0, min(line_number - 1, self.line_count - 1)))
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.fillRect(event.rect(), self.palette().base())
+        painter.setPen(self.palette().text().color())
+        painter.setFont(self.font())
+
+        metrics = FontMetrics(self.font())
+        line_height = self.line_height()
+        x = 4 - self.horizontalScrollBar().value()
+        y = metrics.ascent()
+        widest_line = self.widest_line
+        for text in self.lines(self.verticalScrollBar().value(), self.visible_line_count() + 1):
+            painter.drawText(x, y, text)
+            widest_line = max(widest_line, metrics.horizontalAdvance(text) + 8)
+            y += line_height
+        painter.end()
+
+        if widest_line != self.widest_line:
+            self.widest_line = widest_line
+            self.update_scroll_bars()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_scroll_bars()
+
+    def keyPressEvent(self, event):
+        vertical = self.verticalScrollBar()
+        key = event.key()
+        if key == Qt.Key_Down:
+            vertical.triggerAction(vertical.SliderAction.SliderSingleStepAdd)
+        elif key == Qt.Key_Up:
+            vertical.triggerAction(vertical.SliderAction.SliderSingleStepSub)
+        elif key == Qt.Key_PageDown:
+            vertical.triggerAction(vertical.SliderAction.SliderPageStepAdd)
+        elif key == Qt.Key_PageUp:
+            vertical.triggerAction(vertical.SliderAction.SliderPageStepSub)
+        elif key == Qt.Key_Home and event.modifiers() & Qt.ControlModifier:
+            vertical.setValue(vertical.minimum())
+        elif key == Qt.Key_End and event.modifiers() & Qt.ControlModifier:
+            vertical.setValue(vertical.maximum())
+        else:
+            super().keyPressEvent(event)
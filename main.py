@@ -1,77 +1,164 @@
+from startup_profile import startup_profile, profile_flag, metrics_flag # first, so the imports below are timed
 import os
 import sys
-import json
+import time
+from file_saver import SaveSnapshot
+from highlighting import rule_sets
+from autosave import find_orphaned_sessions, read_session, apply_deltas, remove_session
+from txty_format import style_from_dict
+from text_formats import char_format_from_style_key, document_formatting, SelectionEmphasis
+from text_encoding import file_encoding
 from PySide6 import QtWidgets as Widgets, QtGui as GUI
+from PySide6.QtCore import QTimer, QSettings, QEvent
 from PySide6.QtWidgets import QTextEdit as TextEdit, QMenuBar as MenuBar, QStatusBar as StatusBar, QMessageBox as MessageBox
 from PySide6.QtGui import QAction as Action, QFont as Font, QIcon as Icon, QTextCursor as TextCursor, QTextCharFormat as TextCharFormat, QGuiApplication as GuiApplication
 
 short_message_duration = 2000 # milliseconds
+modification_check_delay = 150 # milliseconds of idle before the title's "*" is brought up to date
+large_file_threshold = 64 * 1024 * 1024 # bytes, larger plain text files open in the LargeFileView
+emphasis_slice_duration = 0.008 # seconds of scanning a selection's formats per turn of the event loop
 toolbox_name = "TOOLBOX"
 text_editor_name = "Texty"
 toolbox_text_editor_title = toolbox_name + " | " + text_editor_name
 
+startup_profile.mark("imports")
+
+
+def tab_attribute(name):
+    # The window works on the document of the current tab, its state lives on the DocumentTab
+    return property(lambda self: getattr(self.current_tab, name), lambda self, value: setattr(self.current_tab, name, value))
+
+
 class MainWindow(Widgets.QMainWindow):
+    file_path = tab_attribute("file_path")
+    file_name = tab_attribute("file_name")
+    _document_modified = tab_attribute("modified")
+    clean_state = tab_attribute("clean_state")
+    edit_revision = tab_attribute("edit_revision")
+    file_saver = tab_attribute("file_saver")
+    autosave_journal = tab_attribute("autosave_journal")
+    highlighter = tab_attribute("highlighter")
+    undo_history = tab_attribute("undo_history")
+    text_encoding = tab_attribute("text_encoding")
+    large_file_view = tab_attribute("large_file_view")
+
     def __init__(self):
         super().__init__()
 
-        self.document_modified = False
-        self.file_path = None
+        self.tabs = []
+        self.current_tab = None
         self.file_extension = ".txty"
+        self.settings = QSettings(toolbox_name, text_editor_name)
+        self.memory_budget = None # bytes, read from the settings with the first tab
+        self.undo_memory_limit = None
+        self._recent_files = None
 
         #--------------------------------------------------------------
         #> WINDOW
+        # Sized and placed by place_on_screen() before it is shown
         self.set_window_title(toolbox_text_editor_title)
         #self.setGeometry(100, 100, 800, 600)
         #self.showFullScreen()
-        screen_geometry = Widgets.QApplication.primaryScreen().geometry()
-        screen_width = screen_geometry.width()
-        screen_height = screen_geometry.height()
-        self.resize(screen_width, screen_height)
 
         #--------------------------------------------------------------
         #> MENU BAR
-        self.menu_bar = self.menuBar()
-        file_menu = self.menu_bar.addMenu("File")
-
-        new_action = Action("New", self);           new_action.setShortcut(GUI.QKeySequence("Ctrl+N"))
-        open_action = Action("Open", self);         open_action.setShortcut(GUI.QKeySequence("Ctrl+O"))
-        save_action = Action("Save", self);         save_action.setShortcut(GUI.QKeySequence("Ctrl+S"))
-        save_as_action = Action("Save As", self);   save_as_action.setShortcut(GUI.QKeySequence("Ctrl+Shift+S"))
-        
-        file_menu.addAction(new_action);        new_action.triggered.connect(self.new_file)
-        file_menu.addAction(open_action);       open_action.triggered.connect(self.open_file)
-        file_menu.addAction(save_action);       save_action.triggered.connect(self.save_file)
-        file_menu.addAction(save_as_action);    save_as_action.triggered.connect(self.save_file_as)
+        # The menus are filled in by finish_startup() after the first paint, the actions
+        # are added to the window right away so their shortcuts work from the start.
+        # setShortcuts() takes the list overload, setShortcut() would make PySide build
+        # the whole Qt namespace's enums (~30 ms) before the first paint
+        if self.settings.value("window/frameless", False, type=bool):
+            self.menu_bar = MenuBar()
+            self.install_window_shell()
+        else:
+            self.menu_bar = self.menuBar()
+        self.file_menu = self.menu_bar.addMenu("File")
+        self.edit_menu = self.menu_bar.addMenu("Edit")
+        self.view_menu = self.menu_bar.addMenu("View")
+        self.highlighting_actions = {} # rule set name (None for plain) -> checkable action
+        self.startup_finished = False
+
+        new_action = Action("New", self);           new_action.setShortcuts([GUI.QKeySequence("Ctrl+N")])
+        open_action = Action("Open", self);         open_action.setShortcuts([GUI.QKeySequence("Ctrl+O")])
+        save_action = Action("Save", self);         save_action.setShortcuts([GUI.QKeySequence("Ctrl+S")])
+        save_as_action = Action("Save As", self);   save_as_action.setShortcuts([GUI.QKeySequence("Ctrl+Shift+S")])
+        close_tab_action = Action("Close Tab", self); close_tab_action.setShortcuts([GUI.QKeySequence("Ctrl+W")])
+
+        new_action.triggered.connect(self.new_file)
+        open_action.triggered.connect(self.open_file)
+        save_action.triggered.connect(self.save_file)
+        save_as_action.triggered.connect(self.save_file_as)
+        close_tab_action.triggered.connect(lambda: self.close_tab(self.tab_bar.currentIndex()))
+        self.file_menu_actions = [new_action, open_action, save_action, save_as_action, close_tab_action]
+
+        # The QTextEdit's own undo is off, UndoHistory takes these keys over while it has the focus
+        undo_action = Action("Undo", self);         undo_action.setShortcuts([GUI.QKeySequence("Ctrl+Z")])
+        redo_action = Action("Redo", self);         redo_action.setShortcuts([GUI.QKeySequence("Ctrl+Y"), GUI.QKeySequence("Ctrl+Shift+Z")])
+        undo_action.triggered.connect(lambda: self.undo_history.undo())
+        redo_action.triggered.connect(lambda: self.undo_history.redo())
+        go_to_line_action = Action("Go to Line", self); go_to_line_action.setShortcuts([GUI.QKeySequence("Ctrl+G")])
+        find_action = Action("Find", self);         find_action.setShortcuts([GUI.QKeySequence("Ctrl+F")])
+        replace_action = Action("Replace", self);   replace_action.setShortcuts([GUI.QKeySequence("Ctrl+H")])
+        go_to_line_action.triggered.connect(self.go_to_line)
+        find_action.triggered.connect(lambda: self.show_find_replace(False))
+        replace_action.triggered.connect(lambda: self.show_find_replace(True))
+        self.edit_menu_actions = [undo_action, redo_action, go_to_line_action, find_action, replace_action]
+
+        performance_action = Action("Performance", self)
+        performance_action.triggered.connect(self.show_performance_panel)
+        self.view_menu_actions = [performance_action]
+
+        self.addActions(self.file_menu_actions + self.edit_menu_actions)
 
         self.status_bar = StatusBar(self)
         self.setStatusBar(self.status_bar)
 
+        self.file_loader = None
+        self.load_cursor = None
+        self.load_started = 0
+        self.load_timings = {} # phase -> seconds of the current load spent on the GUI thread
+        self.load_progress_bar = Widgets.QProgressBar(self)
+        self.load_progress_bar.setRange(0, 100)
+        self.load_progress_bar.setMaximumWidth(200)
+        self.load_progress_bar.hide()
+        self.cancel_load_button = Widgets.QPushButton("Cancel", self)
+        self.cancel_load_button.setToolTip("Stop opening the file\nShortcut: Esc")
+        self.cancel_load_button.clicked.connect(lambda: self.cancel_loading())
+        self.cancel_load_button.hide()
+        self.undo_memory_label = Widgets.QLabel(self)
+        self.status_bar.addPermanentWidget(self.undo_memory_label)
+        self.status_bar.addPermanentWidget(self.load_progress_bar)
+        self.status_bar.addPermanentWidget(self.cancel_load_button)
+
+        self.cancel_load_action = Action("Cancel Loading", self); self.cancel_load_action.setShortcuts([GUI.QKeySequence("Esc")])
+        self.cancel_load_action.triggered.connect(lambda: self.cancel_loading())
+        self.cancel_load_action.setEnabled(False)
+        self.addAction(self.cancel_load_action)
+
         #--------------------------------------------------------------
         #> TOOLBAR
+        # Icon theme lookups wait for finish_startup(), until then the buttons show their text
         self.toolbar = self.addToolBar("Toolbar")
         self.toolbar.setMovable(False)
         
             #> Bold <#
         self.bold_action = Action("Bold", self)
-        self.bold_action.setIcon(Icon.fromTheme("format-text-bold"))
-        # custom_bold_icon = Icon("DALL-E me.png")
-        # self.bold_action.setIcon(custom_bold_icon)
-        self.bold_action.setShortcut(GUI.QKeySequence("Ctrl+B"))
+        self.bold_action.setShortcuts([GUI.QKeySequence("Ctrl+B")])
         self.bold_action.setToolTip("Make selected text bold\nShortcut: Ctrl+B")
+        self.bold_action.setCheckable(True)
         self.bold_action.triggered.connect(self.make_bold)
 
             #> Italic <#
         self.italic_action = Action("Italic", self)
-        self.italic_action.setIcon(Icon.fromTheme("format-text-italic"))
-        self.italic_action.setShortcut(GUI.QKeySequence("Ctrl+I"))
+        self.italic_action.setShortcuts([GUI.QKeySequence("Ctrl+I")])
         self.italic_action.setToolTip("Make selected text italic\nShortcut: Ctrl+I")
+        self.italic_action.setCheckable(True)
         self.italic_action.triggered.connect(self.make_italic)
 
             #> Underline <#
         self.underline_action = Action("Underline", self)
-        self.underline_action.setIcon(Icon.fromTheme("format-text-underline"))
-        self.underline_action.setShortcut(GUI.QKeySequence("Ctrl+U"))
+        self.underline_action.setShortcuts([GUI.QKeySequence("Ctrl+U")])
         self.underline_action.setToolTip("Make selected text underline\nShortcut: Ctrl+U")
+        self.underline_action.setCheckable(True)
         self.underline_action.triggered.connect(self.make_underline)
 
 
@@ -82,20 +169,120 @@ class MainWindow(Widgets.QMainWindow):
 
         #--------------------------------------------------------------
         #> TEXT EDIT FIELD
-        self.file_name = "Untitled"
-        self.set_window_title(toolbox_text_editor_title + " - " + self.file_name)
-
+        # One editor for all tabs, switching tabs swaps the QTextDocument it shows
         self.text_edit_field = TextEdit(self)
         self.text_edit_field.setGeometry(50, 50, 700, 500)
-        self.cursor = TextCursor(self.text_edit_field.document())
 
         font = GUI.QFont("Courier New", 12)
         self.text_edit_field.setFont(font)
 
+        self.modification_timer = QTimer(self)
+        self.modification_timer.setSingleShot(True)
+        self.modification_timer.setInterval(modification_check_delay)
+        self.modification_timer.timeout.connect(self.refresh_modified_state)
         self.text_edit_field.textChanged.connect(self.on_text_changed)
-        self.text_edit_field.selectionChanged.connect(self.update_toolbar_actions)
+        # Selecting by dragging changes the selection many times per event loop turn, the actions follow once
+        self.selection_emphasis = SelectionEmphasis()
+        self.toolbar_update_timer = QTimer(self)
+        self.toolbar_update_timer.setSingleShot(True)
+        self.toolbar_update_timer.setInterval(0)
+        self.toolbar_update_timer.timeout.connect(self.update_toolbar_actions)
+        self.text_edit_field.selectionChanged.connect(self.toolbar_update_timer.start)
+        self.text_edit_field.currentCharFormatChanged.connect(self.toolbar_update_timer.start)
+
+        # Large plain text files are shown in their tab's LargeFileView on the same stack instead
+        self.central_stack = Widgets.QStackedWidget(self)
+        self.central_stack.addWidget(self.text_edit_field)
+        self.find_replace_panel = None
+        self.performance_panel = None
+        self.editor_probe = None # created when recording starts
 
-        self.setCentralWidget(self.text_edit_field)
+        #--------------------------------------------------------------
+        #> TABS
+        self.tab_bar = Widgets.QTabBar(self)
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setMovable(True)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.currentChanged.connect(self.on_tab_changed)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        self.tab_bar.tabMoved.connect(self.on_tab_moved)
+        self.add_tab()
+        self.cursor = TextCursor(self.text_edit_field.document())
+
+        # The find/replace panel is created on first use, below the stack
+        central_widget = Widgets.QWidget(self)
+        self.central_layout = Widgets.QVBoxLayout(central_widget)
+        self.central_layout.setContentsMargins(0, 0, 0, 0)
+        self.central_layout.setSpacing(0)
+        self.central_layout.addWidget(self.tab_bar)
+        self.central_layout.addWidget(self.central_stack)
+        self.setCentralWidget(central_widget)
+
+        # The tab bar is on screen whatever the tab shows, its first paint starts the deferred work
+        self.tab_bar.installEventFilter(self)
+
+
+    def eventFilter(self, watched, event):
+        if watched is self.tab_bar and event.type() == QEvent.Paint and not self.startup_finished:
+            self.tab_bar.removeEventFilter(self)
+            startup_profile.mark("first paint")
+            QTimer.singleShot(0, self.finish_startup)
+        return super().eventFilter(watched, event)
+
+    def finish_startup(self):
+        # Everything not needed for the first frame
+        if self.startup_finished:
+            return
+        self.startup_finished = True
+        self.bold_action.setIcon(Icon.fromTheme("format-text-bold"))
+        # custom_bold_icon = Icon("DALL-E me.png")
+        # self.bold_action.setIcon(custom_bold_icon)
+        self.italic_action.setIcon(Icon.fromTheme("format-text-italic"))
+        self.underline_action.setIcon(Icon.fromTheme("format-text-underline"))
+        self.file_menu.addActions(self.file_menu_actions[:2])
+        self.recent_menu = self.file_menu.addMenu("Open Recent")
+        self.recent_menu.setToolTipsVisible(True)
+        self.recent_menu.aboutToShow.connect(self.update_recent_menu)
+        self.file_menu.addActions(self.file_menu_actions[2:])
+        self.edit_menu.addActions(self.edit_menu_actions)
+        highlighting_menu = self.view_menu.addMenu("Highlighting")
+        highlighting_group = GUI.QActionGroup(self)
+        for name in [None, *rule_sets]:
+            action = Action(name or "None", highlighting_group)
+            action.setCheckable(True)
+            action.triggered.connect(lambda checked, name=name: self.set_highlighting(name))
+            highlighting_menu.addAction(action)
+            self.highlighting_actions[name] = action
+        self.update_highlighting_actions()
+        self.view_menu.addActions(self.view_menu_actions)
+        # PySide builds enum types when they are first used, those a key press needs are built now rather than on the first one
+        from PySide6 import QtCore
+        from undo_history import editing_key_sequences
+        editing_key_sequences()
+        QtCore.Qt.Key_Backspace
+        startup_profile.mark("icons and menus")
+
+        if startup_profile.enabled:
+            # The recovery prompt would wait for the user, it is left out of the measurement
+            startup_profile.report()
+            Widgets.QApplication.exit(0)
+            return
+        self.offer_recovery()
+
+    def place_on_screen(self):
+        # Full size of the primary screen, centred on the second or third screen when there is one
+        screen_geometry = Widgets.QApplication.primaryScreen().geometry()
+        self.resize(screen_geometry.width(), screen_geometry.height())
+
+        screens = GuiApplication.screens()
+        if len(screens) > 1:
+            screen_geometry = screens[min(len(screens), 3) - 1].geometry()
+            x = screen_geometry.x() + (screen_geometry.width() - self.width()) // 2
+            y = screen_geometry.y() + (screen_geometry.height() - self.height()) // 2
+            self.move(x, y)
+        else:
+            print("Only one monitor detected, opening on the primary screen.")
 
 
     # def clear_formatting(self):
@@ -106,55 +293,115 @@ class MainWindow(Widgets.QMainWindow):
     #     cursor.setCharFormat(TextCharFormat())
 
     def clear_formatting(self):
-        cursor = self.text_edit_field.textCursor()
-        cursor.select(TextCursor.Document)
-        char_format = TextCharFormat()
-        cursor.setCharFormat(char_format)
+        self.undo_history.change_format(0, self.text_edit_field.document().characterCount() - 1, {}, replace=True)
 
 
     def make_bold(self):
-        print("Bold action triggered")
-        cursor = self.text_edit_field.textCursor()
-        if not cursor.hasSelection():
-            return
-        char_format = TextCharFormat()
-        char_format.setFontWeight(Font.Bold if not cursor.charFormat().fontWeight() == Font.Bold else Font.Normal)
-        cursor.mergeCharFormat(char_format)
+        self.toggle_emphasis(0, "bold")
 
     def make_italic(self):
-        print("Italic action triggered")
-        cursor = self.text_edit_field.textCursor()
-        if not cursor.hasSelection():
-            return
-
-        char_format = TextCharFormat()
-        char_format.setFontItalic(not cursor.charFormat().fontItalic())
-        cursor.mergeCharFormat(char_format)
+        self.toggle_emphasis(1, "italic")
 
     def make_underline(self):
-        print("Underline action triggered")
+        self.toggle_emphasis(2, "underline")
+
+    def toggle_emphasis(self, index, name):
+        # Off when all of the selection has the format already, on for all of it otherwise; one undo step
         cursor = self.text_edit_field.textCursor()
         if not cursor.hasSelection():
+            self.update_toolbar_actions()
             return
-
-        char_format = TextCharFormat()
-        char_format.setFontUnderline(not cursor.charFormat().fontUnderline())
-        cursor.mergeCharFormat(char_format)
+        document = self.text_edit_field.document()
+        start, end = cursor.selectionStart(), cursor.selectionEnd()
+        from instrumentation import metrics
+        with metrics.measure(f"format: {name}", characters=end - start):
+            emphasis = list(self.selection_emphasis(document, start, end))
+            emphasis[index] = not emphasis[index]
+            self.undo_history.change_format(start, end, {name: emphasis[index]}, styles=self.selection_emphasis.styles)
+        # What the selection has now is known without looking at it again
+        self.selection_emphasis.remember(document, start, end, emphasis)
+        self.update_toolbar_actions()
+
+
+    def install_window_shell(self):
+        # With "window/frameless" set, Texty draws its own title bar above the menu bar and
+        # WindowShell moves and resizes the window. Imported only then, window_shell builds
+        # the Qt namespace's enums
+        from window_shell import TitleBar, WindowShell
+        self.title_bar = TitleBar(self)
+        menu_widget = Widgets.QWidget(self)
+        layout = Widgets.QVBoxLayout(menu_widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        layout.addWidget(self.title_bar)
+        layout.addWidget(self.menu_bar)
+        self.setMenuWidget(menu_widget)
+        self.window_shell = WindowShell(self, self.title_bar)
 
 
     def set_window_title(self, title):
         self.setWindowTitle(title)
+        if self.current_tab is not None:
+            self.update_tab_label(self.current_tab)
 
 
     def on_text_changed(self):
-        if not self.document_modified:
-            self.document_modified = True
+        # Kept O(1) per keystroke, the clean/dirty check runs once typing pauses
+        self.edit_revision += 1
+        self.modification_timer.start()
+
+    @property
+    def document_modified(self):
+        if self.modification_timer.isActive():
+            self.modification_timer.stop()
+            self.refresh_modified_state()
+        return self._document_modified
+
+    @document_modified.setter
+    def document_modified(self, modified):
+        # Marking the document clean makes the current undo step the clean one, undoing
+        # or redoing back to it makes the document clean again
+        self.modification_timer.stop()
+        document = self.text_edit_field.document()
+        document.setModified(modified)
+        self._document_modified = modified
+        if modified:
+            self.clean_state.forget()
+        else:
+            self.clean_state.mark_clean()
+
+    def refresh_modified_state(self):
+        if self.file_loader is not None:
+            return
+        document = self.text_edit_field.document()
+        modified = document.isModified()
+
+        # Edited back to the saved text by hand rather than by undo, compare the content itself
+        if modified and self.clean_state.matches():
+            modified = False
+            document.setModified(False)
+
+        if modified != self._document_modified:
+            self._document_modified = modified
             self.update_window_title()
 
     def update_toolbar_actions(self):
+        # Checked when the format applies to all of the selection, or to what is typed at the cursor
         cursor = self.text_edit_field.textCursor()
-
-        is_bold = cursor.charFormat().fontWeight() == Font.Bold
+        if cursor.hasSelection():
+            deadline = time.perf_counter() + emphasis_slice_duration
+            emphasis = self.selection_emphasis(self.text_edit_field.document(), cursor.selectionStart(), cursor.selectionEnd(),
+                                               deadline)
+            if emphasis is None:
+                # A long scan goes on in later turns, until then the actions show the format at the cursor
+                self.toolbar_update_timer.start()
+                char_format = cursor.charFormat()
+                emphasis = (char_format.fontWeight() == Font.Bold, char_format.fontItalic(), char_format.fontUnderline())
+        else:
+            char_format = self.text_edit_field.currentCharFormat()
+            emphasis = (char_format.fontWeight() == Font.Bold, char_format.fontItalic(), char_format.fontUnderline())
+        for action, checked in zip((self.bold_action, self.italic_action, self.underline_action), emphasis):
+            action.setChecked(checked)
 
     def update_window_title(self):
         modified_indicator = "*" if self.document_modified else ""
@@ -162,24 +409,11 @@ class MainWindow(Widgets.QMainWindow):
 
 
     def new_file(self):
-        if self.document_modified:
-            reply = self.display_unsaved_changes_message(None)
-            if reply == MessageBox.Cancel:
-                return
-        self.text_edit_field.clear()
-        self.document_modified = False
-
-        self.file_name = "Untitled"
-        self.set_window_title(toolbox_text_editor_title + " - " + self.file_name)
-
+        self.select_tab(self.add_tab())
         self.status_bar.showMessage("New file created", short_message_duration)
 
 
     def open_file(self):
-        if self.document_modified:
-            reply = self.display_unsaved_changes_message(None)
-            if reply == MessageBox.Cancel:
-                return
         file_path, _ = Widgets.QFileDialog.getOpenFileName(self, "Open File",
                                                                  "",
                                                                  "All supported files (*.txty *.txt);;" \
@@ -187,143 +421,683 @@ class MainWindow(Widgets.QMainWindow):
                                                                  "Text Files (*.txt)" \
                                                                  "All Files (*)"
                                                                  )
+        if file_path: #checks whether a file was selected
+            self.open_path(file_path)
+
+    def update_recent_menu(self):
+        # Built each time the menu opens, the index only changes when files are opened or saved
+        self.recent_menu.clear()
+        for entry in self.recent_files.files:
+            action = self.recent_menu.addAction(os.path.basename(entry.path))
+            action.setToolTip(entry.path + ("\n" + entry.preview if entry.preview else ""))
+            action.triggered.connect(lambda checked, file_path=entry.path: self.open_recent(file_path))
+        if not self.recent_files.files:
+            self.recent_menu.addAction("No Recent Files").setEnabled(False)
+            return
+        self.recent_menu.addSeparator()
+        self.recent_menu.addAction("Clear Recent").triggered.connect(self.recent_files.clear)
+
+    def open_recent(self, file_path):
+        if not os.path.exists(file_path):
+            self.recent_files.remove(file_path)
+            self.status_bar.showMessage(f"File not found : {file_path}", short_message_duration)
+            return
+        self.open_path(file_path)
+
+    def open_path(self, file_path):
+        # Opens in a tab of its own, unless the file is open already or the current tab is an empty Untitled one
+        file_extension = os.path.splitext(file_path)[1].lower()
+
+        if file_extension not in (".txty", ".txt"):
+            self.status_bar.showMessage(f"Unsupported file type: {file_path}", short_message_duration)
+            return
+
+        for tab in self.tabs:
+            if tab.file_path and os.path.abspath(tab.file_path) == os.path.abspath(file_path):
+                self.select_tab(tab)
+                return
+
+        if self.current_tab.is_pristine():
+            self.restore_recent_view(self.current_tab, file_path)
+            self.load_tab_file(file_path)
+        else:
+            self.select_tab(self.add_tab(file_path, os.path.basename(file_path)))
+
+    def load_tab_file(self, file_path):
+        file_extension = os.path.splitext(file_path)[1].lower()
+
+        if (file_extension == ".txt" and os.path.getsize(file_path) > large_file_threshold
+                and file_encoding(file_path).ascii_compatible):
+            self.open_large_file(file_path)
+            return
+
+        self.close_large_file()
+        self.start_loading(file_path)
         self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.set_window_title(toolbox_text_editor_title + " - " + self.file_name)
+        self.document_modified = False
 
-        if file_path: #checks whether a file was selected
-            file_extension = os.path.splitext(file_path)[1].lower()
-
-            if file_extension == ".txty":
-                with open(file_path, 'r') as file:
-                    data = json.load(file)
-                    content = data['content']
-                    formatting = data.get('formatting', [])
-                    self.clear_formatting()
-                    self.text_edit_field.setPlainText(content)
-
-                    cursor = self.text_edit_field.textCursor()
-                    for format_data in formatting:
-                        start, end = format_data["range"]
-                        cursor.setPosition(start)
-                        cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
-                        char_format = TextCharFormat()
-
-                        if format_data.get("bold", False):
-                            char_format.setFontWeight(Font.Bold)
-
-                        if format_data.get("italic", False):
-                            char_format.setFontItalic(True)
-
-                        if format_data.get("underline", False):
-                            char_format.setFontUnderline(True)
-
-                        cursor.setCharFormat(char_format)
-
-                    self.status_bar.showMessage(f"Opened file : {file_path}", short_message_duration)
-
-            elif file_extension == ".txt":
-                with open(file_path, 'r') as file:
-                    content = file.read()
-                self.clear_formatting()
-                self.text_edit_field.setPlainText(content)
-                self.status_bar.showMessage(f"Opened file : {file_path}", short_message_duration)
-            else:
-                self.status_bar.showMessage(f"Unsupported file type: {file_path}", short_message_duration)
+    def add_tab(self, file_path=None, file_name="Untitled"):
+        # Imported with the first tab rather than with the window's module, like the views and panels
+        from document_tab import DocumentTab, memory_budget
+        from undo_history import undo_memory_limit
+        if self.memory_budget is None:
+            self.memory_budget = int(self.settings.value("tabs/memory_budget", memory_budget))
+            self.undo_memory_limit = int(self.settings.value("undo/memory_limit", undo_memory_limit))
+        tab = DocumentTab(self, file_path, file_name)
+        if file_path is not None:
+            self.restore_recent_view(tab, file_path)
+        tab.undo_history.memory_limit = self.undo_memory_limit
+        tab.undo_history.changed.connect(lambda tab=tab: self.update_undo_memory(tab))
+        tab.file_saver.saved.connect(lambda snapshot, tab=tab: self.on_file_saved(tab, snapshot))
+        tab.file_saver.failed.connect(lambda snapshot, message, tab=tab: self.on_file_save_failed(tab, snapshot, message))
+        self.tabs.append(tab)
+        self.tab_bar.addTab(file_name)
+        self.update_tab_label(tab)
+        return tab
+
+    @property
+    def recent_files(self):
+        # Imported and read the first time a file is opened or the Open Recent menu is shown
+        if self._recent_files is None:
+            from recent_files import RecentFiles
+            self._recent_files = RecentFiles()
+        return self._recent_files
+
+    def restore_recent_view(self, tab, file_path):
+        # A file that is unchanged since it was last open comes back where it was left
+        entry = self.recent_files.lookup(file_path)
+        if entry is not None:
+            tab.cursor_position, tab.scroll_position = entry.cursor_position, entry.scroll_position
+
+    def remember_recent_views(self, tabs):
+        for tab in tabs:
+            if tab.file_path is None:
+                continue
+            if tab is self.current_tab and tab.is_loaded() and not self.in_large_file_mode():
+                tab.cursor_position = self.text_edit_field.textCursor().position()
+                tab.scroll_position = self.text_edit_field.verticalScrollBar().value()
+            self.recent_files.remember_view(tab.file_path, tab.cursor_position, tab.scroll_position)
+        self.recent_files.save()
+
+    def select_tab(self, tab):
+        self.tab_bar.setCurrentIndex(self.tabs.index(tab))
+
+    def update_tab_label(self, tab):
+        index = self.tabs.index(tab)
+        self.tab_bar.setTabText(index, tab.file_name + (" *" if tab.modified else ""))
+        self.tab_bar.setTabToolTip(index, tab.file_path or tab.file_name)
+
+    def update_undo_memory(self, tab):
+        if tab is not self.current_tab:
+            return
+        history = tab.undo_history
+        memory = history.memory
+        self.undo_memory_label.setText(f"Undo: {memory / 1024 / 1024:.1f} MB" if memory >= 1024 * 1024 else f"Undo: {memory / 1024:.0f} KB")
+        self.undo_memory_label.setToolTip(f"{len(history.undo_steps)} undo and {len(history.redo_steps)} redo steps, "
+                                          f"limit {history.memory_limit / 1024 / 1024:.0f} MB")
+
+    def set_highlighting(self, name):
+        self.highlighter.set_rule_set(rule_sets.get(name))
+
+    def update_highlighting_actions(self):
+        # The menu shows the current tab's rule set, it is empty until finish_startup()
+        rule_set = self.highlighter.rule_set
+        action = self.highlighting_actions.get(rule_set.name if rule_set else None)
+        if action is not None:
+            action.setChecked(True)
+
+    def on_tab_moved(self, from_index, to_index):
+        self.tabs.insert(to_index, self.tabs.pop(from_index))
+
+    def on_tab_changed(self, index):
+        if index < 0 or self.tabs[index] is self.current_tab:
+            return
+        self.leave_current_tab()
+        self.current_tab = self.tabs[index]
+        self.show_current_tab()
+
+    def leave_current_tab(self):
+        tab = self.current_tab
+        if tab is None:
+            return
+        tab.highlighter.set_view(None)
+        tab.undo_history.set_view(None)
+        if self.file_loader is not None:
+            # A tab that is still being read is read again when it is shown next
+            self.stop_loading()
+            tab.release_document()
+            return
+        self.document_modified # settles a pending clean/dirty check while the document is still shown
+        tab.cursor_position = self.text_edit_field.textCursor().position()
+        tab.scroll_position = self.text_edit_field.verticalScrollBar().value()
+
+    def show_current_tab(self):
+        tab = self.current_tab
+        tab.activate()
+        unloaded = not tab.is_loaded()
+        if unloaded:
+            tab.create_document(self.text_edit_field.font()).modificationChanged.connect(self.modification_timer.start)
+        self.text_edit_field.blockSignals(True)
+        self.text_edit_field.setDocument(tab.document)
+        self.text_edit_field.blockSignals(False)
+        tab.highlighter.set_view(self.text_edit_field)
+        tab.undo_history.set_view(self.text_edit_field)
+        self.update_highlighting_actions()
+        self.update_undo_memory(tab)
+        if self.find_replace_panel is not None:
+            self.find_replace_panel.set_document(tab.document)
+
+        if unloaded and (tab.packed is not None or tab.file_path is not None):
+            self.reload_tab(tab)
+        else:
+            self.restore_view(tab)
+
+        if self.in_large_file_mode():
+            self.central_stack.setCurrentWidget(tab.large_file_view)
+            self.toolbar.setEnabled(False)
+            self.set_window_title(toolbox_text_editor_title + " - " + self.file_name + " [read-only]")
+        else:
+            self.central_stack.setCurrentWidget(self.text_edit_field)
+            self.toolbar.setEnabled(True)
+            self.update_window_title()
+        self.enforce_memory_budget()
+
+    def reload_tab(self, tab):
+        if tab.packed is not None:
+            # Unloaded in memory, the dirty state and the saved state to compare with survive the round trip
+            modified, clean_state = tab.modified, tab.clean_state.keep()
+            self.load_formatted_content(*tab.unpack())
+            if modified:
+                self.document_modified = True
+                tab.clean_state.restore(clean_state)
+            self.restore_view(tab)
+        elif tab.large_file_view is None:
+            self.load_tab_file(tab.file_path)
+
+    def restore_view(self, tab):
+        cursor = self.text_edit_field.textCursor()
+        cursor.setPosition(min(tab.cursor_position, tab.document.characterCount() - 1))
+        self.text_edit_field.setTextCursor(cursor)
+        self.text_edit_field.verticalScrollBar().setValue(tab.scroll_position)
+
+    def enforce_memory_budget(self):
+        # Least recently shown tabs are unloaded first, the current one never
+        loaded = [tab for tab in self.tabs if tab.is_loaded()]
+        total = sum(tab.estimated_size() for tab in loaded)
+        for tab in sorted(loaded, key=lambda tab: tab.last_activated):
+            if total <= self.memory_budget:
+                break
+            if tab is self.current_tab:
+                continue
+            total -= tab.estimated_size()
+            tab.unload()
+
+    def close_tab(self, index):
+        if index < 0:
+            return
+        tab = self.tabs[index]
+        if tab is self.current_tab and self.file_loader is not None:
+            self.stop_loading()
+        else:
+            self.remember_recent_views([tab])
+        if self.document_modified if tab is self.current_tab else tab.modified:
+            self.select_tab(tab)
+            if self.display_unsaved_changes_message(None) == MessageBox.Cancel:
+                return
+        tab.close()
+        if tab is self.current_tab:
+            self.current_tab = None
+        self.tabs.pop(index)
+        self.tab_bar.removeTab(index)
+        if not self.tabs:
+            self.select_tab(self.add_tab())
+
+    def save_session(self):
+        file_tabs = [tab for tab in self.tabs if tab.file_path]
+        self.settings.setValue("session/files", [tab.file_path for tab in file_tabs])
+        self.settings.setValue("session/current", file_tabs.index(self.current_tab) if self.current_tab in file_tabs else 0)
+        self.settings.setValue("session/highlighting", [tab.highlighter.rule_set.name if tab.highlighter.rule_set else "" for tab in file_tabs])
+
+    def restore_session(self):
+        # Every tab is created unloaded, only the one that ends up current is read
+        file_paths = self.settings.value("session/files", []) or []
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
+        highlighting = self.settings.value("session/highlighting", []) or []
+        if isinstance(highlighting, str):
+            highlighting = [highlighting]
+        highlighting = dict(zip(file_paths, highlighting))
+        file_paths = [file_path for file_path in file_paths if os.path.exists(file_path)]
+        if not file_paths or not self.current_tab.is_pristine():
+            return
+
+        self.tab_bar.blockSignals(True)
+        restored = [self.add_tab(file_path, os.path.basename(file_path)) for file_path in file_paths]
+        for tab in restored:
+            tab.highlighter.set_rule_set(rule_sets.get(highlighting.get(tab.file_path)))
+        initial_tab = self.tabs.pop(0)
+        self.tab_bar.removeTab(0)
+        initial_tab.close()
+        self.current_tab = None
+        self.tab_bar.blockSignals(False)
+
+        current = min(max(0, int(self.settings.value("session/current", 0))), len(restored) - 1)
+        self.tab_bar.setCurrentIndex(current)
+        self.on_tab_changed(current)
+
+    def open_large_file(self, file_path):
+        # Read-only, memory-mapped view, the document itself is emptied to free its memory
+        self.cancel_loading()
+        self.load_formatted_content("", [], [])
+        self.autosave_journal.reset()
+        if self.large_file_view is None:
+            from large_file_view import LargeFileView
+            self.large_file_view = LargeFileView(self)
+            self.large_file_view.line_count_changed.connect(self.on_large_file_indexed)
+            self.central_stack.addWidget(self.large_file_view)
+        self.large_file_view.open(file_path)
+        self.recent_files.opened(file_path, os.stat(file_path))
+        self.central_stack.setCurrentWidget(self.large_file_view)
+        self.large_file_view.setFocus()
+        self.toolbar.setEnabled(False)
+
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.set_window_title(toolbox_text_editor_title + " - " + self.file_name + " [read-only]")
+        self.document_modified = False
+
+    def on_large_file_indexed(self, line_count, done):
+        if done:
+            self.status_bar.showMessage(f"Opened large file read-only : {line_count:,} lines", short_message_duration)
+        else:
+            self.status_bar.showMessage(f"Indexing lines : {line_count:,}")
+
+    def close_large_file(self):
+        if self.large_file_view is None or self.large_file_view.file_path is None:
+            return
+        self.large_file_view.close_file()
+        self.central_stack.setCurrentWidget(self.text_edit_field)
+        self.toolbar.setEnabled(True)
+
+    def show_find_replace(self, replace):
+        if self.in_large_file_mode():
+            self.status_bar.showMessage("Find is not available for large files", short_message_duration)
+            return
+        if self.find_replace_panel is None:
+            from find_replace import FindReplacePanel
+            self.find_replace_panel = FindReplacePanel(self.text_edit_field,
+                                                     lambda starts, lengths, texts: self.undo_history.replace_ranges(starts, lengths, texts),
+                                                     self.status_bar, self)
+            self.central_layout.addWidget(self.find_replace_panel)
+        self.find_replace_panel.open_panel(replace)
+
+    def show_performance_panel(self):
+        # Recording starts the first time the panel is shown, its checkbox turns it off and on
+        if self.performance_panel is None:
+            from PySide6.QtCore import Qt
+            from instrumentation import InstrumentationPanel
+            self.start_recording()
+            self.performance_panel = InstrumentationPanel(self.editor_probe, self)
+            self.addDockWidget(Qt.BottomDockWidgetArea, self.performance_panel)
+        self.performance_panel.show()
+        self.performance_panel.raise_()
+
+    def start_recording(self):
+        # The recorder and its probe are imported when recording starts, not before the first paint
+        if self.editor_probe is None:
+            from instrumentation import EditorProbe
+            self.editor_probe = EditorProbe(self.text_edit_field, self.document_memory, self)
+        self.editor_probe.set_enabled(True)
+
+    def document_memory(self):
+        # Estimated the way the memory budget counts it, packed tabs by their compressed size
+        return {"documents": sum(tab.estimated_size() for tab in self.tabs),
+                "packed tabs": sum(len(tab.packed) for tab in self.tabs if tab.packed is not None)}
+
+    def in_large_file_mode(self):
+        return self.large_file_view is not None and self.large_file_view.file_path is not None
+
+    def go_to_line(self):
+        if self.in_large_file_mode():
+            maximum = self.large_file_view.line_count
+        else:
+            maximum = self.text_edit_field.document().blockCount()
+        line_number, accepted = Widgets.QInputDialog.getInt(self, "Go to Line", f"Line number (1 - {maximum}):", 1, 1, maximum)
+        if not accepted:
+            return
+
+        if self.in_large_file_mode():
+            self.large_file_view.go_to_line(line_number)
+        else:
+            block = self.text_edit_field.document().findBlockByNumber(line_number - 1)
+            cursor = self.text_edit_field.textCursor()
+            cursor.setPosition(block.position())
+            self.text_edit_field.setTextCursor(cursor)
+            self.text_edit_field.ensureCursorVisible()
+
+    def start_loading(self, file_path):
+        # The file is read and decoded by a FileLoader thread. Plain text is appended
+        # chunk by chunk as it arrives, the editor stays read-only until the load is done.
+        self.cancel_loading()
+        self.load_formatted_content("", [], [])
+        self.text_edit_field.setReadOnly(True)
+        self.load_cursor = TextCursor(self.text_edit_field.document())
+        self.load_started = time.perf_counter()
+        self.load_timings = {}
+
+        from file_loader import FileLoader # imported with the first file opened
+        # A JSON .txty file is parsed once, unchanged it is read from its snapshot after that
+        snapshot_path = None
+        entry = self.recent_files.lookup(file_path)
+        if file_path.lower().endswith(".txty"):
+            snapshot_path = self.recent_files.snapshot_path(entry if entry is not None and entry.snapshot else file_path)
+        self.file_loader = FileLoader(file_path, self, snapshot_path, cached=entry is not None and entry.snapshot is not None)
+        self.file_loader.text_loaded.connect(self.on_text_loaded)
+        self.file_loader.document_loaded.connect(self.on_document_loaded)
+        self.file_loader.restarted.connect(self.on_loading_restarted)
+        self.file_loader.progress.connect(self.on_loading_progress)
+        self.file_loader.finished.connect(self.on_loading_finished)
+
+        self.load_progress_bar.setValue(0)
+        self.load_progress_bar.show()
+        self.cancel_load_button.show()
+        self.cancel_load_action.setEnabled(True)
+        self.status_bar.showMessage(f"Opening file : {file_path}")
+        self.file_loader.start()
+
+    def is_current_loader(self):
+        # Chunks that were queued before a load got cancelled may still arrive
+        return self.file_loader is not None and self.sender() is self.file_loader and not self.file_loader.cancelled
+
+    def on_text_loaded(self, chunk):
+        if not self.is_current_loader():
+            return
+        self.text_edit_field.blockSignals(True)
+        self.autosave_journal.paused = True
+        self.highlighter.paused = True
+        started = time.perf_counter()
+        self.load_cursor.movePosition(TextCursor.MoveOperation.End)
+        self.load_cursor.insertText(chunk)
+        self.load_timings["insert text"] = self.load_timings.get("insert text", 0) + time.perf_counter() - started
+        self.autosave_journal.paused = False
+        self.highlighter.paused = False
+        self.text_edit_field.blockSignals(False)
+
+    def on_loading_restarted(self):
+        # The detected encoding failed further into the file, it is read again in another one
+        if not self.is_current_loader():
+            return
+        self.text_edit_field.blockSignals(True)
+        self.autosave_journal.paused = True
+        self.highlighter.paused = True
+        self.load_cursor.select(TextCursor.SelectionType.Document)
+        self.load_cursor.removeSelectedText()
+        self.autosave_journal.paused = False
+        self.highlighter.paused = False
+        self.text_edit_field.blockSignals(False)
+
+    def on_document_loaded(self, data):
+        if not self.is_current_loader():
+            return
+        started = time.perf_counter()
+        self.load_formatted_content(data["content"], data["styles"], data["formatting"])
+        self.load_timings["apply formatting"] = time.perf_counter() - started
+
+    def on_loading_progress(self, bytes_read, total_bytes):
+        if not self.is_current_loader():
+            return
+        self.load_progress_bar.setValue(int(bytes_read * 100 / total_bytes) if total_bytes else 100)
+
+    def on_loading_finished(self):
+        if not self.is_current_loader():
+            return
+        if self.file_loader.error:
+            # Never leave a partly loaded document that could be saved over the file
+            self.cancel_loading(f"Could not open file : {self.file_loader.error}")
+            return
+        file_path = self.file_loader.file_path
+        self.text_encoding = self.file_loader.text_encoding
+        from instrumentation import metrics
+        metrics.record_phases("open", {**self.file_loader.timings, **self.load_timings, "total": time.perf_counter() - self.load_started},
+                              extension=self.file_loader.file_extension, bytes=self.file_loader.total_size)
+        self.recent_files.opened(file_path, self.file_loader.stat, self.text_edit_field.document().firstBlock().text(),
+                                 self.file_loader.snapshot_written)
+        self.finish_loading()
+        self.autosave_journal.reset(file_path, self.file_name)
+        self.restore_view(self.current_tab)
+        self.status_bar.showMessage(f"Opened file : {file_path}", short_message_duration)
+        self.enforce_memory_budget()
+
+    def cancel_loading(self, message="Loading cancelled"):
+        if self.file_loader is None:
+            return
+        self.stop_loading()
+
+        self.load_formatted_content("", [], [])
+        self.file_path = None
+        self.file_name = "Untitled"
+        self.text_encoding = None
+        self.set_window_title(toolbox_text_editor_title + " - " + self.file_name)
+        self.autosave_journal.reset()
+        self.status_bar.showMessage(message, short_message_duration)
+
+    def stop_loading(self):
+        self.file_loader.cancel()
+        self.file_loader.wait()
+        self.finish_loading()
+
+    def finish_loading(self):
+        self.file_loader.deleteLater()
+        self.file_loader = None
+        self.load_cursor = None
+        self.load_progress_bar.hide()
+        self.cancel_load_button.hide()
+        self.cancel_load_action.setEnabled(False)
+
+        document = self.text_edit_field.document()
+        self.undo_history.clear()
+        document.setModified(False)
+        self.text_edit_field.setReadOnly(False)
+        self.document_modified = False
+
+    def load_formatted_content(self, content, styles, formatting):
+        # Replaces the whole document in one pass: the text goes in with the default
+        # format, then every non-default run is applied inside a single edit block
+        # while the editor's signals and the undo stack are suspended, so the
+        # document is laid out once and textChanged does not fire per run. Each
+        # entry of the style table is looked up once, runs only index into it.
+        document = self.text_edit_field.document()
+        self.edit_revision += 1
+        self.text_edit_field.blockSignals(True)
+        self.autosave_journal.paused = True
+        self.highlighter.paused = True
+        self.undo_history.paused = True
+        try:
+            document.setPlainText(content)
+            end_position = document.characterCount() - 1
+
+            char_formats = [None] * len(styles) # None for plain text, which setPlainText() already gave everything
+            for index, style_data in enumerate(styles):
+                style = style_from_dict(style_data)
+                if any(style):
+                    char_formats[index] = char_format_from_style_key(style)
+
+            cursor = TextCursor(document)
+            cursor.beginEditBlock()
+            for format_data in formatting:
+                char_format = char_formats[format_data["style"]]
+                if char_format is None:
+                    continue
+                start, end = format_data["range"]
+                start, end = max(0, start), min(end, end_position)
+                if start >= end:
+                    continue
+
+                cursor.setPosition(start)
+                cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
+                cursor.setCharFormat(char_format)
+            cursor.endEditBlock()
+        finally:
+            self.undo_history.paused = False
+            self.undo_history.clear()
+            self.autosave_journal.paused = False
+            self.highlighter.paused = False
+            self.text_edit_field.blockSignals(False)
+
+        self.text_edit_field.setCurrentCharFormat(TextCharFormat())
+        document.setModified(False)
+        self.document_modified = False
 
-            self.file_name = os.path.basename(file_path)
-            self.set_window_title(toolbox_text_editor_title + " - " + self.file_name)
-            self.document_modified = False
-    
     def save_file(self):
+        if self.in_large_file_mode():
+            self.status_bar.showMessage("Large files are opened read-only", short_message_duration)
+            return False
         if not self.file_path:
             file_path, _ = Widgets.QFileDialog.getSaveFileName(self, f"Save File", self.file_name, "Texty Files (*.txty);;Text Files (*.txt);;All Files (*)")
+            if not file_path:
+                return False
             self.file_path = file_path
-        self.write_file(self.file_path)
+        return self.write_file(self.file_path)
 
     def save_file_as(self):
+        if self.in_large_file_mode():
+            self.status_bar.showMessage("Large files are opened read-only", short_message_duration)
+            return False
         file_path, _ = Widgets.QFileDialog.getSaveFileName(self, f"Save File As", self.file_name, "Texty Files (*.txty);;Text Files (*.txt);;All Files (*)")
+        if not file_path:
+            return False
+        if os.path.abspath(file_path) != os.path.abspath(self.file_path or ""):
+            self.text_encoding = None # a new file is written in the default encoding
         self.file_path = file_path
-        self.write_file(self.file_path)
+        return self.write_file(self.file_path)
 
     def write_file(self, file_path):
+        # Only the snapshot is taken here, serializing and writing happen on the
+        # FileSaver thread. The title keeps its "*" until the write has completed.
+        # Returns whether a snapshot was submitted.
         file_extension = os.path.splitext(file_path)[1].lower()
 
         if not file_extension:
             file_path += ".txty"
             file_extension = ".txty"
 
-        content = self.text_edit_field.toPlainText()
-
-        if file_extension == ".txty":
-            data = {
-                "metadata": {"title": self.file_name},
-                "content": content,
-                "formatting": self.get_formatting()
-            }
-            with open(file_path, 'w') as file:
-                json.dump(data, file, indent=4)
-            self.status_bar.showMessage(f"File saved as .txty: {file_path}", short_message_duration)
-        elif file_extension == ".txt":
-            with open(file_path, 'w') as file:
-                file.write(content)
-            self.status_bar.showMessage(f"File saved as .txt: {file_path}", short_message_duration)
-        else:
+        if file_extension not in (".txty", ".txt"):
             self.status_bar.showMessage(f"Unsupported file type: {file_path}", short_message_duration)
-            return
-        
-        self.document_modified = False
-        self.update_window_title()
-
+            return False
+
+        started = time.perf_counter()
+        styles, formatting = self.get_formatting()
+        snapshot = SaveSnapshot(
+            file_path=file_path,
+            file_extension=file_extension,
+            content=self.text_edit_field.toPlainText(),
+            styles=styles,
+            formatting=formatting,
+            metadata={"title": self.file_name},
+            revision=self.edit_revision,
+            text_encoding=self.text_encoding if file_extension == ".txt" else None
+        )
+        snapshot.timings["snapshot"] = time.perf_counter() - started
+        self.file_saver.submit(snapshot)
+        self.status_bar.showMessage(f"Saving : {file_path}")
+        return True
+
+    def on_file_saved(self, tab, snapshot):
+        from instrumentation import metrics
+        metrics.record_phases("save", snapshot.timings, extension=snapshot.file_extension, characters=len(snapshot.content))
+        self.status_bar.showMessage(f"File saved as {snapshot.file_extension}: {snapshot.file_path}", short_message_duration)
+        if snapshot.file_extension == ".txt" and snapshot.text_encoding is not tab.text_encoding and snapshot.file_path == tab.file_path:
+            # The file's encoding could not hold the text, it was written as UTF-8 and stays UTF-8
+            self.status_bar.showMessage(f"Saved as UTF-8, {tab.text_encoding.encoding} cannot hold all of the text: {snapshot.file_path}", short_message_duration * 2)
+            tab.text_encoding = snapshot.text_encoding
+        try:
+            self.recent_files.opened(snapshot.file_path, os.stat(snapshot.file_path), snapshot.content.partition("\n")[0])
+        except OSError:
+            pass
+        if snapshot.revision == tab.edit_revision:
+            if tab is self.current_tab:
+                self.modification_timer.stop()
+            tab.mark_saved(snapshot)
+            if tab is self.current_tab:
+                self.update_window_title()
+            elif tab in self.tabs:
+                self.update_tab_label(tab)
+
+    def on_file_save_failed(self, tab, snapshot, message):
+        self.status_bar.showMessage(f"Could not save file : {message}", short_message_duration)
 
     def get_formatting(self):
-        formatting = []
-        cursor = self.text_edit_field.textCursor()
-        cursor.movePosition(TextCursor.MoveOperation.Start)
+        # (styles, formatting) in the .txty layout
+        started = time.perf_counter()
+        styles, formatting = document_formatting(self.text_edit_field.document())
+        from instrumentation import metrics
+        metrics.record("get_formatting", time.perf_counter() - started, runs=len(formatting))
+        return styles, formatting
 
-        current_format = None
-        start_position = None
-
-        while True:
-            if cursor.position() >= self.text_edit_field.document().characterCount() - 1:
-                break
+    def closeEvent(self, event):
+        if self.file_loader is not None:
+            self.stop_loading()
+            self.current_tab.release_document()
+        for tab in list(self.tabs):
+            if self.document_modified if tab is self.current_tab else tab.modified:
+                self.select_tab(tab)
+                self.display_unsaved_changes_message(event)
+                if not event.isAccepted():
+                    return
+        event.accept()
+
+        # Let saves that are still being written finish before the window goes away
+        self.save_session()
+        self.remember_recent_views(self.tabs)
+        for tab in self.tabs:
+            tab.close()
+
+    def offer_recovery(self):
+        # Every document of the crashed editor had its own session, each is recovered into a tab
+        recovered = []
+        for session_directory in find_orphaned_sessions():
+            session = read_session(session_directory)
+            if session is None:
+                remove_session(session_directory)
+            else:
+                recovered.append((session_directory, session))
+        if not recovered:
+            return
 
-            # Get the character's format
-            char_format = cursor.charFormat()
-            new_format = {
-                "bold": char_format.fontWeight() == Font.Bold,
-                "italic": char_format.fontItalic(),
-                "underline": char_format.fontUnderline()
-            }
-
-            # Check if the format has changed
-            if current_format != new_format:
-                # Save the previous range if a format was being tracked
-                if current_format is not None and start_position is not None:
-                    formatting.append({
-                        **current_format,
-                        "range": [start_position, cursor.position()]
-                    })
-                
-                # Update the current format and start position
-                current_format = new_format
-                start_position = cursor.position()
-            
-            # Move to the next character
-            cursor.movePosition(TextCursor.MoveOperation.NextCharacter)
-
-        # Handle the final range
-        if current_format is not None and start_position is not None:
-            formatting.append({
-                **current_format,
-                "range": [start_position, cursor.position()]
-            })
-
-        return formatting
+        file_names = ", ".join(header["file_name"] for _, (header, *_) in recovered)
+        reply = MessageBox.question(
+            self,
+            "Recover Unsaved Changes",
+            f"Texty did not close properly. Do you want to recover the unsaved changes to {file_names}?",
+            MessageBox.Yes | MessageBox.No,
+            MessageBox.Yes
+        )
+        if reply != MessageBox.Yes:
+            for session_directory, _ in recovered:
+                remove_session(session_directory)
+            return
 
-    def closeEvent(self, event):
-        if self.document_modified:
-            self.display_unsaved_changes_message(event)
-        else:
-            event.accept()
+        for session_directory, (header, content, styles, formatting, deltas) in recovered:
+            if not self.current_tab.is_pristine():
+                self.select_tab(self.add_tab())
+            self.autosave_journal.adopt(session_directory, header["file_path"], header["file_name"])
+            self.load_formatted_content(content, styles, formatting)
+            self.autosave_journal.paused = True
+            apply_deltas(self.text_edit_field.document(), deltas)
+            self.autosave_journal.paused = False
+
+            self.file_path = header["file_path"]
+            self.file_name = header["file_name"]
+            if self.file_path and self.file_path.lower().endswith(".txt"):
+                try:
+                    self.text_encoding = file_encoding(self.file_path)
+                except OSError:
+                    pass # gone since, saved in the default encoding
+            self.document_modified = True
+            self.update_window_title()
+            self.status_bar.showMessage(f"Recovered unsaved changes to {self.file_name}", short_message_duration)
 
     def display_unsaved_changes_message(self, event):
         reply = MessageBox.question(
@@ -335,10 +1109,11 @@ class MainWindow(Widgets.QMainWindow):
         )
 
         if reply == MessageBox.Yes:
-            self.save_file()
-            if event:
-                event.accept()
-        elif reply == MessageBox.No:
+            # Closing discards the autosave journal, so the save has to be written before the document goes
+            if not self.save_file() or not self.file_saver.flush():
+                reply = MessageBox.Cancel
+                self.status_bar.showMessage("The changes were not saved, the document stays open", short_message_duration)
+        if reply == MessageBox.Yes or reply == MessageBox.No:
             if event:
                 event.accept()
         elif event:
@@ -347,26 +1122,26 @@ class MainWindow(Widgets.QMainWindow):
         return reply
 
 if __name__ == "__main__":
-    app = Widgets.QApplication(sys.argv)
+    startup_profile.enabled = profile_flag in sys.argv
+    arguments = [argument for argument in sys.argv if argument != profile_flag]
+    metrics_path = None
+    if metrics_flag in arguments[:-1]:
+        index = arguments.index(metrics_flag)
+        metrics_path = arguments[index + 1]
+        del arguments[index:index + 2]
+    app = Widgets.QApplication(arguments)
+    startup_profile.mark("application")
     main_window = MainWindow()
-
-    screens = GuiApplication.screens()
-    if len(screens) > 2:
-        secondary_screen = screens[2]
-        screen_geometry = secondary_screen.geometry()
-
-        x = screen_geometry.x() + (screen_geometry.width() - main_window.width()) // 2
-        y = screen_geometry.y() + (screen_geometry.height() - main_window.height()) // 2
-        main_window.move(x, y)
-    elif len(screens) > 1:
-        secondary_screen = screens[1]
-        screen_geometry = secondary_screen.geometry()
-
-        x = screen_geometry.x() + (screen_geometry.width() - main_window.width()) // 2
-        y = screen_geometry.y() + (screen_geometry.height() - main_window.height()) // 2
-        main_window.move(x, y)
-    else:
-        print("Only one monitor detected, opening on the primary screen.")
-
+    if metrics_path:
+        main_window.start_recording()
+    startup_profile.mark("main window")
+    main_window.restore_session()
+    startup_profile.mark("session restore")
+    main_window.place_on_screen()
     main_window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    startup_profile.mark("show")
+    exit_status = app.exec()
+    if metrics_path:
+        from instrumentation import metrics
+        metrics.write_jsonl(metrics_path)
+    sys.exit(exit_status)
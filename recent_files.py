@@ -0,0 +1,173 @@
+"""Recently opened files, with what is needed to reopen them quickly.
+
+The index lists the files most recently opened first, each with the size and
+modification time it had, the cursor and scroll position it was left at and a
+short preview of its first line. A JSON .txty file also gets a snapshot: its
+parsed document saved as .txty version 3, which is read through a memory map
+with no JSON to parse. Other files are read as fast as a snapshot would be and
+get none.
+
+An entry only counts while the file's size and modification time are those
+recorded. Otherwise its snapshot and positions are dropped and the file is
+read as usual. The snapshots share a byte budget, the least recently opened
+lose theirs first.
+"""
+import os
+import json
+import hashlib
+from dataclasses import dataclass, asdict
+from PySide6.QtCore import QStandardPaths
+from txty_format import encode_binary_txty, write_bytes_atomic
+
+recent_directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), "Texty", "recent")
+index_file_name = "index.json"
+recent_files_limit = 10 # files listed
+snapshot_budget = 128 * 1024 * 1024 # bytes of snapshots kept in all
+preview_length = 80 # characters of the first line shown with a file
+
+
+@dataclass
+class RecentFile:
+    path: str
+    size: int
+    mtime_ns: int
+    cursor_position: int = 0
+    scroll_position: int = 0
+    preview: str = ""
+    snapshot: str = None # file name in the recent directory
+    snapshot_size: int = 0
+
+
+def snapshot_name(file_path):
+    return hashlib.sha1(os.path.abspath(file_path).encode("utf-8", "surrogatepass")).hexdigest() + ".txty"
+
+
+def write_snapshot(snapshot_path, content, styles, formatting, metadata):
+    """Save a parsed document as a snapshot. Called from the loader thread, a cache file needs no fsync."""
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    temporary_path = snapshot_path + ".tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(encode_binary_txty(content, styles, formatting, metadata))
+    os.replace(temporary_path, snapshot_path)
+
+
+class RecentFiles:
+    """The recent files index, kept in `directory` with the snapshots."""
+
+    def __init__(self, directory=recent_directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, index_file_name)
+        self.files = [] # RecentFile, most recently opened first
+        self.loaded = False
+
+    def load(self):
+        # Read on first use rather than at start-up
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self.index_path, 'r', encoding="utf-8") as file:
+                self.files = [RecentFile(**entry) for entry in json.load(file)["files"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.files = []
+
+    def save(self):
+        if not self.loaded:
+            return # not read yet, so nothing changed; saving would empty the index
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = json.dumps({"files": [asdict(entry) for entry in self.files]}, indent=1)
+            write_bytes_atomic(self.index_path, data.encode("utf-8"))
+        except OSError:
+            pass # only a cache, the next save tries again
+
+    def find(self, file_path):
+        self.load()
+        file_path = os.path.abspath(file_path)
+        return next((entry for entry in self.files if entry.path == file_path), None)
+
+    def lookup(self, file_path):
+        """The entry of a file that is unchanged since it was recorded, None otherwise.
+
+        The snapshot and positions of a changed file are dropped.
+        """
+        entry = self.find(file_path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            self.drop_snapshot(entry)
+            entry.cursor_position = entry.scroll_position = 0
+            return None
+        if entry.snapshot and not os.path.exists(self.snapshot_path(entry)):
+            entry.snapshot, entry.snapshot_size = None, 0
+        return entry
+
+    def snapshot_path(self, entry_or_path):
+        if isinstance(entry_or_path, RecentFile):
+            return os.path.join(self.directory, entry_or_path.snapshot)
+        return os.path.join(self.directory, snapshot_name(entry_or_path))
+
+    def opened(self, file_path, stat, preview="", snapshot_written=False):
+        """Put a file first, as it was when `stat` was taken before reading it."""
+        entry = self.find(file_path)
+        if entry is None:
+            entry = RecentFile(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        else:
+            self.files.remove(entry)
+            if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns) or snapshot_written:
+                if not snapshot_written:
+                    self.drop_snapshot(entry)
+                entry.size, entry.mtime_ns = stat.st_size, stat.st_mtime_ns
+        entry.preview = preview[:preview_length].strip()
+        if snapshot_written:
+            entry.snapshot = snapshot_name(file_path)
+            try:
+                entry.snapshot_size = os.path.getsize(self.snapshot_path(entry))
+            except OSError:
+                entry.snapshot, entry.snapshot_size = None, 0
+        self.files.insert(0, entry)
+        self.evict()
+        self.save()
+
+    def remember_view(self, file_path, cursor_position, scroll_position):
+        entry = self.find(file_path)
+        if entry is not None:
+            entry.cursor_position, entry.scroll_position = cursor_position, scroll_position
+
+    def remove(self, file_path):
+        entry = self.find(file_path)
+        if entry is not None:
+            self.drop_snapshot(entry)
+            self.files.remove(entry)
+            self.save()
+
+    def clear(self):
+        self.load()
+        for entry in self.files:
+            self.drop_snapshot(entry)
+        self.files = []
+        self.save()
+
+    def evict(self):
+        # Files past the limit go with their snapshots, then the oldest snapshots until the rest fit
+        for entry in self.files[recent_files_limit:]:
+            self.drop_snapshot(entry)
+        del self.files[recent_files_limit:]
+        total = sum(entry.snapshot_size for entry in self.files)
+        for entry in reversed(self.files):
+            if total <= snapshot_budget:
+                break
+            total -= entry.snapshot_size
+            self.drop_snapshot(entry)
+
+    def drop_snapshot(self, entry):
+        if entry.snapshot:
+            try:
+                os.remove(self.snapshot_path(entry))
+            except OSError:
+                pass
+        entry.snapshot, entry.snapshot_size = None, 0
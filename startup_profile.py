@@ -0,0 +1,39 @@
+"""Timing of the editor's start-up, reported by `python main.py --profile-startup`.
+
+Imported before anything else in main.py so the import phase is measured too.
+Each phase runs from the previous mark to its own; the report lists them in
+order with the total since the interpreter started importing main.py.
+"""
+import sys
+import time
+
+profile_flag = "--profile-startup"
+metrics_flag = "--metrics" # followed by the path the measurements are written to on exit, instrumentation is only imported then
+
+
+class StartupProfile:
+    """Named phases of the start-up and how long each took."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.enabled = False
+        self.phases = [] # (name, seconds)
+        self.last_mark = self.started
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last_mark))
+        self.last_mark = now
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        total = self.last_mark - self.started
+        width = max((len(name) for name, _ in self.phases), default=0)
+        print("Startup profile:", file=stream)
+        for name, seconds in self.phases:
+            share = seconds / total * 100 if total else 0
+            print(f"  {name:<{width}}  {seconds * 1000:8.1f} ms  {share:5.1f}%", file=stream)
+        print(f"  {'total':<{width}}  {total * 1000:8.1f} ms", file=stream, flush=True)
+
+
+startup_profile = StartupProfile()
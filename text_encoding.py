@@ -0,0 +1,219 @@
+"""Encodings of plain text files: detection, incremental decoding and encoding for saving.
+
+The encoding of a file is detected from its first `detection_size` bytes: a
+byte order mark decides it outright; otherwise NUL bytes on alternating
+positions point to BOM-less UTF-16, text that is valid UTF-8 is UTF-8, and
+anything else is read with the first 8-bit `fallback_encodings` entry that can
+decode it. The line ending style is taken from the first line break. Files are
+decoded chunk by chunk with an incremental decoder and their line breaks turned
+into "\\n", as a QTextDocument keeps them. Saving puts back the encoding, byte
+order mark and line endings the file was read with; text the encoding cannot
+hold is saved as UTF-8 instead, still with the file's line endings.
+
+Only a prefix is looked at, so text that stops being valid further on is found
+while decoding. A reader then starts over with the next fallback encoding.
+Detection results are cached per path and checked against the file's size and
+modification time, so reopening a file skips detection.
+"""
+import os
+import codecs
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+detection_size = 64 * 1024 # bytes looked at to detect the encoding
+detection_cache_size = 256 # files whose detected encoding is remembered
+read_chunk_size = 4 * 1024 * 1024 # bytes decoded at a time when a file is read as a whole
+boms = [ # longest first, the UTF-32 LE mark starts with the UTF-16 LE one
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+
+@dataclass(frozen=True)
+class TextEncoding:
+    """How the text of a file is stored: codec name, byte order mark and line ending."""
+    encoding: str = "utf-8"
+    bom: bytes = b""
+    newline: str = os.linesep
+
+    @property
+    def ascii_compatible(self):
+        # Line breaks are single b"\n" bytes, so the raw bytes can be scanned for lines
+        return not codecs.lookup(self.encoding).name.startswith(("utf-16", "utf-32"))
+
+
+default_encoding = TextEncoding() # for text that was not read from a file
+
+
+def fallback_encodings():
+    """8-bit encodings tried in order when the text is not UTF-8, latin-1 decodes any bytes."""
+    import locale # only needed for text that is not UTF-8, kept out of the editor's start-up
+    preferred = codecs.lookup(locale.getpreferredencoding(False)).name
+    candidates = [] if preferred in ("utf-8", "ascii") else [preferred]
+    return candidates + [encoding for encoding in ("cp1252", "latin-1") if encoding not in candidates]
+
+
+def detect_encoding(prefix, complete=False):
+    """TextEncoding of a file starting with the bytes `prefix`, which is the whole file when `complete`."""
+    for bom, encoding in boms:
+        if prefix.startswith(bom):
+            return TextEncoding(encoding, bom, detect_newline(prefix[len(bom):], encoding))
+
+    encoding = detect_utf16(prefix)
+    if encoding is None:
+        candidates = ["utf-8"] + fallback_encodings()
+        encoding = next(candidate for candidate in candidates if decodes(prefix, candidate, complete))
+    return TextEncoding(encoding, b"", detect_newline(prefix, encoding))
+
+
+def detect_utf16(prefix):
+    # Mostly ASCII text in UTF-16 has a NUL in every other byte, text in any other encoding rarely has any
+    sample = prefix[:4096 - 4096 % 2]
+    if len(sample) < 4:
+        return None
+    even_nuls = sample[0::2].count(0)
+    odd_nuls = sample[1::2].count(0)
+    half = len(sample) // 2
+    if odd_nuls > half * 0.3 and even_nuls < half * 0.05:
+        return "utf-16-le"
+    if even_nuls > half * 0.3 and odd_nuls < half * 0.05:
+        return "utf-16-be"
+    return None
+
+
+def decodes(data, encoding, complete):
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(data, complete)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_newline(prefix, encoding):
+    # A sequence cut off at the end of the prefix is dropped, it cannot hold the first line break
+    text = codecs.getincrementaldecoder(encoding)("ignore").decode(prefix)
+    position = text.find("\n")
+    carriage = text.find("\r")
+    if carriage >= 0 and (position < 0 or carriage < position):
+        return "\r\n" if text[carriage + 1:carriage + 2] == "\n" else "\r"
+    return "\n" if position >= 0 else default_encoding.newline
+
+
+class DetectionCache:
+    """Detected encodings by path, valid as long as the file's size and modification time are unchanged."""
+
+    def __init__(self, size=detection_cache_size):
+        self.size = size
+        self.entries = OrderedDict() # absolute path -> (size, mtime in ns, TextEncoding), least recently used first
+        self.lock = threading.Lock() # loaders and savers use it from their threads
+
+    def get(self, file_path, stat):
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(file_path))
+            if entry is None or entry[:2] != (stat.st_size, stat.st_mtime_ns):
+                return None
+            self.entries.move_to_end(os.path.abspath(file_path))
+            return entry[2]
+
+    def put(self, file_path, text_encoding, stat=None):
+        try:
+            stat = stat or os.stat(file_path)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[os.path.abspath(file_path)] = (stat.st_size, stat.st_mtime_ns, text_encoding)
+            self.entries.move_to_end(os.path.abspath(file_path))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+detection_cache = DetectionCache()
+
+
+def detect_file_encoding(file, file_path):
+    """TextEncoding of an open binary file, from the cache when the file has not changed since."""
+    stat = os.fstat(file.fileno())
+    text_encoding = detection_cache.get(file_path, stat)
+    if text_encoding is None:
+        file.seek(0)
+        prefix = file.read(detection_size)
+        text_encoding = detect_encoding(prefix, complete=len(prefix) >= stat.st_size)
+        detection_cache.put(file_path, text_encoding, stat)
+    return text_encoding
+
+
+def next_fallback(text_encoding):
+    """The encoding to start over with when `text_encoding` failed further into the file."""
+    candidates = fallback_encodings()
+    name = codecs.lookup(text_encoding.encoding).name
+    following = candidates[candidates.index(name) + 1:] if name in candidates else candidates
+    return replace(text_encoding, encoding=following[0], bom=b"")
+
+
+def decode_chunks(file, text_encoding, first_chunk_size, chunk_size):
+    """Yield the text of an open binary file piece by piece, with "\\n" line breaks.
+
+    Raises UnicodeDecodeError when the bytes are not valid in the encoding.
+    """
+    decoder = codecs.getincrementaldecoder(text_encoding.encoding)()
+    file.seek(len(text_encoding.bom))
+    size = first_chunk_size
+    carriage_return = False # a "\r" at the end of a piece may be the first half of "\r\n"
+    while True:
+        data = file.read(size)
+        final = not data
+        text = decoder.decode(data, final)
+        if carriage_return:
+            text = "\r" + text
+        carriage_return = not final and text.endswith("\r")
+        if carriage_return:
+            text = text[:-1]
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if text:
+            yield text
+        if final:
+            return
+        size = chunk_size
+
+
+def read_text(file_path):
+    """(content, TextEncoding) of a whole plain text file."""
+    with open(file_path, 'rb') as file:
+        text_encoding = detect_file_encoding(file, file_path)
+        while True:
+            try:
+                content = "".join(decode_chunks(file, text_encoding, read_chunk_size, read_chunk_size))
+            except UnicodeDecodeError:
+                text_encoding = next_fallback(text_encoding)
+                detection_cache.put(file_path, text_encoding)
+                continue
+            return content, text_encoding
+
+
+def encode_text(content, text_encoding=None):
+    """Bytes of `content` ("\\n" line breaks) as a file in the given encoding, the default one if None."""
+    text_encoding = text_encoding or default_encoding
+    if text_encoding.newline != "\n":
+        content = content.replace("\n", text_encoding.newline)
+    return text_encoding.bom + content.encode(text_encoding.encoding)
+
+
+def encode_text_or_utf8(content, text_encoding=None):
+    """(bytes, TextEncoding written) of `content`: in the given encoding, or in UTF-8 with the same line
+    endings when that encoding cannot hold all of its characters."""
+    try:
+        return encode_text(content, text_encoding), text_encoding
+    except UnicodeEncodeError:
+        fallback = TextEncoding("utf-8", b"", (text_encoding or default_encoding).newline)
+        return encode_text(content, fallback), fallback
+
+
+def file_encoding(file_path):
+    """TextEncoding of the file at `file_path`, see detect_file_encoding."""
+    with open(file_path, 'rb') as file:
+        return detect_file_encoding(file, file_path)
@@ -0,0 +1,418 @@
+"""Conversions between QTextCharFormat and the .txty style of a formatting run."""
+import time
+from PySide6.QtGui import QColor as Color, QFont as Font, QTextCharFormat as TextCharFormat, QTextFormat as TextFormat
+from txty_format import StyleTable, plain_style, style_to_dict, style_from_dict
+
+char_formats = {} # style -> QTextCharFormat, each distinct style's format is built once and shared
+highlight_property = TextFormat.UserProperty # marks syntax highlighting formats, they live in the block layouts and style no text
+uniform_check_size = 64 * 1024 # characters, formatting of a longer range is only read when the document has more than one style
+
+
+def style_key(char_format):
+    families = char_format.fontFamilies()
+    size = char_format.fontPointSize()
+    return (char_format.fontWeight() == Font.Bold, char_format.fontItalic(), char_format.fontUnderline(),
+            families[0] if families else None,
+            (int(size) if size.is_integer() else size) if size > 0 else None,
+            color_name(char_format, TextFormat.ForegroundBrush), color_name(char_format, TextFormat.BackgroundBrush))
+
+
+def color_name(char_format, property_id):
+    if not char_format.hasProperty(property_id):
+        return None
+    color = char_format.brushProperty(property_id).color()
+    return color.name() if color.alpha() == 255 else color.name(Color.HexArgb)
+
+
+def char_format_from_style_key(style):
+    """The shared QTextCharFormat of a style, callers hand it to Qt (which copies it) and never change it."""
+    char_format = char_formats.get(style)
+    if char_format is None:
+        char_format = char_formats[style] = build_char_format(style)
+    return char_format
+
+
+def build_char_format(style):
+    bold, italic, underline, font, size, color, highlight = style
+    char_format = TextCharFormat()
+    if bold:
+        char_format.setFontWeight(Font.Bold)
+    if italic:
+        char_format.setFontItalic(True)
+    if underline:
+        char_format.setFontUnderline(True)
+    if font:
+        char_format.setFontFamilies([font])
+    if size:
+        char_format.setFontPointSize(size)
+    if color:
+        char_format.setForeground(Color(color))
+    if highlight:
+        char_format.setBackground(Color(highlight))
+    return char_format
+
+
+def highlight_char_format(style):
+    char_format = build_char_format(style)
+    char_format.setProperty(highlight_property, True)
+    return char_format
+
+
+def changed_style(style, changes, replace=False):
+    """`style` after a format change: the partial .txty style dict `changes` merged into it, or set instead of it."""
+    return style_from_dict(changes if replace else {**style_to_dict(style), **changes})
+
+
+def change_char_format(changes, replace=False):
+    """The QTextCharFormat that makes a format change, to merge (or set, with `replace`) over the text.
+
+    Bold, italic and underline given as false are set off explicitly, so that merging
+    them turns them off. Font, size and colours can only be set by a merge, not cleared.
+    """
+    if replace:
+        return char_format_from_style_key(style_from_dict(changes))
+    char_format = TextCharFormat()
+    if "bold" in changes:
+        char_format.setFontWeight(Font.Bold if changes["bold"] else Font.Normal)
+    if "italic" in changes:
+        char_format.setFontItalic(bool(changes["italic"]))
+    if "underline" in changes:
+        char_format.setFontUnderline(bool(changes["underline"]))
+    if changes.get("font"):
+        char_format.setFontFamilies([changes["font"]])
+    if changes.get("size"):
+        char_format.setFontPointSize(changes["size"])
+    if changes.get("color"):
+        char_format.setForeground(Color(changes["color"]))
+    if changes.get("highlight"):
+        char_format.setBackground(Color(changes["highlight"]))
+    return char_format
+
+
+def document_styles(document):
+    """The styles of every character format the document has, whether any text still uses it or not.
+
+    Formats are only ever added to a document, so all of its text has one of these
+    styles. Syntax highlighting adds its formats to the same collection, but never
+    to the text, they are left out.
+    """
+    return {style_key(text_format.toCharFormat()) for text_format in document.allFormats()
+            if text_format.isCharFormat() and not text_format.hasProperty(highlight_property)}
+
+
+def document_formatting(document):
+    """Style table and formatting runs of a QTextDocument in the .txty layout, one run per stretch of equal style."""
+    return FormattingReader(document).read()
+
+
+class FormattingReader:
+    """document_formatting() read a few blocks at a time, for callers that cannot wait for a large document.
+
+    The document must not change between calls to read().
+    """
+
+    def __init__(self, document):
+        # Walks the document's own formatting runs (blocks and their fragments)
+        # instead of the characters, so the cost scales with the number of runs.
+        self.document = document
+        self.runs = []
+        self.end_position = document.characterCount() - 1
+        self.table = StyleTable()
+        self.styles = {}  # char format index -> style index, each distinct format is inspected once
+        self.block = document.begin()
+
+        # If none of the document's formats is styled neither is any text
+        if not any(any(style) for style in document_styles(document)):
+            self.block = None
+            if self.end_position > 0:
+                self.table.index(plain_style)
+                self.runs.append([0, 0, self.end_position])
+
+    def read(self, deadline=None):
+        """Read on until the time.perf_counter() deadline, if any, has passed.
+
+        Returns (styles, formatting) once the whole document is read, None before.
+        """
+        runs, end_position, table, styles = self.runs, self.end_position, self.table, self.styles
+        block = self.block
+        while block is not None and block.isValid():
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                start = fragment.position()
+                format_index = fragment.charFormatIndex()
+                style = styles.get(format_index)
+                if style is None:
+                    style = styles[format_index] = table.index(style_key(fragment.charFormat()))
+                if runs and runs[-1][0] == style and runs[-1][2] == start:
+                    runs[-1][2] = start + fragment.length()
+                else:
+                    runs.append([style, start, start + fragment.length()])
+                iterator += 1
+
+            # The paragraph separator carries the character format of the block it opens
+            next_block = block.next()
+            separator_position = block.position() + block.length() - 1
+            if separator_position < end_position:
+                format_index = next_block.charFormatIndex()
+                style = styles.get(format_index)
+                if style is None:
+                    style = styles[format_index] = table.index(style_key(next_block.charFormat()))
+                if runs and runs[-1][0] == style and runs[-1][2] == separator_position:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([style, separator_position, separator_position + 1])
+            block = next_block
+            if deadline is not None and block.isValid() and time.perf_counter() > deadline:
+                self.block = block
+                return None
+
+        self.block = None
+        return table.to_list(), [{"style": style, "range": [start, end]} for style, start, end in runs]
+
+
+def format_pieces(document, start, end):
+    """(start, end, char format index, fragment) of the pieces of text from start to end, clipped to them.
+
+    The paragraph separator ending a block is a piece of its own, it carries the
+    character format of the block it opens: the fragment given for it is that block,
+    which has a charFormat() as well.
+    """
+    block = document.findBlock(start)
+    while block.isValid():
+        block_start = block.position()
+        if block_start >= end:
+            break
+        next_block = block.next()
+        separator_position = block_start + block.length() - 1
+        if block_start >= start and separator_position <= end:
+            # Inside the range as a whole, nothing needs clipping
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                position = fragment.position()
+                yield position, position + fragment.length(), fragment.charFormatIndex(), fragment
+                iterator += 1
+        else:
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                position = fragment.position()
+                if position >= end:
+                    break
+                fragment_end = position + fragment.length()
+                if fragment_end > start:
+                    yield max(position, start), min(fragment_end, end), fragment.charFormatIndex(), fragment
+                iterator += 1
+        if start <= separator_position < end and next_block.isValid():
+            yield separator_position, separator_position + 1, next_block.charFormatIndex(), next_block
+        block = next_block
+
+
+def range_formatting(document, start, end):
+    """Styled runs of the text from start to end as [offset from start, length, style], plain text has none."""
+    if end - start >= uniform_check_size:
+        known_styles = document_styles(document)
+        if len(known_styles) == 1:
+            style = next(iter(known_styles))
+            return [[0, end - start, style]] if any(style) else []
+    runs = []
+    styles = {} # char format index -> style, None for plain text
+    for run_start, run_end, format_index, source in format_pieces(document, start, end):
+        style = styles.get(format_index, False)
+        if style is False:
+            style = style_key(source.charFormat())
+            style = styles[format_index] = style if any(style) else None
+        if style is None:
+            continue
+        if runs and runs[-1][2] == style and runs[-1][0] + runs[-1][1] == run_start - start:
+            runs[-1][1] += run_end - run_start
+        else:
+            runs.append([run_start - start, run_end - run_start, style])
+    return runs
+
+
+def selection_emphasis(document, start, end):
+    """(bold, italic, underline) of the text from start to end, each True only when all of it has that format."""
+    emphasis, found_text = scan_emphasis(document, start, end)
+    return emphasis if found_text else (False, False, False)
+
+
+def scan_emphasis(document, start, end, emphasis=(True, True, True)):
+    # Returns the emphasis and whether there was any text at all, see EmphasisScan
+    return EmphasisScan(document, [(start, end)], emphasis).read()
+
+
+def has_text(document, start, end):
+    """Whether the range has any character but paragraph separators, it goes through the empty blocks only."""
+    position = start
+    while position < end:
+        block = document.findBlock(position)
+        separator_position = block.position() + block.length() - 1
+        if position < separator_position:
+            return True
+        position = separator_position + 1
+    return False
+
+
+class EmphasisScan:
+    """Finds which of (bold, italic, underline) all of the text in some ranges has, a few blocks at a time.
+
+    Walks the formatting runs the ranges overlap and stops as soon as every format
+    is known to be missing somewhere. Only the formats that are True in `emphasis`
+    are looked for. Paragraph separators are left out, they are not visible text.
+    Scanned to the end, `styles` holds every style in the ranges, separators too.
+    The document must not change between calls to read().
+    """
+
+    def __init__(self, document, ranges, emphasis=(True, True, True)):
+        self.document = document
+        self.ranges = list(ranges)
+        self.emphasis = list(emphasis)
+        self.seen = set() # char format indexes, each distinct format is inspected once
+        self.separator_formats = set() # char format indexes of the paragraph separators
+        self.styles = set()
+        self.found_text = False
+        self.block = None
+
+    def read(self, deadline=None):
+        """Scan on until the time.perf_counter() deadline, if any, has passed.
+
+        Returns (emphasis, whether there was any text at all) once done, None before.
+        """
+        emphasis, seen, styles = self.emphasis, self.seen, self.styles
+        if not any(emphasis):
+            self.styles = None
+            return tuple(emphasis), self.found_text
+        while self.ranges:
+            start, end = self.ranges[0]
+            block = self.block if self.block is not None else self.document.findBlock(start)
+            while block.isValid() and block.position() < end:
+                block_start = block.position()
+                separator_position = block_start + block.length() - 1
+                inside = block_start >= start and separator_position < end # no fragment needs clipping
+                iterator = block.begin()
+                while not iterator.atEnd():
+                    fragment = iterator.fragment()
+                    if not inside:
+                        fragment_start = fragment.position()
+                        if fragment_start >= end:
+                            break
+                        if fragment_start + fragment.length() <= start:
+                            iterator += 1
+                            continue
+                    self.found_text = True
+                    format_index = fragment.charFormatIndex()
+                    if format_index not in seen:
+                        seen.add(format_index)
+                        char_format = fragment.charFormat()
+                        styles.add(style_key(char_format))
+                        emphasis[0] = emphasis[0] and char_format.fontWeight() == Font.Bold
+                        emphasis[1] = emphasis[1] and char_format.fontItalic()
+                        emphasis[2] = emphasis[2] and char_format.fontUnderline()
+                        if not any(emphasis):
+                            self.styles = None # not all of them seen
+                            return tuple(emphasis), True
+                    iterator += 1
+                # The paragraph separator carries the character format of the block it opens
+                next_block = block.next()
+                if start <= separator_position < end and next_block.isValid():
+                    format_index = next_block.charFormatIndex()
+                    if format_index not in self.separator_formats:
+                        self.separator_formats.add(format_index)
+                        styles.add(style_key(next_block.charFormat()))
+                block = next_block
+                if deadline is not None and block.isValid() and block.position() < end and time.perf_counter() > deadline:
+                    self.block = block
+                    return None
+            self.ranges.pop(0)
+            self.block = None
+        return tuple(emphasis), self.found_text
+
+
+class SelectionEmphasis:
+    """selection_emphasis that remembers its last result for the document revision it was made at.
+
+    A selection grown from the remembered one only has the added ends scanned, one
+    shrunk from it keeps the formats all of the remembered one had, and a toggle
+    that just set a format stores the outcome instead of scanning again. Formats
+    none or all of the document's formats have need no scan of a long selection.
+    Called with a deadline, it gives None when that passes first, and the next call
+    for the same selection goes on from there.
+
+    `styles` holds the styles the last selection may have, None when not known.
+    """
+
+    def __init__(self):
+        self.document = None
+        self.revision = -1
+        self.start = self.end = 0
+        self.result = None # (emphasis, found text)
+        self.styles = None
+        self.scan = None # (document, revision, start, end, plan) of a scan not yet done, see plan_scan()
+
+    def __call__(self, document, start, end, deadline=None):
+        revision = document.revision()
+        if self.scan is not None and self.scan[:4] == (document, revision, start, end):
+            plan = self.scan[4]
+        else:
+            plan = self.plan_scan(document, revision, start, end)
+        known, scan, styles, partial = plan
+        result = scan.read(deadline) if scan is not None else (known, has_text(document, start, end))
+        if result is None:
+            self.scan = (document, revision, start, end, plan)
+            return None
+        scanned, found_text = result
+        # Formats known beforehand were not looked for, the scan left them False
+        emphasis = tuple(scanned[index] if known[index] is None else known[index] for index in range(3))
+        if scan is not None and not partial:
+            styles = scan.styles if scan.styles is not None else styles
+        elif scan is not None:
+            styles = styles | scan.styles if styles is not None and scan.styles is not None else None
+        self.remember(document, start, end, emphasis, found_text, styles)
+        return emphasis if found_text else (False, False, False)
+
+    def plan_scan(self, document, revision, start, end):
+        """(known, scan, styles, partial): each format True or False when known without looking at the
+        text and None when `scan` decides it, the styles the selection may have as far as known
+        beforehand, and whether the scan only covers the parts of the selection those leave out."""
+        known = [None, None, None]
+        ranges = [(start, end)]
+        found_text = False
+        styles = None
+        partial = False
+        if self.result is not None and document is self.document and revision == self.revision:
+            emphasis, found_remembered = self.result
+            if start <= self.start and end >= self.end:
+                # What the remembered selection lacks, the grown one lacks too
+                known = [None if has else False for has in emphasis]
+                found_text = found_remembered
+                ranges = [(part_start, part_end) for part_start, part_end in ((start, self.start), (self.end, end))
+                          if part_start < part_end]
+                styles, partial = self.styles, True
+            elif self.start <= start and end <= self.end and found_remembered:
+                # What all of the remembered selection has, the shrunk one has too
+                known = [True if has else None for has in emphasis]
+                styles = self.styles
+        if end - start >= uniform_check_size and (None in known or styles is None):
+            known_styles = document_styles(document)
+            for index in range(3):
+                if known[index] is None and not any(style[index] for style in known_styles):
+                    known[index] = False
+                elif known[index] is None and all(style[index] for style in known_styles):
+                    known[index] = True
+            if styles is None:
+                styles = known_styles
+        if None not in known:
+            return known, None, styles, partial
+        scan = EmphasisScan(document, ranges, [has is None for has in known])
+        scan.found_text = found_text
+        return known, scan, styles, partial
+
+    def remember(self, document, start, end, emphasis, found_text=True, styles=None):
+        self.document = document
+        self.revision = document.revision()
+        self.start, self.end = start, end
+        self.result = (tuple(emphasis), found_text)
+        self.styles = styles
+        self.scan = None
@@ -0,0 +1,170 @@
+"""Convert and validate .txty files from the command line, without Qt.
+
+Usage:
+    python txty_cli.py to-txt   PATH... [-o DIRECTORY] [-j JOBS]
+    python txty_cli.py to-txty  PATH... [-o DIRECTORY] [-j JOBS] [--txty-version 1|2|3]
+    python txty_cli.py to-html  PATH... [-o DIRECTORY] [-j JOBS]
+    python txty_cli.py to-md    PATH... [-o DIRECTORY] [-j JOBS]
+    python txty_cli.py validate PATH... [-j JOBS]
+
+A PATH may be a directory, it is searched recursively for the command's input
+type. Output files are written next to their input, or under DIRECTORY with the
+directory layout of the input kept. Files are processed by a pool of JOBS worker
+processes (one per core by default) and reported as they finish. The exit status
+is 1 when any file failed.
+"""
+import os
+import sys
+import time
+import argparse
+from dataclasses import dataclass
+from multiprocessing import Pool
+from txty_format import (read_txty, write_txty, read_plain_text, encode_plain_text, write_bytes_atomic,
+                         validate_txty, current_version)
+from txty_export import render_html, render_markdown
+
+# command -> (input extension, output extension)
+commands = {
+    "to-txt": (".txty", ".txt"),
+    "to-txty": (".txt", ".txty"),
+    "to-html": (".txty", ".html"),
+    "to-md": (".txty", ".md"),
+    "validate": (".txty", None),
+}
+
+
+@dataclass
+class Task:
+    command: str
+    input_path: str
+    output_path: str = None
+    txty_version: int = current_version
+
+
+@dataclass
+class Result:
+    task: Task
+    size: int = 0 # bytes read
+    error: str = None
+    problems: tuple = ()
+
+
+def run_task(task):
+    result = Result(task)
+    try:
+        result.size = os.path.getsize(task.input_path)
+        if task.command == "to-txty":
+            content = read_plain_text(task.input_path)
+            title = os.path.splitext(os.path.basename(task.input_path))[0]
+            write_txty(task.output_path, content, [], [], {"title": title}, version=task.txty_version)
+            return result
+
+        document = read_txty(task.input_path)
+        if task.command == "validate":
+            result.problems = tuple(validate_txty(document))
+        elif task.command == "to-txt":
+            write_bytes_atomic(task.output_path, encode_plain_text(document["content"]))
+        elif task.command == "to-html":
+            title = document["metadata"].get("title") or os.path.basename(task.input_path)
+            write_bytes_atomic(task.output_path, render_html(document["content"], document["styles"], document["formatting"], title).encode("utf-8"))
+        elif task.command == "to-md":
+            write_bytes_atomic(task.output_path, render_markdown(document["content"], document["styles"], document["formatting"]).encode("utf-8"))
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        result.error = str(error) or type(error).__name__
+    return result
+
+
+def collect_tasks(command, paths, output_directory=None, txty_version=current_version):
+    input_extension, output_extension = commands[command]
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for directory, _, file_names in os.walk(path):
+                found.extend(os.path.join(directory, file_name) for file_name in sorted(file_names)
+                             if os.path.splitext(file_name)[1].lower() == input_extension)
+            relative_to = path
+        else:
+            found = [path]
+            relative_to = os.path.dirname(path)
+
+        for input_path in found:
+            output_path = None
+            if output_extension:
+                output_path = os.path.splitext(input_path)[0] + output_extension
+                if output_directory:
+                    output_path = os.path.join(output_directory, os.path.relpath(output_path, relative_to))
+            tasks.append(Task(command, input_path, output_path, txty_version))
+    return tasks
+
+
+def run_batch(tasks, jobs=None, report=None):
+    """Run the tasks on `jobs` processes, calling `report(result, done)` as each one finishes.
+
+    Returns the results in completion order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    for directory in {os.path.dirname(task.output_path) for task in tasks if task.output_path}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    results = []
+    if jobs == 1 or len(tasks) <= 1:
+        outcomes = map(run_task, tasks)
+        pool = None
+    else:
+        # Several small files per hand-off keep the inter-process traffic low
+        pool = Pool(min(jobs, len(tasks)))
+        outcomes = pool.imap_unordered(run_task, tasks, chunksize=max(1, min(64, len(tasks) // (jobs * 8))))
+    try:
+        for result in outcomes:
+            results.append(result)
+            if report is not None:
+                report(result, len(results))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=commands)
+    parser.add_argument("paths", nargs="+", help="files, or directories to search recursively")
+    parser.add_argument("-o", "--output-directory", help="write the output files here instead of next to the inputs")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+    parser.add_argument("--txty-version", type=int, choices=(1, 2, 3), default=current_version, help="version written by to-txty")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only report failures and the summary")
+    arguments = parser.parse_args(arguments)
+
+    tasks = collect_tasks(arguments.command, arguments.paths, arguments.output_directory, arguments.txty_version)
+    if not tasks:
+        print("No input files found", file=sys.stderr)
+        return 1
+
+    total = len(tasks)
+    failed = 0
+
+    def report(result, done):
+        nonlocal failed
+        task = result.task
+        if result.error or result.problems:
+            failed += 1
+            details = result.error or "; ".join(result.problems)
+            print(f"[{done}/{total}] FAILED {task.input_path}: {details}", flush=True)
+        elif not arguments.quiet:
+            target = f" -> {task.output_path}" if task.output_path else " ok"
+            print(f"[{done}/{total}] {task.input_path}{target}", flush=True)
+
+    started = time.perf_counter()
+    results = run_batch(tasks, arguments.jobs, report)
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    megabytes = sum(result.size for result in results) / 1024 / 1024
+    print(f"{total - failed} of {total} files done, {failed} failed, {megabytes:.1f} MB in {elapsed:.2f}s "
+          f"({total / elapsed:.1f} files/s, {megabytes / elapsed:.1f} MB/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
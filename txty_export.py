@@ -0,0 +1,108 @@
+"""Render .txty documents as HTML or Markdown, independent of the GUI."""
+import html
+import re
+from txty_format import plain_style, style_from_dict, utf16_length
+
+markdown_special = re.compile(r"([\\`*_\[\]<>#|~])")
+markdown_line_start = re.compile(r"^([ \t]*|[ \t]*\d+)([-+=.)])", re.MULTILINE) # list items, headings and rules
+
+
+def styled_segments(content, styles, formatting):
+    """Split the content into (text, style) pieces following the formatting runs."""
+    styles = [style_from_dict(style_data) for style_data in styles]
+    if utf16_length(content) == len(content):
+        cut = lambda start, end: content[start:end]
+    else:
+        # Ranges count UTF-16 units, characters outside the BMP take two
+        encoded = content.encode("utf-16-le", "surrogatepass")
+        cut = lambda start, end: encoded[2 * start:2 * end].decode("utf-16-le", "surrogatepass")
+    length = utf16_length(content)
+
+    position = 0
+    for format_data in formatting:
+        start, end = format_data["range"]
+        start, end = max(start, position), min(end, length)
+        if start >= end:
+            continue
+        if start > position:
+            yield cut(position, start), plain_style
+        yield cut(start, end), styles[format_data["style"]]
+        position = end
+    if position < length:
+        yield cut(position, length), plain_style
+
+
+def render_html(content, styles, formatting, title="Untitled"):
+    body = []
+    for text, (bold, italic, underline, font, size, color, highlight) in styled_segments(content, styles, formatting):
+        text = html.escape(text)
+        css = []
+        if font:
+            css.append(f"font-family: '{font}'")
+        if size:
+            css.append(f"font-size: {size}pt")
+        if color:
+            css.append(f"color: {css_color(color)}")
+        if highlight:
+            css.append(f"background-color: {css_color(highlight)}")
+        if css:
+            text = f"<span style=\"{html.escape('; '.join(css))}\">{text}</span>"
+        if underline:
+            text = f"<u>{text}</u>"
+        if italic:
+            text = f"<i>{text}</i>"
+        if bold:
+            text = f"<b>{text}</b>"
+        body.append(text)
+    return ("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+            f"<title>{html.escape(title)}</title>\n</head>\n<body>\n"
+            "<pre style=\"white-space: pre-wrap; font-family: 'Courier New', monospace\">"
+            + "".join(body) + "</pre>\n</body>\n</html>\n")
+
+
+def render_markdown(content, styles, formatting):
+    # Markdown has no underline, and emphasis markers neither span lines nor work
+    # reliably inside words, so markers are put around each line's stripped text
+    # only where spaces or line ends surround it; elsewhere inline HTML is used.
+    # Every line break is kept as a hard break. Fonts, sizes and colours are left out.
+    segments = list(styled_segments(content, styles, formatting))
+    pieces = []
+    for index, (text, style) in enumerate(segments):
+        before = segments[index - 1][0][-1:] if index else ""
+        after = segments[index + 1][0][:1] if index + 1 < len(segments) else ""
+        lines = text.split("\n")
+        for number, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped or not any(style[:3]):
+                lines[number] = escape_markdown(line)
+                continue
+            leading = line[:len(line) - len(line.lstrip())]
+            trailing = line[len(line.rstrip()):]
+            separated = ((leading or number > 0 or not before.strip())
+                         and (trailing or number < len(lines) - 1 or not after.strip()))
+            lines[number] = leading + emphasize(escape_markdown(stripped), style, separated) + trailing
+        pieces.append("\n".join(lines))
+    markdown = markdown_line_start.sub(r"\1\\\2", "".join(pieces))
+    return re.sub(r"(?<=\S)\n(?=.*\S)", "\\\\\n", markdown) + "\n"
+
+
+def emphasize(text, style, markers):
+    bold, italic, underline = style[:3]
+    if underline:
+        text = f"<u>{text}</u>"
+    if italic:
+        text = f"*{text}*" if markers else f"<i>{text}</i>"
+    if bold:
+        text = f"**{text}**" if markers else f"<b>{text}</b>"
+    return text
+
+
+def css_color(color):
+    # Stored as #aarrggbb when translucent, CSS reads eight digits as #rrggbbaa
+    if len(color) == 9:
+        return "#" + color[3:] + color[1:3]
+    return color
+
+
+def escape_markdown(text):
+    return markdown_special.sub(r"\\\1", text)
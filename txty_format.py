@@ -0,0 +1,359 @@
+"""Reading and writing .txty documents, independent of the GUI.
+
+Three versions exist and are told apart by their first bytes:
+
+Version 1 is the original indented JSON document:
+    {"metadata": {...}, "content": "...", "formatting": [{"bold", "italic", "underline", "range"}, ...]}
+
+Version 2 is a binary container:
+    header      magic b"TXTY", version u16, flags u16, metadata size u32, text size u64, run count u64
+    metadata    UTF-8 JSON object
+    text        the UTF-8 content as one contiguous section
+    runs        run count packed runs of offset u64, length u32, style bitmask u8
+
+Version 3 adds an interned style table:
+    header      magic b"TXTY", version u16, flags u16, metadata size u32, styles size u32, text size u64, run count u64
+    metadata    UTF-8 JSON object
+    styles      UTF-8 JSON array of styles, a run refers to a style by its index
+    text        the UTF-8 content as one contiguous section
+    runs        run count packed runs of gap u32 (from the end of the previous run), length u32, style index u32
+
+All versions are read into the same dict layout:
+    {"metadata": {...}, "content": "...", "styles": [{...}, ...], "formatting": [{"style", "range"}, ...]}
+
+A style holds only the attributes that differ from plain text: "bold", "italic"
+and "underline" (true), "font" (family name), "size" (points), "color" and
+"highlight" ("#rrggbb", "#aarrggbb" when translucent). Each distinct style is
+stored once, so new attributes grow the table and never the runs. Formatting
+ranges count UTF-16 code units, as positions in a QTextDocument do.
+
+Versions 1 and 2 can still be written for older readers: version 1 puts the
+style attributes back into every run, version 2 keeps bold, italic and
+underline only.
+
+Plain .txt files are read and written through text_encoding, which detects
+their encoding, byte order mark and line endings and writes them back the same.
+"""
+import gc
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+from array import array
+from itertools import accumulate
+from contextlib import contextmanager
+from text_encoding import read_text, encode_text
+
+magic = b"TXTY"
+current_version = 3
+prefix_struct = struct.Struct("<4sH") # magic and version, shared by all binary versions
+header_struct = struct.Struct("<4sHHIIQQ")
+run_struct = struct.Struct("<III")
+run_value_type = "I" if array("I").itemsize == 4 else "L" # u32, three per version 3 run
+header_struct_v2 = struct.Struct("<4sHHIQQ")
+run_struct_v2 = struct.Struct("<QIB")
+
+# A style in memory is a tuple of these attributes, plain text has all of them falsy
+style_keys = ("bold", "italic", "underline", "font", "size", "color", "highlight")
+plain_style = (False, False, False, None, None, None, None)
+style_bits = {"bold": 1, "italic": 2, "underline": 4} # version 2 bitmask
+
+
+class TxtyFormatError(ValueError):
+    pass
+
+
+class StyleTable:
+    """Interns styles: every distinct style gets one index, in order of first use."""
+
+    def __init__(self):
+        self.styles = []
+        self.indexes = {}
+
+    def index(self, style):
+        index = self.indexes.get(style)
+        if index is None:
+            index = self.indexes[style] = len(self.styles)
+            self.styles.append(style)
+        return index
+
+    def to_list(self):
+        return [style_to_dict(style) for style in self.styles]
+
+
+def style_from_dict(style_data):
+    """Style tuple of a style table entry, or of a version 1 run."""
+    return (bool(style_data.get("bold", False)), bool(style_data.get("italic", False)), bool(style_data.get("underline", False)),
+            style_data.get("font") or None, style_data.get("size") or None,
+            style_data.get("color") or None, style_data.get("highlight") or None)
+
+
+def style_to_dict(style):
+    return {key: value for key, value in zip(style_keys, style) if value}
+
+
+def style_mask(style):
+    return (style[0] and style_bits["bold"]) | (style[1] and style_bits["italic"]) | (style[2] and style_bits["underline"])
+
+
+def style_from_mask(mask):
+    return (bool(mask & style_bits["bold"]), bool(mask & style_bits["italic"]), bool(mask & style_bits["underline"])) + plain_style[3:]
+
+
+def utf16_length(content):
+    return len(content.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def validate_txty(document):
+    """Problems found in a document dict read by read_txty, an empty list when it is sound."""
+    problems = []
+    styles = document["styles"]
+    for index, style_data in enumerate(styles):
+        if not isinstance(style_data, dict):
+            problems.append(f"style {index}: not an object")
+            continue
+        unknown = sorted(set(style_data) - set(style_keys))
+        if unknown:
+            problems.append(f"style {index}: unknown attributes {', '.join(unknown)}")
+        if any(not isinstance(style_data.get(key, False), bool) for key in style_keys[:3]):
+            problems.append(f"style {index}: bold, italic and underline are not true/false")
+        if not isinstance(style_data.get("size", 0), (int, float)) or isinstance(style_data.get("size"), bool):
+            problems.append(f"style {index}: size is not a number")
+        if any(not isinstance(style_data.get(key, ""), str) for key in ("font", "color", "highlight")):
+            problems.append(f"style {index}: font, color or highlight is not text")
+
+    content_length = utf16_length(document["content"])
+    previous_end = 0
+    for index, format_data in enumerate(document["formatting"]):
+        run_range = format_data.get("range") if isinstance(format_data, dict) else None
+        if not (isinstance(run_range, list) and len(run_range) == 2 and all(isinstance(value, int) for value in run_range)):
+            problems.append(f"run {index}: 'range' is not a [start, end] pair")
+            continue
+        start, end = run_range
+        if not 0 <= start < end <= content_length:
+            problems.append(f"run {index}: range {start}-{end} is outside the text (length {content_length})")
+        elif start < previous_end:
+            problems.append(f"run {index}: range {start}-{end} overlaps or precedes the previous run")
+        style = format_data.get("style")
+        if not isinstance(style, int) or not 0 <= style < len(styles):
+            problems.append(f"run {index}: style {style!r} is not in the style table")
+        previous_end = max(previous_end, end)
+    return problems
+
+
+@contextmanager
+def collection_paused():
+    # A large document decodes into hundreds of thousands of run dicts. None of
+    # them can form a reference cycle, yet their allocation keeps triggering
+    # the cyclic garbage collector, which then takes most of the load time.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def is_binary_txty(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(magic)) == magic
+
+
+def read_txty(file_path):
+    """Read a .txty file of any version into a {"metadata", "content", "styles", "formatting"} dict."""
+    if is_binary_txty(file_path):
+        return read_binary_txty(file_path)
+    with open(file_path, 'rb') as file:
+        return parse_json_txty(file.read())
+
+
+def parse_json_txty(data):
+    with collection_paused():
+        return parse_json_document(data)
+
+
+def parse_json_document(data):
+    try:
+        document = json.loads(data)
+    except ValueError as error:
+        raise TxtyFormatError(f"Not a valid .txty file: {error}") from error
+    if not isinstance(document, dict) or not isinstance(document.get("content"), str):
+        raise TxtyFormatError("'content' is missing from the .txty file")
+    document.setdefault("metadata", {})
+    document.setdefault("formatting", [])
+    if not isinstance(document["formatting"], list) or not all(isinstance(format_data, dict) for format_data in document["formatting"]):
+        raise TxtyFormatError("'formatting' is not a list of runs")
+    if "styles" not in document:
+        # Version 1 runs carry their style attributes themselves
+        table = StyleTable()
+        document["formatting"] = [{"style": table.index(style_from_dict(format_data)), "range": format_data.get("range")}
+                                  for format_data in document["formatting"]]
+        document["styles"] = table.to_list()
+    elif not isinstance(document["styles"], list) or any(
+            not isinstance(format_data.get("style"), int) or not 0 <= format_data["style"] < len(document["styles"])
+            for format_data in document["formatting"]):
+        raise TxtyFormatError("A formatting run refers to a style that is not in the style table")
+    return document
+
+
+def read_binary_txty(file_path):
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return decode_binary_txty(mapped)
+
+
+def decode_binary_txty(data):
+    """Decode version 2 or 3 bytes, or any buffer such as a memory mapping, into the common dict layout."""
+    with collection_paused(), memoryview(data) as view:
+        if len(view) < prefix_struct.size:
+            raise TxtyFormatError("Truncated .txty header")
+        file_magic, version = prefix_struct.unpack_from(view)
+        if file_magic != magic or version not in (2, 3):
+            raise TxtyFormatError(f"Unsupported .txty version: {version}")
+        header = header_struct if version == 3 else header_struct_v2
+        if len(view) < header.size:
+            raise TxtyFormatError("Truncated .txty header")
+
+        if version == 3:
+            _, _, _flags, metadata_size, styles_size, text_size, run_count = header.unpack_from(view)
+            runs_size = run_count * run_struct.size
+        else:
+            _, _, _flags, metadata_size, text_size, run_count = header.unpack_from(view)
+            styles_size = 0
+            runs_size = run_count * run_struct_v2.size
+        metadata_start = header.size
+        styles_start = metadata_start + metadata_size
+        text_start = styles_start + styles_size
+        runs_start = text_start + text_size
+        runs_end = runs_start + runs_size
+        if runs_end > len(view):
+            raise TxtyFormatError("Truncated .txty file")
+
+        metadata = json.loads(str(view[metadata_start:styles_start], "utf-8")) if metadata_size else {}
+        # Decoded straight from the buffer, the text section is never copied into a bytes object
+        content = str(view[text_start:runs_start], "utf-8")
+        if version == 2:
+            styles, formatting = decode_runs_v2(view[runs_start:runs_end])
+            return {"metadata": metadata, "content": content, "styles": styles, "formatting": formatting}
+
+        styles = json.loads(str(view[styles_start:text_start], "utf-8")) if styles_size else []
+        if not isinstance(styles, list):
+            raise TxtyFormatError("The .txty style table is not a list")
+        # The runs are read as one array of u32 values; a running sum over the
+        # gaps and lengths alone gives every run's start and end
+        values = array(run_value_type)
+        values.frombytes(view[runs_start:runs_end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        style_indexes = values[2::3]
+        if style_indexes and max(style_indexes) >= len(styles):
+            raise TxtyFormatError(f"Style {max(style_indexes)} is missing from the .txty style table")
+        del values[2::3]
+        bounds = list(accumulate(values))
+        formatting = [{"style": style, "range": [start, end]}
+                      for start, end, style in zip(bounds[0::2], bounds[1::2], style_indexes)]
+        return {"metadata": metadata, "content": content, "styles": styles, "formatting": formatting}
+
+
+def decode_runs_v2(runs):
+    # Bitmask styles, interned in order of first use
+    runs = list(run_struct_v2.iter_unpack(runs))
+    table = StyleTable()
+    indexes = {mask: table.index(style_from_mask(mask)) for mask in dict.fromkeys(mask for _, _, mask in runs)}
+    formatting = [{"style": indexes[mask], "range": [offset, offset + length]} for offset, length, mask in runs]
+    return table.to_list(), formatting
+
+
+def read_plain_text(file_path):
+    return read_text(file_path)[0]
+
+
+def encode_plain_text(content, text_encoding=None):
+    """Bytes of a .txt file, in the encoding it was read with or UTF-8 with the platform's line endings."""
+    return encode_text(content, text_encoding)
+
+
+def write_txty(file_path, content, styles, formatting, metadata=None, version=current_version):
+    """Write a .txty file, the current version unless an older one is asked for."""
+    write_bytes_atomic(file_path, encode_txty(content, styles, formatting, metadata, version))
+
+
+def encode_txty(content, styles, formatting, metadata=None, version=current_version):
+    if version == 1:
+        # Every run spells out bold, italic and underline, as version 1 readers expect
+        legacy_styles = [{"bold": False, "italic": False, "underline": False, **style_data} for style_data in styles]
+        data = {
+            "metadata": metadata or {},
+            "content": content,
+            "formatting": [{**legacy_styles[format_data["style"]], "range": format_data["range"]} for format_data in formatting]
+        }
+        return json.dumps(data, indent=4).encode("utf-8")
+    return encode_binary_txty(content, styles, formatting, metadata, version)
+
+
+def write_bytes_atomic(file_path, data):
+    """Write to a temporary file next to the target, fsync it and rename it over the target.
+
+    A crash at any point leaves either the old file or the complete new one, never a truncated file.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    descriptor, temporary_path = tempfile.mkstemp(prefix="." + os.path.basename(file_path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temporary_path, file_mode(file_path))
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    if hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable
+        directory_descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+
+def file_mode(file_path):
+    # mkstemp creates the file as 0600, keep the mode a plain open() would have given it
+    try:
+        return os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def encode_binary_txty(content, styles, formatting, metadata=None, version=current_version):
+    if version not in (2, 3):
+        raise ValueError(f"Cannot write binary .txty version {version}")
+    metadata_bytes = json.dumps(metadata or {}).encode("utf-8")
+    text_bytes = content.encode("utf-8")
+
+    if version == 2:
+        masks = [style_mask(style_from_dict(style_data)) for style_data in styles]
+        runs = bytearray(len(formatting) * run_struct_v2.size)
+        for index, format_data in enumerate(formatting):
+            start, end = format_data["range"]
+            run_struct_v2.pack_into(runs, index * run_struct_v2.size, start, end - start, masks[format_data["style"]])
+        header = header_struct_v2.pack(magic, 2, 0, len(metadata_bytes), len(text_bytes), len(formatting))
+        return b"".join((header, metadata_bytes, text_bytes, runs))
+
+    styles_bytes = json.dumps(styles, separators=(",", ":")).encode("utf-8") if styles else b""
+    runs = bytearray(len(formatting) * run_struct.size)
+    position = 0
+    for index, format_data in enumerate(formatting):
+        start, end = format_data["range"]
+        if start < position:
+            raise TxtyFormatError(f"Formatting run {index} overlaps the previous one")
+        run_struct.pack_into(runs, index * run_struct.size, start - position, end - start, format_data["style"])
+        position = end
+    header = header_struct.pack(magic, version, 0, len(metadata_bytes), len(styles_bytes), len(text_bytes), len(formatting))
+    return b"".join((header, metadata_bytes, styles_bytes, text_bytes, runs))
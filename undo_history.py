@@ -0,0 +1,881 @@
+"""Undo history of a document, kept within a memory limit.
+
+QTextDocument's own undo stack has no limit and cannot be trimmed. It keeps
+every removed piece of text and every old format in full, so a replace over a
+large file or a format toggle over the whole document stays in memory for the
+rest of the session. The document's stack is switched off and UndoHistory
+keeps one instead. Each step is the list of changes Qt reported, and each
+change holds the text and styled runs that were replaced and those that
+replaced them.
+
+Qt only reports a change after it has happened. The text an edit may replace
+is therefore read just before it: around the cursor and the selection for a
+keystroke, a drop or a context menu, and over the given range when the editor
+changes the document itself (capture()). A change outside the range read
+cannot be undone, and the history starts over from it. Large text put in by a
+change is not read until the step is undone, the document holds it until then.
+
+Format changes are made through change_format(). They keep only the runs whose
+style the change alters, with the style they had, and none at all when the
+document's formats show that the whole range had one style.
+
+Replace all goes through replace_ranges(), which keeps only the replaced ranges
+and the text put in them. Many ranges are replaced by putting in the whole text
+again, which Qt does faster than thousands of separate insertions.
+
+Consecutive keystrokes make one step per word. Text larger than
+compress_size is kept as zlib-compressed .txty bytes. Once the history grows
+past memory_limit, the oldest steps are dropped.
+"""
+import time
+import zlib
+import operator
+import itertools
+from contextlib import nullcontext
+from array import array
+from PySide6 import QtCore
+from PySide6.QtCore import QObject, QEvent, QTimer, Signal
+from PySide6.QtGui import QKeySequence as KeySequence, QTextCursor as TextCursor, QTextCharFormat as TextCharFormat
+from text_formats import (range_formatting, format_pieces, document_styles, document_formatting, style_key, changed_style,
+                          change_char_format, char_format_from_style_key)
+from txty_format import (StyleTable, encode_binary_txty, decode_binary_txty, style_from_dict, style_to_dict, utf16_length,
+                         plain_style, run_value_type)
+
+undo_memory_limit = 64 * 1024 * 1024 # bytes of undo history per document, the oldest steps are dropped first
+compress_size = 4096 # characters, larger text is kept compressed
+compression_level = 1 # the compressed text only lives in memory, fast beats small
+capture_margin = 256 # characters read on each side of the cursor before a keystroke, more than one key deletes
+coalesce_interval = 1.0 # seconds, keystrokes further apart are separate steps
+run_size = 80 # bytes, rough cost of an uncompressed formatting run
+splice_limit = 2000 # ranges, replace_ranges() puts in the whole text again for more
+editing_keys = [] # QKeySequence.StandardKey values that edit the text, see editing_key_sequences()
+
+
+def editing_key_sequences():
+    """The standard key sequences that edit the text.
+
+    Built on first use rather than at import: PySide creates an enum type the
+    first time it is touched, about 30 ms for the Qt namespace, which the editor
+    does not pay before its first paint. Qt is looked up through QtCore for the
+    same reason.
+    """
+    if not editing_keys:
+        editing_keys.extend([KeySequence.Cut, KeySequence.Paste, KeySequence.Delete, KeySequence.DeleteStartOfWord,
+                             KeySequence.DeleteEndOfWord, KeySequence.DeleteEndOfLine, KeySequence.DeleteCompleteLine,
+                             KeySequence.InsertParagraphSeparator, KeySequence.InsertLineSeparator])
+    return editing_keys
+
+
+class Excerpt:
+    """Text of a document range with its styled runs, positions and lengths in UTF-16 units as in the document."""
+
+    def __init__(self, text="", length=0, runs=()):
+        self.text = text
+        self.length = length
+        self.runs = list(runs) # [offset, length, style]
+
+    @property
+    def size(self):
+        return len(self.text) * 2 + len(self.runs) * run_size
+
+    def text_slice(self, start, end):
+        if len(self.text) == self.length:
+            return self.text[start:end]
+        # Characters outside the BMP take two positions, slice the UTF-16 form
+        data = self.text.encode("utf-16-le", "surrogatepass")
+        return data[start * 2:end * 2].decode("utf-16-le", "surrogatepass")
+
+    def slice(self, start, end):
+        if start == 0 and end == self.length:
+            return self
+        runs = [[max(offset, start) - start, min(offset + length, end) - max(offset, start), style]
+                for offset, length, style in self.runs if offset < end and offset + length > start]
+        return Excerpt(self.text_slice(start, end), end - start, runs)
+
+    def splice(self, start, end, excerpt):
+        """This excerpt with the part from start to end replaced by `excerpt`."""
+        before, after = self.slice(0, start), self.slice(end, self.length)
+        shift = start + excerpt.length
+        runs = before.runs + [[offset + start, length, style] for offset, length, style in excerpt.runs] + \
+            [[offset + shift, length, style] for offset, length, style in after.runs]
+        return Excerpt(before.text + excerpt.text + after.text, self.length - (end - start) + excerpt.length, runs)
+
+    def pack(self):
+        # Kept as they are when small, as zlib-compressed .txty bytes otherwise
+        if len(self.text) < compress_size and len(self.runs) * run_size < compress_size:
+            return self
+        return PackedExcerpt(self)
+
+
+class PackedExcerpt:
+    """An Excerpt compressed, unpacked again when its step is undone or redone."""
+
+    def __init__(self, excerpt):
+        table = StyleTable()
+        formatting = [{"style": table.index(style), "range": [offset, offset + length]} for offset, length, style in excerpt.runs]
+        self.length = excerpt.length
+        self.data = zlib.compress(encode_binary_txty(excerpt.text, table.to_list(), formatting), compression_level)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def unpack(self):
+        data = decode_binary_txty(zlib.decompress(self.data))
+        styles = [style_from_dict(style_data) for style_data in data["styles"]]
+        runs = [[start, end - start, styles[format_data["style"]]] for format_data in data["formatting"]
+                for start, end in [format_data["range"]]]
+        return Excerpt(data["content"], self.length, runs)
+
+
+def unpacked(excerpt):
+    return excerpt.unpack() if isinstance(excerpt, PackedExcerpt) else excerpt
+
+
+def read_excerpt(document, start, end):
+    cursor = TextCursor(document)
+    cursor.setPosition(start)
+    cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
+    return Excerpt(cursor.selectedText().replace("\u2029", "\n"), end - start, range_formatting(document, start, end))
+
+
+def replace_range(cursor, position, length, excerpt, format_only):
+    # Puts `excerpt` over the `length` characters at `position`, only its formats when the text stays the same
+    excerpt = unpacked(excerpt)
+    cursor.setPosition(position)
+    cursor.setPosition(position + length, TextCursor.MoveMode.KeepAnchor)
+    if format_only:
+        cursor.setCharFormat(TextCharFormat())
+    else:
+        cursor.insertText(excerpt.text, TextCharFormat())
+    for offset, run_length, style in excerpt.runs:
+        cursor.setPosition(position + offset)
+        cursor.setPosition(position + offset + run_length, TextCursor.MoveMode.KeepAnchor)
+        cursor.setCharFormat(char_format_from_style_key(style))
+    return position, excerpt.length
+
+
+def changed_runs(document, start, end, changes, replace):
+    """The runs of the text from start to end that a format change alters, as [offset, length, style before].
+
+    Also returns the style all of the text had, None when it had more than one.
+    """
+    runs = []
+    known = {} # char format index -> (style, whether the change alters it)
+    uniform = None
+    mixed = False
+    for run_start, run_end, format_index, source in format_pieces(document, start, end):
+        style_altered = known.get(format_index)
+        if style_altered is None:
+            style = style_key(source.charFormat())
+            style_altered = known[format_index] = (style, changed_style(style, changes, replace) != style)
+        style, altered = style_altered
+        if uniform is None:
+            uniform = style
+        elif not mixed and style != uniform:
+            mixed = True
+        if not altered:
+            continue
+        if runs and runs[-1][2] == style and runs[-1][0] + runs[-1][1] == run_start - start:
+            runs[-1][1] += run_end - run_start
+        else:
+            runs.append([run_start - start, run_end - run_start, style])
+    return runs, None if mixed else uniform
+
+
+def append_run(runs, offset, length, style):
+    # Adds a run, joined with the one before when it continues it in the same style
+    if runs and runs[-1][2] == style and runs[-1][0] + runs[-1][1] == offset:
+        runs[-1][1] += length
+    else:
+        runs.append([offset, length, style])
+
+
+def read_ranges(document, starts, lengths):
+    """Text and styled runs of ranges in document order, as one Excerpt of all of them one after another."""
+    total = sum(lengths)
+    if len(starts) > splice_limit:
+        # Sliced from the whole text and formatting, which costs less than reading each range
+        text = document.toRawText().replace("\u2029", "\n")
+        if len(text) == document.characterCount() - 1:
+            styles = document_styles(document)
+            if len(styles) == 1:
+                style = next(iter(styles))
+                runs = [[0, total, style]] if any(style) and total else []
+            else:
+                runs = range_runs(document_runs(document), starts, lengths)
+            return Excerpt("".join([text[start:start + length] for start, length in zip(starts, lengths)]), total, runs)
+
+    excerpts = [read_excerpt(document, start, start + length) for start, length in zip(starts, lengths)]
+    runs = []
+    offset = 0
+    for excerpt in excerpts:
+        for run_offset, run_length, style in excerpt.runs:
+            append_run(runs, offset + run_offset, run_length, style)
+        offset += excerpt.length
+    return Excerpt("".join([excerpt.text for excerpt in excerpts]), total, runs)
+
+
+def document_runs(document):
+    # [start, end, style] runs covering all of the document's text
+    styles, formatting = document_formatting(document)
+    styles = [style_from_dict(style_data) for style_data in styles]
+    return [(format_data["range"][0], format_data["range"][1], styles[format_data["style"]]) for format_data in formatting]
+
+
+def range_runs(runs, starts, lengths):
+    # The styled runs of the ranges one after another, from [start, end, style] runs of the whole document
+    range_runs = []
+    index = 0
+    offset = 0
+    for start, length in zip(starts, lengths):
+        end = start + length
+        while index < len(runs) and runs[index][1] <= start:
+            index += 1
+        run_index = index
+        while run_index < len(runs) and runs[run_index][0] < end:
+            run_start, run_end, style = runs[run_index]
+            if any(style):
+                append_run(range_runs, offset + max(run_start, start) - start, min(run_end, end) - max(run_start, start), style)
+            run_index += 1
+        offset += length
+    return range_runs
+
+
+def excerpt_parts(excerpt, lengths):
+    """The Excerpt cut into consecutive parts of the given lengths."""
+    text, runs = excerpt.text, excerpt.runs
+    data = None if len(text) == excerpt.length else text.encode("utf-16-le", "surrogatepass")
+    index = 0
+    offset = 0
+    for length in lengths:
+        end = offset + length
+        while index < len(runs) and runs[index][0] + runs[index][1] <= offset:
+            index += 1
+        part_runs = []
+        run_index = index
+        while run_index < len(runs) and runs[run_index][0] < end:
+            run_offset, run_length, style = runs[run_index]
+            part_runs.append([max(run_offset, offset) - offset, min(run_offset + run_length, end) - max(run_offset, offset), style])
+            run_index += 1
+        part_text = text[offset:end] if data is None else data[offset * 2:end * 2].decode("utf-16-le", "surrogatepass")
+        yield Excerpt(part_text, length, part_runs)
+        offset = end
+
+
+def splice_ranges(cursor, starts, lengths, parts, part_lengths):
+    """Put the parts of the Excerpt `parts` over the ranges at `starts`, in document order, one part each.
+
+    Up to splice_limit ranges are replaced one by one, from the last, more by
+    putting in the document's whole text again with all of them replaced.
+    Returns the position and length of the last part.
+    """
+    parts = unpacked(parts)
+    position = starts[-1] + sum(part_lengths) - part_lengths[-1] - (sum(lengths) - lengths[-1])
+    if len(starts) > splice_limit:
+        text = cursor.document().toRawText()
+        # Document positions count UTF-16 units, string positions would drift from them otherwise
+        if len(text) == cursor.document().characterCount() - 1 and len(parts.text) == parts.length:
+            rebuild_ranges(cursor, text, starts, lengths, parts, part_lengths)
+            return position, part_lengths[-1]
+    for start, length, part in reversed(list(zip(starts, lengths, excerpt_parts(parts, part_lengths)))):
+        replace_range(cursor, start, length, part, False)
+    return position, part_lengths[-1]
+
+
+def rebuild_ranges(cursor, text, starts, lengths, parts, part_lengths):
+    # The whole text put in again with the parts in place of the ranges, one insertion instead of one per range
+    document = cursor.document()
+    ends = [start + length for start, length in zip(starts, lengths)]
+    offsets = list(itertools.accumulate(part_lengths, initial=0))
+    part_text = parts.text
+    pieces = [None] * (len(starts) * 2 + 1)
+    pieces[0::2] = [text[end:start] for end, start in zip([0, *ends], [*starts, len(text)])]
+    pieces[1::2] = [part_text[offset:end] for offset, end in zip(offsets, offsets[1:])]
+
+    styles = document_styles(document)
+    style = next(iter(styles)) if len(styles) == 1 else None
+    if style is not None and parts.runs == ([[0, parts.length, style]] if any(style) and parts.length else []):
+        # One style before, and the parts have it too
+        runs = []
+        char_format = char_format_from_style_key(style)
+    else:
+        runs = spliced_runs(document_runs(document), starts, lengths, parts.runs, part_lengths)
+        char_format = TextCharFormat()
+    cursor.select(TextCursor.SelectionType.Document)
+    cursor.insertText("".join(pieces), char_format)
+    for start, end, run_style in runs:
+        if any(run_style):
+            cursor.setPosition(start)
+            cursor.setPosition(end, TextCursor.MoveMode.KeepAnchor)
+            cursor.setCharFormat(char_format_from_style_key(run_style))
+
+
+def spliced_runs(runs, starts, lengths, part_runs, part_lengths):
+    """[start, end, style] runs of the whole document once each range is replaced by its part.
+
+    `runs` cover all of the document's text, `part_runs` are the parts' styled runs
+    one after another, the rest of the parts is plain.
+    """
+    new_runs = []
+    new_length = 0
+    run_index = 0
+    part_index = 0
+
+    def add(style, length):
+        nonlocal new_length
+        if not length:
+            return
+        if new_runs and new_runs[-1][2] == style:
+            new_runs[-1][1] += length
+        else:
+            new_runs.append([new_length, new_length + length, style])
+        new_length += length
+
+    def copy(start, end):
+        nonlocal run_index
+        while start < end:
+            while run_index < len(runs) - 1 and runs[run_index][1] <= start:
+                run_index += 1
+            _, run_end, style = runs[run_index]
+            run_end = min(end, run_end) if run_end > start else end
+            add(style, run_end - start)
+            start = run_end
+
+    def put(offset, end):
+        nonlocal part_index
+        while part_index < len(part_runs) and part_runs[part_index][0] + part_runs[part_index][1] <= offset:
+            part_index += 1
+        index = part_index
+        while offset < end:
+            if index < len(part_runs) and part_runs[index][0] < end:
+                run_offset, run_length, style = part_runs[index]
+                if run_offset > offset:
+                    add(plain_style, run_offset - offset)
+                    offset = run_offset
+                run_end = min(end, run_offset + run_length)
+                add(style, run_end - offset)
+                offset = run_end
+                index += 1
+            else:
+                add(plain_style, end - offset)
+                offset = end
+
+    position = 0
+    offset = 0
+    for start, length, part_length in zip(starts, lengths, part_lengths):
+        copy(position, start)
+        put(offset, offset + part_length)
+        position = start + length
+        offset += part_length
+    copy(position, runs[-1][1] if runs else position)
+    return new_runs
+
+
+def first_styles(old, old_lengths, new_lengths):
+    # Runs that give each new text the style of the first character it replaces, as typing over a selection does
+    new_total = sum(new_lengths)
+    if not old.runs or not new_total:
+        return []
+    if old.runs == [[0, old.length, old.runs[0][2]]]:
+        return [[0, new_total, old.runs[0][2]]] # all of one style
+    runs = []
+    index = 0
+    offset = 0
+    new_offset = 0
+    for old_length, new_length in zip(old_lengths, new_lengths):
+        while index < len(old.runs) and old.runs[index][0] + old.runs[index][1] <= offset:
+            index += 1
+        if new_length and old_length and index < len(old.runs) and old.runs[index][0] <= offset:
+            append_run(runs, new_offset, new_length, old.runs[index][2])
+        offset += old_length
+        new_offset += new_length
+    return runs
+
+
+class Change:
+    """One change Qt reported: `old` replaced by `new` at `position`.
+
+    When a change puts in text of compress_size or more, `new` is None and
+    only its length is kept. It is read from the document when the step is
+    first undone, the document holds it until then.
+    """
+
+    def __init__(self, position, old, new, new_length=0):
+        self.position = position
+        self.old = old
+        self.new = new
+        self.new_length = new_length if new is None else new.length
+        self.format_only = None if new is None else old.length == new.length and unpacked(old).text == new.text
+
+    @property
+    def size(self):
+        return self.old.size + (self.new.size if self.new is not None else 0)
+
+    def read_new(self, document):
+        new = read_excerpt(document, self.position, self.position + self.new_length)
+        self.format_only = self.old.length == new.length and unpacked(self.old).text == new.text
+        self.new = new.pack()
+
+    def pack(self):
+        self.old = self.old.pack()
+        if self.new is not None:
+            self.new = self.new.pack()
+
+    def undo(self, cursor):
+        if self.new is None:
+            self.read_new(cursor.document())
+        return replace_range(cursor, self.position, self.new.length, self.old, self.format_only)
+
+    def redo(self, cursor):
+        return replace_range(cursor, self.position, self.old.length, self.new, self.format_only)
+
+
+class FormatChange:
+    """A format change made with change_format(): `changes` merged into, or with `replace` set over, a range.
+
+    Only the runs whose style it altered are kept, as [offset, length, style index]
+    triples in an array, with the styles they had. `style` is the one style all of
+    the range had before, None when it had several or that is not known.
+    """
+
+    def __init__(self, position, length, changes, replace, runs, style=None):
+        self.position = position
+        self.length = length
+        self.changes = changes
+        self.replace = replace
+        self.style = style
+        table = StyleTable()
+        self.runs = array(run_value_type, [value for offset, run_length, run_style in runs
+                                           for value in (offset, run_length, table.index(run_style))])
+        self.styles = table.styles
+
+    @property
+    def size(self):
+        return len(self.runs) * self.runs.itemsize + len(self.styles) * run_size
+
+    def pack(self):
+        pass # compact as it is
+
+    def style_after(self, undone):
+        # The one style of all of the range once the change is undone or made, None when not known
+        if self.style is None:
+            return None
+        return self.style if undone else changed_style(self.style, self.changes, self.replace)
+
+    def undo(self, cursor):
+        runs = self.runs
+        for index in range(0, len(runs), 3):
+            cursor.setPosition(self.position + runs[index])
+            cursor.setPosition(self.position + runs[index] + runs[index + 1], TextCursor.MoveMode.KeepAnchor)
+            cursor.setCharFormat(char_format_from_style_key(self.styles[runs[index + 2]]))
+        return self.position, self.length
+
+    def redo(self, cursor):
+        cursor.setPosition(self.position)
+        cursor.setPosition(self.position + self.length, TextCursor.MoveMode.KeepAnchor)
+        if self.replace:
+            cursor.setCharFormat(change_char_format(self.changes, replace=True))
+        else:
+            cursor.mergeCharFormat(change_char_format(self.changes))
+        return self.position, self.length
+
+    def operations(self, undone):
+        # The (position, length, changes, replace) edits undo() or redo() makes, in order
+        if not undone:
+            return [(self.position, self.length, self.changes, self.replace)]
+        runs = self.runs
+        return [(self.position + runs[index], runs[index + 1], style_to_dict(self.styles[runs[index + 2]]), True)
+                for index in range(0, len(runs), 3)]
+
+
+class Replacements:
+    """Ranges replaced in one edit with replace_ranges(), each by a text of its own.
+
+    `starts` are where the ranges started before the edit and `old_lengths` and
+    `new_lengths` how long each was before and after it, in arrays. `old` and `new`
+    are Excerpts of the text of all of the ranges one after another, so a replace
+    all keeps the matches and what replaced them rather than the whole document.
+    """
+
+    def __init__(self, starts, old_lengths, old, new_lengths, new):
+        self.starts = array(run_value_type, starts)
+        self.old_lengths = array(run_value_type, old_lengths)
+        self.new_lengths = array(run_value_type, new_lengths)
+        self.old = old
+        self.new = new
+
+    @property
+    def size(self):
+        return len(self.starts) * self.starts.itemsize * 3 + self.old.size + self.new.size
+
+    def pack(self):
+        self.old = self.old.pack()
+        self.new = self.new.pack()
+
+    def undo(self, cursor):
+        # The ranges moved by the length each replacement before them added or took away
+        shifts = itertools.accumulate(map(operator.sub, self.new_lengths, self.old_lengths), initial=0)
+        starts = [start + shift for start, shift in zip(self.starts, shifts)]
+        return splice_ranges(cursor, starts, self.new_lengths, self.old, self.old_lengths)
+
+    def redo(self, cursor):
+        return splice_ranges(cursor, self.starts, self.old_lengths, self.new, self.new_lengths)
+
+
+class UndoStep:
+    """Changes undone and redone together, in the order they were made."""
+
+    def __init__(self, step_id, typing):
+        self.step_id = step_id
+        self.typing = typing # keystrokes, which may be joined with the next ones
+        self.changes = []
+        self.time = time.monotonic()
+
+    @property
+    def size(self):
+        return sum(change.size for change in self.changes)
+
+
+class UndoHistory(QObject):
+    """Undo and redo for one QTextDocument, within `memory_limit` bytes.
+
+    The view the document is shown in is watched for edits through an event
+    filter, which also takes over the undo and redo keys from the QTextEdit.
+    The document counts as unmodified when the history is back at the step it
+    was at when it was last marked unmodified.
+    """
+
+    changed = Signal() # steps were added, removed, undone or redone
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = None
+        self.view = None
+        self.memory_limit = undo_memory_limit
+        self.paused = False # set while the document is replaced as a whole, the history starts over after
+        self.applying = False
+        self.undo_steps = []
+        self.redo_steps = [] # the next one to redo last
+        self.memory = 0
+        self.step_ids = itertools.count(1)
+        self.base_state = 0 # state with every remaining step undone
+        self.clean_state = 0
+        self.captured = None # (start, Excerpt) of the range read before the edit that follows
+        self.captured_typing = False
+        self.uniform = None # (document revision, start, end, style) of a range known to have one style throughout
+        self.format_journal = None # (operations) -> context manager format changes are made in, see AutosaveJournal.format_change()
+        self.step = None # collecting the changes of the current turn of the event loop
+        self.step_timer = QTimer(self)
+        self.step_timer.setSingleShot(True)
+        self.step_timer.setInterval(0)
+        self.step_timer.timeout.connect(self.close_step)
+
+    def set_document(self, document):
+        """Follow another QTextDocument, or none while the document is unloaded."""
+        if self.document is not None:
+            self.document.contentsChange.disconnect(self.on_contents_change)
+            self.document.modificationChanged.disconnect(self.on_modification_changed)
+        self.document = document
+        if document is not None:
+            document.setUndoRedoEnabled(False)
+            document.contentsChange.connect(self.on_contents_change)
+            document.modificationChanged.connect(self.on_modification_changed)
+        self.clear()
+
+    def set_view(self, view):
+        """Watch the QTextEdit showing the document for edits, None while it shows another one."""
+        if self.view is not None:
+            self.view.removeEventFilter(self)
+            self.view.viewport().removeEventFilter(self)
+        self.view = view
+        if view is not None:
+            view.installEventFilter(self)
+            view.viewport().installEventFilter(self)
+
+    def state(self):
+        return self.undo_steps[-1].step_id if self.undo_steps else self.base_state
+
+    def can_undo(self):
+        return bool(self.undo_steps or self.step)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def eventFilter(self, watched, event):
+        event_type = event.type()
+        if event_type == QEvent.KeyPress and watched is self.view:
+            if event.matches(KeySequence.Undo):
+                self.undo()
+                return True
+            if event.matches(KeySequence.Redo):
+                self.redo()
+                return True
+            Qt = QtCore.Qt
+            # QTextEdit handles Backspace by its key, it is only a standard key sequence on macOS
+            if event.key() == Qt.Key_Backspace or any(event.matches(key) for key in editing_key_sequences()):
+                self.capture_at_cursor(typing=not (event.matches(KeySequence.Cut) or event.matches(KeySequence.Paste)))
+            elif event.text() and (event.text().isprintable() or event.text() == "\t") and (
+                    not event.modifiers() & (Qt.ControlModifier | Qt.MetaModifier) or event.modifiers() & Qt.AltModifier):
+                self.capture_at_cursor(typing=True)
+        elif event_type == QEvent.InputMethod and watched is self.view:
+            self.capture_at_cursor(typing=True)
+        elif event_type == QEvent.Drop or event_type == QEvent.ContextMenu or (
+                event_type == QEvent.MouseButtonRelease and event.button() == QtCore.Qt.MiddleButton):
+            # A drop moves the selection to where it is dropped, middle-click pastes the X11 selection there
+            position = self.view.cursorForPosition(event.position().toPoint() if event_type != QEvent.ContextMenu else event.pos())
+            self.capture_at_cursor(position.position())
+        return False
+
+    def capture_at_cursor(self, position=None, typing=False):
+        cursor = self.view.textCursor()
+        start, end = cursor.selectionStart(), cursor.selectionEnd()
+        if position is not None:
+            start, end = min(start, position), max(end, position)
+        self.capture(start - capture_margin, end + capture_margin, typing)
+
+    def capture(self, start, end, typing=False):
+        """Read the range an edit that follows may change, so that it can be undone."""
+        if self.document is None:
+            return
+        self.close_step()
+        end_position = self.document.characterCount() - 1
+        start, end = max(0, start), min(end, end_position)
+        self.captured = (start, read_excerpt(self.document, start, max(start, end)))
+        self.captured_typing = typing
+
+    def change_format(self, start, end, changes, replace=False, styles=None):
+        """Merge the partial .txty style dict `changes` into the text from start to end, or set it instead, as one step.
+
+        A caller that has looked at the text can pass the `styles` it may have.
+        """
+        document = self.document
+        if document is None or start >= end:
+            return
+        self.close_step()
+        self.captured = None
+        self.captured_typing = False
+        # The styles before are read from the text only when the last format change, the
+        # caller's styles or the document's formats leave more than one possible
+        style = self.uniform_style(start, end)
+        if style is not None:
+            styles = {style}
+        elif styles is None:
+            styles = document_styles(document)
+        if len(styles) == 1:
+            style = next(iter(styles))
+            runs = [[0, end - start, style]] if changed_style(style, changes, replace) != style else []
+        elif all(changed_style(known, changes, replace) == known for known in styles):
+            runs = []
+        else:
+            runs, style = changed_runs(document, start, end, changes, replace)
+        if not runs:
+            return # nothing it would change
+
+        change = FormatChange(start, end - start, changes, replace, runs, style)
+        cursor = TextCursor(document)
+        self.applying = True
+        try:
+            with self.journaling(change.operations(undone=False)):
+                cursor.beginEditBlock()
+                change.redo(cursor)
+                cursor.endEditBlock()
+        finally:
+            self.applying = False
+        self.remember_style(change, undone=False)
+        self.add_change(change)
+
+    def replace_ranges(self, starts, lengths, texts):
+        """Replace the ranges at `starts`, in document order, each by its text of `texts`, as one step.
+
+        Each text takes the style of the first character it replaces.
+        """
+        document = self.document
+        if document is None or not starts:
+            return
+        self.close_step()
+        self.captured = None
+        self.captured_typing = False
+        old = read_ranges(document, starts, lengths)
+        new_text = "".join(texts)
+        # Only characters outside the BMP take two positions, without them a text's length is its own
+        new_lengths = list(map(len if utf16_length(new_text) == len(new_text) else utf16_length, texts))
+        new = Excerpt(new_text, sum(new_lengths), first_styles(old, lengths, new_lengths))
+        change = Replacements(starts, lengths, old, new_lengths, new)
+        cursor = TextCursor(document)
+        self.applying = True
+        try:
+            cursor.beginEditBlock()
+            change.redo(cursor)
+            cursor.endEditBlock()
+        finally:
+            self.applying = False
+        self.add_change(change)
+
+    def journaling(self, operations):
+        # None for edits that are not format changes only
+        if self.format_journal is None or operations is None:
+            return nullcontext()
+        return self.format_journal(operations)
+
+    def uniform_style(self, start, end):
+        # The style of all of the text from start to end, if a format change left it with one that is still there
+        if self.uniform is None:
+            return None
+        revision, uniform_start, uniform_end, style = self.uniform
+        if revision != self.document.revision() or start < uniform_start or end > uniform_end:
+            return None
+        return style
+
+    def remember_style(self, change, undone):
+        style = change.style_after(undone)
+        self.uniform = None if style is None else (self.document.revision(), change.position, change.position + change.length, style)
+
+    def on_contents_change(self, position, removed, added):
+        if self.applying or not (removed or added):
+            return
+        if self.paused:
+            self.captured = None
+            return
+        if self.captured is None or self.captured[1] is None or not (self.captured[0] <= position and position + removed <= self.captured[0] + self.captured[1].length):
+            # What was there before is unknown, the steps before this change cannot be undone
+            self.clear()
+            return
+
+        # The captured range follows the change, so several changes of one edit can be taken from it
+        start, excerpt = self.captured
+        old = excerpt.slice(position - start, position - start + removed)
+        if added >= compress_size:
+            # What replaced it is only read if the step is undone, the document holds it until then
+            change = Change(position, old, None, added)
+            self.captured = (start, None)
+        else:
+            new = read_excerpt(self.document, position, position + added)
+            change = Change(position, old, new)
+            self.captured = (start, excerpt.splice(position - start, position - start + removed, new))
+        self.add_change(change)
+
+    def add_change(self, change):
+        if self.step is None:
+            self.step = UndoStep(next(self.step_ids), self.captured_typing)
+            self.step_timer.start()
+        self.step.changes.append(change)
+
+    def close_step(self):
+        # The changes of one turn of the event loop are one step
+        self.step_timer.stop()
+        step, self.step = self.step, None
+        if step is None:
+            return
+        self.captured = None
+        for change in step.changes:
+            change.pack()
+        self.memory -= sum(redo_step.size for redo_step in self.redo_steps)
+        self.redo_steps = []
+        if not self.join_typing(step):
+            self.undo_steps.append(step)
+            self.memory += step.size
+        self.trim()
+        self.changed.emit()
+
+    def join_typing(self, step):
+        # Inserting right after the previous keystroke or deleting next to it adds to the previous step, until a new word starts
+        previous = self.undo_steps[-1] if self.undo_steps else None
+        if (previous is None or not (previous.typing and step.typing) or previous.step_id == self.clean_state
+                or len(previous.changes) != 1 or len(step.changes) != 1 or step.time - previous.time > coalesce_interval):
+            return False
+        last, change = previous.changes[0], step.changes[0]
+        if any(excerpt is None or isinstance(excerpt, PackedExcerpt) for excerpt in (last.old, last.new, change.old, change.new)):
+            return False
+
+        if not last.old.length and not change.old.length and change.position == last.position + last.new.length:
+            if last.new.text[-1:].isspace() and not change.new.text[:1].isspace():
+                return False
+            joined = Change(last.position, last.old, last.new.splice(last.new.length, last.new.length, change.new))
+        elif not last.new.length and not change.new.length and change.position + change.old.length == last.position:
+            joined = Change(change.position, change.old.splice(change.old.length, change.old.length, last.old), last.new) # Backspace
+        elif not last.new.length and not change.new.length and change.position == last.position:
+            joined = Change(last.position, last.old.splice(last.old.length, last.old.length, change.old), last.new) # Delete
+        else:
+            return False
+        self.memory += joined.size - last.size
+        previous.changes[0] = joined
+        previous.time = step.time
+        return True
+
+    def trim(self):
+        # The oldest steps go first, then the redo steps furthest away
+        while self.memory > self.memory_limit and (self.undo_steps or self.redo_steps):
+            if self.undo_steps:
+                step = self.undo_steps.pop(0)
+                self.base_state = step.step_id
+            else:
+                step = self.redo_steps.pop(0)
+            self.memory -= step.size
+
+    def clear(self):
+        self.step_timer.stop()
+        self.step = None
+        self.captured = None
+        self.undo_steps = []
+        self.redo_steps = []
+        self.memory = 0
+        self.base_state = next(self.step_ids)
+        if self.document is not None and not self.document.isModified():
+            self.clean_state = self.base_state
+        self.changed.emit()
+
+    def on_modification_changed(self, modified):
+        if not modified:
+            self.close_step()
+            self.clean_state = self.state()
+
+    def undo(self):
+        self.close_step()
+        if not self.undo_steps:
+            return False
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        size = step.size
+        self.apply(step.changes, undone=True)
+        self.memory += step.size - size
+        self.trim()
+        self.changed.emit()
+        return True
+
+    def redo(self):
+        self.close_step()
+        if not self.redo_steps:
+            return False
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        self.apply(step.changes, undone=False)
+        self.changed.emit()
+        return True
+
+    def apply(self, changes, undone):
+        # The changes of a step as one edit, last to first when it is undone. A change
+        # whose new text was not read yet reads it from the document as the changes
+        # after it left it
+        cursor = TextCursor(self.document)
+        ordered = list(reversed(changes)) if undone else changes
+        operations = None
+        if all(isinstance(change, FormatChange) for change in ordered):
+            operations = [operation for change in ordered for operation in change.operations(undone)]
+        self.applying = True
+        try:
+            with self.journaling(operations):
+                cursor.beginEditBlock()
+                for change in ordered:
+                    position, length = change.undo(cursor) if undone else change.redo(cursor)
+                cursor.endEditBlock()
+        finally:
+            self.applying = False
+        self.document.setModified(self.state() != self.clean_state)
+        if len(changes) == 1 and isinstance(changes[0], FormatChange):
+            self.remember_style(changes[0], undone)
+
+        if self.view is not None and self.view.document() is self.document:
+            cursor.setPosition(min(position + length, self.document.characterCount() - 1))
+            self.view.setTextCursor(cursor)
+            self.view.ensureCursorVisible()
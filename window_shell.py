@@ -0,0 +1,218 @@
+"""Frameless window chrome: a title bar, dragging by it and resizing by the window's edges.
+
+A press on the title bar or an edge hands the move or resize to the window
+manager with startSystemMove()/startSystemResize(), which moves the window
+without any mouse events reaching the editor. Where the platform does not
+support that, the window follows the mouse itself: mouse moves only record the
+geometry wanted, and a timer applies the latest one once per display refresh,
+so a high-rate mouse does not set the geometry and lay the window out several
+times per frame.
+
+The time between applied updates, the time each took and the number of mouse
+moves folded into each are recorded in `metrics` as "window: ..." measurements,
+shown in the Performance panel.
+"""
+import time
+from PySide6.QtCore import QObject, QEvent, QTimer, QRect, Qt
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QLabel, QPushButton
+from instrumentation import metrics
+
+resize_margin = 5 # pixels along each edge that resize the window
+minimum_size = 100 # pixels, the smallest width and height a resize leaves
+default_refresh_rate = 60.0 # Hz, used when the screen does not report its own
+edge_cursors = {
+    Qt.LeftEdge: Qt.SizeHorCursor,
+    Qt.RightEdge: Qt.SizeHorCursor,
+    Qt.TopEdge: Qt.SizeVerCursor,
+    Qt.BottomEdge: Qt.SizeVerCursor,
+    Qt.TopEdge | Qt.LeftEdge: Qt.SizeFDiagCursor,
+    Qt.BottomEdge | Qt.RightEdge: Qt.SizeFDiagCursor,
+    Qt.TopEdge | Qt.RightEdge: Qt.SizeBDiagCursor,
+    Qt.BottomEdge | Qt.LeftEdge: Qt.SizeBDiagCursor,
+}
+
+
+def edges_at(rect, pos, margin=resize_margin):
+    """The edges of `rect` that `pos` is within `margin` of, Qt.Edge(0) for none."""
+    edges = Qt.Edge(0)
+    if pos.x() < margin:
+        edges |= Qt.LeftEdge
+    elif pos.x() >= rect.width() - margin:
+        edges |= Qt.RightEdge
+    if pos.y() < margin:
+        edges |= Qt.TopEdge
+    elif pos.y() >= rect.height() - margin:
+        edges |= Qt.BottomEdge
+    return edges
+
+
+def resized_geometry(geometry, edges, dx, dy):
+    """`geometry` with the given edges moved by (dx, dy), no smaller than minimum_size."""
+    geometry = QRect(geometry)
+    if edges & Qt.LeftEdge:
+        geometry.setLeft(min(geometry.left() + dx, geometry.right() + 1 - minimum_size))
+    elif edges & Qt.RightEdge:
+        geometry.setRight(max(geometry.right() + dx, geometry.left() - 1 + minimum_size))
+    if edges & Qt.TopEdge:
+        geometry.setTop(min(geometry.top() + dy, geometry.bottom() + 1 - minimum_size))
+    elif edges & Qt.BottomEdge:
+        geometry.setBottom(max(geometry.bottom() + dy, geometry.top() - 1 + minimum_size))
+    return geometry
+
+
+class TitleBar(QWidget):
+    """Title, close, minimize and maximize/restore buttons for a frameless window.
+
+    Double-clicking it maximizes or restores the window.
+    """
+
+    def __init__(self, window, parent=None):
+        super().__init__(parent)
+        self.window_widget = window
+        layout = QHBoxLayout(self)
+
+        self.title_label = QLabel(window.windowTitle(), self)
+        self.title_label.setStyleSheet("font-weight: bold; font-size: 14px;")
+        layout.addWidget(self.title_label)
+        layout.addStretch()
+        window.windowTitleChanged.connect(self.title_label.setText)
+
+        close_button = self.add_button("✖", "red", window.close)
+        minimize_button = self.add_button("_", "gray", window.showMinimized)
+        self.maximize_button = self.add_button("⬜", "gray", self.toggle_maximize_restore)
+        for button in (close_button, minimize_button, self.maximize_button):
+            layout.addWidget(button)
+        window.installEventFilter(self)
+
+    def add_button(self, text, background, slot):
+        button = QPushButton(text, self)
+        button.setFixedSize(30, 30)
+        button.setStyleSheet(f"background: {background}; color: white; border: none;")
+        button.clicked.connect(slot)
+        return button
+
+    def toggle_maximize_restore(self):
+        if self.window_widget.isMaximized():
+            self.window_widget.showNormal()
+        else:
+            self.window_widget.showMaximized()
+
+    def mouseDoubleClickEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.toggle_maximize_restore()
+            event.accept()
+
+    def eventFilter(self, watched, event):
+        # The button follows the window state, however it was maximized or restored
+        if watched is self.window_widget and event.type() == QEvent.WindowStateChange:
+            self.maximize_button.setText("❐" if self.window_widget.isMaximized() else "⬜")
+        return False
+
+
+class WindowShell(QObject):
+    """Makes `window` frameless, moved by dragging `title_bar` and resized by dragging its edges.
+
+    The window's contents margins are set to the resize margin, so the edges
+    belong to the window itself and not to the widgets inside it. Only moves
+    over that strip are tracked for the cursor shape, which is set again only
+    when the edge under the mouse changes.
+    """
+
+    def __init__(self, window, title_bar=None, margin=resize_margin):
+        super().__init__(window)
+        self.window = window
+        self.title_bar = title_bar
+        self.margin = margin
+        window.setWindowFlags(window.windowFlags() | Qt.FramelessWindowHint)
+        window.setContentsMargins(margin, margin, margin, margin)
+        window.setMouseTracking(True)
+        window.installEventFilter(self)
+        if title_bar is not None:
+            title_bar.installEventFilter(self)
+
+        self.hover_edges = Qt.Edge(0)
+        self.edges = Qt.Edge(0) # of a resize the shell runs itself, none for a move
+        self.dragging = False
+        self.start_position = None # global mouse position at the press
+        self.start_geometry = None
+        self.pending_geometry = None # latest geometry asked for, applied by the frame timer
+        self.coalesced = 0 # mouse moves since the last applied update
+        self.last_frame = None
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.apply_geometry)
+
+    def eventFilter(self, watched, event):
+        event_type = event.type()
+        if event_type == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            return self.on_press(watched, event)
+        if event_type == QEvent.MouseMove:
+            if self.dragging:
+                self.on_drag(event.globalPosition().toPoint())
+                return True
+            if watched is self.window and not event.buttons():
+                self.update_cursor(edges_at(self.window.rect(), event.position().toPoint(), self.margin))
+        elif event_type == QEvent.MouseButtonRelease and self.dragging and event.button() == Qt.LeftButton:
+            self.dragging = False
+            self.frame_timer.stop()
+            self.apply_geometry()
+            return True
+        elif event_type == QEvent.Leave and watched is self.window and not self.dragging:
+            self.update_cursor(Qt.Edge(0))
+        return False
+
+    def on_press(self, watched, event):
+        if self.window.isMaximized() or self.window.isFullScreen():
+            return False
+        edges = edges_at(self.window.rect(), event.position().toPoint(), self.margin) if watched is self.window else Qt.Edge(0)
+        if not edges and watched is not self.title_bar:
+            return False
+        handle = self.window.windowHandle()
+        if handle is not None and (handle.startSystemResize(edges) if edges else handle.startSystemMove()):
+            metrics.record("window: system " + ("resize" if edges else "move"), 1, "count")
+            return True
+
+        # Followed by hand, one geometry update per frame
+        self.dragging = True
+        self.edges = edges
+        self.start_position = event.globalPosition().toPoint()
+        self.start_geometry = self.window.geometry()
+        self.last_frame = None
+        refresh_rate = self.window.screen().refreshRate() or default_refresh_rate
+        self.frame_timer.setInterval(max(1, round(1000 / refresh_rate)))
+        return True
+
+    def on_drag(self, global_position):
+        delta = global_position - self.start_position
+        if self.edges:
+            self.pending_geometry = resized_geometry(self.start_geometry, self.edges, delta.x(), delta.y())
+        else:
+            self.pending_geometry = self.start_geometry.translated(delta)
+        self.coalesced += 1
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def apply_geometry(self):
+        if self.pending_geometry is None:
+            return
+        started = time.perf_counter()
+        if self.last_frame is not None:
+            metrics.record("window: frame interval", started - self.last_frame)
+        metrics.record("window: moves per frame", self.coalesced, "count")
+        geometry, self.pending_geometry, self.coalesced = self.pending_geometry, None, 0
+        if self.edges:
+            self.window.setGeometry(geometry)
+        else:
+            self.window.move(geometry.topLeft()) # a move needs no new layout
+        self.last_frame = time.perf_counter()
+        metrics.record("window: geometry update", self.last_frame - started)
+
+    def update_cursor(self, edges):
+        if edges == self.hover_edges:
+            return
+        self.hover_edges = edges
+        if edges:
+            self.window.setCursor(edge_cursors[edges])
+        else:
+            self.window.unsetCursor()